@@ -0,0 +1,345 @@
+# Banco de pruebas de carga para la venta de boletos
+#
+# Lanza compradores simulados (HiloSimuladorComprasConcurrentes) en varios hilos y
+# procesos contra una base nueva, con llegadas constantes, de Poisson o en ráfaga
+# (apertura de una venta muy esperada), y reporta rendimiento, latencias, espera
+# de locks, sobreventa y errores de contención de SQLite en un JSON comparable.
+#
+#   python benchmark_compras.py --hilos 8 --procesos 2 --duracion 20 --tasa 400 --llegadas poisson
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime
+
+from capa_datos import (
+    ColaVentasPendientes,
+    HiloProcesadorVentas,
+    HiloSimuladorComprasConcurrentes,
+    RepositorioEventos,
+    configurar_base_datos,
+    obtener_pool,
+)
+from capa_logica import ControlAdmision, CoordinadorCompras, GestorVentas, PoolProcesosCompras
+from metricas import metricas
+
+
+LLEGADAS = ("constante", "poisson", "rafaga")
+
+
+class CompradorSimulado(HiloSimuladorComprasConcurrentes):
+    """Comprador del banco de pruebas.
+
+    Reutiliza el simulador del sistema cambiando sólo cuándo se compra
+    (esperar_siguiente), qué evento se elige (elegir_evento, con sesgo de
+    popularidad) y qué se registra de cada intento. Con tasa 0 compra sin
+    pausas (lazo cerrado); con tasa > 0 las llegadas siguen un calendario
+    propio, y si el sistema se atrasa el siguiente intento sale de inmediato.
+    """
+
+    def __init__(self, gestor_ventas, coordinador, opciones, pesos: dict, semilla: int, inicio: float):
+        super().__init__(
+            gestor_ventas,
+            coordinador=coordinador,
+            cantidad_max=opciones.cantidad_max,
+            omitir_agotados=False,
+            semilla=semilla
+        )
+        self.tasa = opciones.tasa / max(1, opciones.hilos * opciones.procesos)
+        self.llegadas = opciones.llegadas
+        self.factor_rafaga = opciones.factor_rafaga
+        self.inicio = inicio
+        self.fin_rafaga = inicio + opciones.duracion * opciones.fraccion_rafaga
+        self.fin = inicio + opciones.duracion
+        self.siguiente = inicio
+        self.pesos = pesos
+        self.latencias = []
+        self.esperas_lock = []
+        self.resultados = Counter()
+        self.errores_bd = Counter()
+
+    def esperar_siguiente(self) -> None:
+        if self.tasa <= 0:
+            return
+        tasa = self.tasa
+        if self.llegadas == "rafaga" and self.siguiente < self.fin_rafaga:
+            tasa *= self.factor_rafaga
+        if self.llegadas == "constante":
+            self.siguiente += 1.0 / tasa
+        else:
+            self.siguiente += self.aleatorio.expovariate(tasa)
+        pausa = self.siguiente - time.perf_counter()
+        if pausa > 0:
+            time.sleep(pausa)
+
+    def elegir_evento(self, eventos):
+        return self.aleatorio.choices(eventos, [self.pesos.get(evento.id, 0.0) for evento in eventos])[0]
+
+    def run(self):
+        while self.activo and time.perf_counter() < self.fin:
+            self.esperar_siguiente()
+            if time.perf_counter() >= self.fin:
+                break
+            comienzo = time.perf_counter()
+            try:
+                resultado = self.intentar_compra()
+            except sqlite3.OperationalError as error:
+                # "database is locked" y similares: contención entre escritores
+                self.errores_bd[str(error)] += 1
+                self.resultados["error_bd"] += 1
+                continue
+            except Exception as error:
+                self.resultados[f"error: {type(error).__name__}"] += 1
+                continue
+            self.latencias.append((time.perf_counter() - comienzo) * 1000)
+            if resultado is None:
+                self.resultados["sin_eventos"] += 1
+                continue
+            exito, mensaje = resultado
+            self.esperas_lock.append(getattr(resultado, "espera_lock", 0.0) * 1000)
+            if exito:
+                self.resultados["exitosas"] += 1
+            elif getattr(resultado, "reintentar", False):
+                self.resultados["ocupado"] += 1
+            elif mensaje.startswith("Sólo quedan"):
+                self.resultados["sin_stock"] += 1
+            else:
+                self.resultados["rechazadas"] += 1
+
+
+def pesos_popularidad(ids: list, zipf: float) -> dict:
+    #Peso 1/rango^s: con s=0 todos los eventos son igual de populares
+    return {evento_id: 1.0 / (rango ** zipf) for rango, evento_id in enumerate(sorted(ids), start=1)}
+
+
+def preparar_base(opciones) -> list:
+    #Crea una base nueva con los eventos del banco de pruebas y devuelve sus ids
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(opciones.base + sufijo):
+            os.remove(opciones.base + sufijo)
+    configurar_base_datos(opciones.base)
+    repositorio = RepositorioEventos()
+    filas = [
+        (f"Evento {numero}", "2030-01-01", "Estadio", 100.0, opciones.capacidad)
+        for numero in range(1, opciones.eventos + 1)
+    ]
+    with repositorio.pool.transaccion():
+        repositorio.insertar_eventos(filas)
+    return [evento.id for evento in repositorio.listar_eventos()]
+
+
+def ejecutar_proceso(indice: int, opciones, pesos: dict, inicio_reloj: float) -> dict:
+    """Corre los compradores de un proceso y devuelve sus mediciones crudas.
+
+    Es una función de módulo para poder usarse como destino de
+    multiprocessing. Cada proceso abre su propio pool, cache y (con
+    --diferido) su propia cola de ventas con un diario separado.
+    """
+    configurar_base_datos(opciones.base)
+    metricas.reiniciar()
+    cola = procesador = None
+    if opciones.diferido:
+        cola = ColaVentasPendientes(ruta_diario=f"{opciones.base}.{indice}.log")
+        procesador = HiloProcesadorVentas(cola)
+        procesador.start()
+    gestor_ventas = GestorVentas(cola)
+    pool_compras = None
+    if opciones.trabajadores:
+        #Los compradores de este proceso sólo encolan; venden los procesos de trabajo
+        pool_compras = coordinador = PoolProcesosCompras(opciones.trabajadores, opciones.base)
+        pool_compras.iniciar()
+    elif opciones.sin_coordinador:
+        coordinador = None
+    else:
+        coordinador = CoordinadorCompras(gestor_ventas)
+    if opciones.admision and coordinador is not None:
+        coordinador = ControlAdmision(
+            coordinador, max_en_curso=opciones.admision,
+            tasa_evento=opciones.tasa_evento or None, tasa_cliente=opciones.tasa_cliente or None
+        )
+
+    # Todos los procesos comparten el mismo instante de arranque (reloj de pared)
+    espera = inicio_reloj - time.time()
+    if espera > 0:
+        time.sleep(espera)
+    inicio = time.perf_counter()
+    compradores = [
+        CompradorSimulado(gestor_ventas, coordinador, opciones, pesos, opciones.semilla + indice * 1000 + numero, inicio)
+        for numero in range(opciones.hilos)
+    ]
+    for comprador in compradores:
+        comprador.start()
+    for comprador in compradores:
+        comprador.join()
+    transcurrido = time.perf_counter() - inicio
+
+    if procesador is not None:
+        procesador.detener()
+        cola.cerrar()
+    if pool_compras is not None:
+        pool_compras.detener()
+
+    resultados = Counter()
+    errores_bd = Counter()
+    latencias, esperas_lock = [], []
+    for comprador in compradores:
+        resultados.update(comprador.resultados)
+        errores_bd.update(comprador.errores_bd)
+        latencias.extend(comprador.latencias)
+        esperas_lock.extend(comprador.esperas_lock)
+    return {
+        "resultados": dict(resultados),
+        "errores_bd": dict(errores_bd),
+        "latencias": latencias,
+        "esperas_lock": esperas_lock,
+        "segundos": transcurrido,
+        "metricas": metricas.instantanea()["histogramas"],
+        "admision": coordinador.estado() if isinstance(coordinador, ControlAdmision) else None,
+    }
+
+
+def _proceso_hijo(indice, opciones, pesos, inicio_reloj, salida):
+    salida.put((indice, ejecutar_proceso(indice, opciones, pesos, inicio_reloj)))
+
+
+def percentiles(valores: list) -> dict:
+    valores = sorted(valores)
+    def percentil(p):
+        return round(valores[min(len(valores) - 1, int(p * len(valores)))], 3) if valores else 0.0
+    return {
+        "p50": percentil(0.50),
+        "p95": percentil(0.95),
+        "p99": percentil(0.99),
+        "max": round(valores[-1], 3) if valores else 0.0,
+        "media": round(sum(valores) / len(valores), 3) if valores else 0.0,
+    }
+
+
+def verificar_sobreventa(ruta: str) -> dict:
+    #Compara contadores, capacidad y ventas registradas una vez terminada la carga
+    conexion = obtener_pool(ruta).obtener()
+    sobrevendidos = conexion.execute("""
+        SELECT COUNT(*), COALESCE(SUM(boletos_vendidos - boletos_disponibles), 0)
+        FROM eventos WHERE boletos_vendidos > boletos_disponibles
+    """).fetchone()
+    descuadres = conexion.execute("""
+        SELECT COUNT(*) FROM eventos e
+        WHERE e.boletos_vendidos <> (
+            SELECT COALESCE(SUM(v.cantidad_boletos), 0) FROM ventas v WHERE v.evento_id = e.id
+        )
+    """).fetchone()[0]
+    vendidos, ventas = conexion.execute("""
+        SELECT (SELECT COALESCE(SUM(boletos_vendidos), 0) FROM eventos),
+               (SELECT COUNT(*) FROM ventas)
+    """).fetchone()
+    return {
+        "eventos_sobrevendidos": sobrevendidos[0],
+        "boletos_sobrevendidos": sobrevendidos[1],
+        "eventos_descuadrados": descuadres,
+        "boletos_vendidos": vendidos,
+        "ventas_registradas": ventas,
+    }
+
+
+def ejecutar(opciones) -> dict:
+    ids = preparar_base(opciones)
+    pesos = pesos_popularidad(ids, opciones.zipf)
+
+    if opciones.procesos <= 1:
+        parciales = [ejecutar_proceso(0, opciones, pesos, time.time())]
+    else:
+        # Margen para que todos los procesos arranquen antes de empezar a comprar
+        inicio_reloj = time.time() + 1.0
+        salida = multiprocessing.Queue()
+        procesos = [
+            multiprocessing.Process(target=_proceso_hijo, args=(indice, opciones, pesos, inicio_reloj, salida))
+            for indice in range(opciones.procesos)
+        ]
+        for proceso in procesos:
+            proceso.start()
+        # Leer antes de join: un hijo no termina hasta vaciar su parte de la cola
+        parciales = [salida.get()[1] for _ in procesos]
+        for proceso in procesos:
+            proceso.join()
+
+    resultados = Counter()
+    errores_bd = Counter()
+    latencias, esperas_lock = [], []
+    for parcial in parciales:
+        resultados.update(parcial["resultados"])
+        errores_bd.update(parcial["errores_bd"])
+        latencias.extend(parcial["latencias"])
+        esperas_lock.extend(parcial["esperas_lock"])
+    segundos = max(parcial["segundos"] for parcial in parciales)
+    intentos = sum(resultados.values())
+
+    return {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "configuracion": {
+            clave: valor for clave, valor in vars(opciones).items() if clave != "salida"
+        },
+        "entorno": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "cpus": os.cpu_count(),
+        },
+        "segundos": round(segundos, 3),
+        "intentos": intentos,
+        "resultados": dict(resultados),
+        "rendimiento": {
+            "intentos_por_segundo": round(intentos / segundos, 1) if segundos else 0.0,
+            "ventas_por_segundo": round(resultados["exitosas"] / segundos, 1) if segundos else 0.0,
+        },
+        "latencia_ms": percentiles(latencias),
+        "espera_lock_ms": percentiles(esperas_lock),
+        "errores_bd": {"total": sum(errores_bd.values()), "detalle": dict(errores_bd)},
+        "consistencia": verificar_sobreventa(opciones.base),
+        "metricas_por_proceso": [parcial["metricas"] for parcial in parciales],
+        "admision_por_proceso": [parcial["admision"] for parcial in parciales],
+    }
+
+
+def leer_opciones(argumentos=None):
+    parser = argparse.ArgumentParser(description="Banco de pruebas de compras concurrentes")
+    parser.add_argument("--hilos", type=int, default=8, help="compradores por proceso")
+    parser.add_argument("--procesos", type=int, default=1, help="procesos con compradores")
+    parser.add_argument("--duracion", type=float, default=10.0, help="segundos de carga")
+    parser.add_argument("--tasa", type=float, default=0.0, help="intentos por segundo en total (0 = sin pausas)")
+    parser.add_argument("--llegadas", choices=LLEGADAS, default="poisson")
+    parser.add_argument("--factor-rafaga", type=float, default=10.0, help="multiplicador de la tasa durante la ráfaga")
+    parser.add_argument("--fraccion-rafaga", type=float, default=0.2, help="parte inicial de la duración en ráfaga")
+    parser.add_argument("--eventos", type=int, default=20)
+    parser.add_argument("--capacidad", type=int, default=5000, help="boletos por evento")
+    parser.add_argument("--cantidad-max", type=int, default=4, help="boletos por compra (1..N)")
+    parser.add_argument("--zipf", type=float, default=1.0, help="sesgo de popularidad (0 = uniforme)")
+    parser.add_argument("--diferido", action="store_true", help="registrar ventas por la ColaVentasPendientes")
+    parser.add_argument("--trabajadores", type=int, default=0, help="vender con PoolProcesosCompras de N procesos")
+    parser.add_argument("--sin-coordinador", action="store_true", help="llamar a GestorVentas sin CoordinadorCompras")
+    parser.add_argument("--admision", type=int, default=0, help="compras simultáneas del ControlAdmision (0 = sin sala de espera)")
+    parser.add_argument("--tasa-evento", type=float, default=0.0, help="límite de pedidos/s por evento (0 = sin límite)")
+    parser.add_argument("--tasa-cliente", type=float, default=0.0, help="límite de pedidos/s por gmail (0 = sin límite)")
+    parser.add_argument("--semilla", type=int, default=12345)
+    parser.add_argument("--base", default="benchmark.db", help="base de datos descartable del banco de pruebas")
+    parser.add_argument("--salida", default=None, help="archivo JSON de resultados")
+    return parser.parse_args(argumentos)
+
+
+def main():
+    opciones = leer_opciones()
+    if os.path.abspath(opciones.base) == os.path.abspath(RepositorioEventos.DB):
+        raise SystemExit("El banco de pruebas recrea la base: use una distinta de la del sistema")
+    resultado = ejecutar(opciones)
+    texto = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if opciones.salida:
+        with open(opciones.salida, "w", encoding="utf-8") as archivo:
+            archivo.write(texto)
+    print(texto)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,36 @@ import sqlite3
 import threading
 import multiprocessing
 import time
+import glob
 import shutil
-from datetime import datetime
-from typing import List
+import gzip
+import lzma
+import hashlib
+import heapq
+import bisect
+import queue
+import random
+import os
+import json
+from array import array
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from typing import Iterator, List
 
+from metricas import metricas, servir_http
+
+
+#Evento y Venta usan __slots__: sin __dict__ por instancia, cada objeto ocupa menos de la
+#mitad y se crea más rápido, lo que importa al listar historiales grandes. Para análisis
+#sobre muchas ventas, RepositorioVentas.columnas_ventas evita crear un objeto por fila.
 
 class Evento:
+    __slots__ = (
+        "id", "nombre", "fecha", "lugar", "precio",
+        "boletos_disponibles", "boletos_vendidos", "boletos_retenidos"
+    )
+
     def __init__(
         self,
         id: int,
@@ -18,7 +42,8 @@ class Evento:
         lugar: str,
         precio: float,
         boletos_disponibles: int,
-        boletos_vendidos: int = 0
+        boletos_vendidos: int = 0,
+        boletos_retenidos: int = 0
     ):
         self.id = id
         self.nombre = nombre
@@ -27,9 +52,23 @@ class Evento:
         self.precio = precio
         self.boletos_disponibles = boletos_disponibles
         self.boletos_vendidos = boletos_vendidos
+        #Boletos apartados por reservas pendientes de confirmar (ver GestorReservas)
+        self.boletos_retenidos = boletos_retenidos
+
+    @property
+    def restantes(self) -> int:
+        return self.boletos_disponibles - self.boletos_vendidos - self.boletos_retenidos
+
+    def copiar(self) -> "Evento":
+        return Evento(
+            self.id, self.nombre, self.fecha, self.lugar, self.precio,
+            self.boletos_disponibles, self.boletos_vendidos, self.boletos_retenidos
+        )
 
 
 class Venta:
+    __slots__ = ("id", "evento_id", "cliente", "gmail", "cantidad_boletos", "total", "fecha_venta")
+
     def __init__(
         self,
         id: int,
@@ -49,27 +88,418 @@ class Venta:
         self.fecha_venta = fecha_venta
 
 
+class PoolConexiones:
+    #Pool de conexiones SQLite compartido: una conexión persistente por hilo de trabajo.
+    #Cada conexión se abre una sola vez con WAL y pragmas ajustados, reutiliza las
+    #sentencias preparadas (cached_statements) y se verifica antes de reutilizarla
+    #si estuvo inactiva mucho tiempo.
+
+    PRAGMAS = (
+        #Sólo tiene efecto en una base nueva o en el próximo VACUUM (ver ServicioMantenimiento)
+        "PRAGMA auto_vacuum=INCREMENTAL",
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=-16000",
+        "PRAGMA mmap_size=268435456",
+        "PRAGMA temp_store=MEMORY",
+    )
+
+    def __init__(
+        self,
+        ruta: str,
+        max_conexiones: int = 32,
+        timeout: float = 10.0,
+        intervalo_verificacion: float = 30.0,
+        sentencias_en_cache: int = 256
+    ):
+        self.ruta = ruta
+        self.max_conexiones = max_conexiones
+        self.timeout = timeout
+        self.intervalo_verificacion = intervalo_verificacion
+        self.sentencias_en_cache = sentencias_en_cache
+        self._local = threading.local()
+        self._conexiones = {}
+        self._condicion = threading.Condition()
+        #Transacciones de escritura confirmadas por este pool (ver InventarioCache)
+        self.escrituras = 0
+
+    def _crear_conexion(self) -> sqlite3.Connection:
+        #isolation_level=None deja las transacciones en manos de transaccion()
+        conexion = sqlite3.connect(
+            self.ruta,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.sentencias_en_cache
+        )
+        for pragma in self.PRAGMAS:
+            conexion.execute(pragma)
+        return conexion
+
+    def _esta_sana(self, conexion: sqlite3.Connection) -> bool:
+        try:
+            conexion.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _recuperar_conexiones_huerfanas(self) -> None:
+        #Cierra las conexiones de hilos que ya terminaron (se llama con la condición tomada)
+        for ident, (hilo, conexion) in list(self._conexiones.items()):
+            if not hilo.is_alive():
+                del self._conexiones[ident]
+                conexion.close()
+
+    def _registrar_conexion(self) -> sqlite3.Connection:
+        limite = time.monotonic() + self.timeout
+        with self._condicion:
+            while len(self._conexiones) >= self.max_conexiones:
+                self._recuperar_conexiones_huerfanas()
+                if len(self._conexiones) < self.max_conexiones:
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    raise sqlite3.OperationalError("Pool de conexiones agotado")
+                self._condicion.wait(restante)
+            conexion = self._crear_conexion()
+            self._conexiones[threading.get_ident()] = (threading.current_thread(), conexion)
+        self._local.conexion = conexion
+        return conexion
+
+    def obtener(self) -> sqlite3.Connection:
+        #Devuelve la conexión del hilo actual, creándola o reemplazándola si hace falta
+        conexion = getattr(self._local, "conexion", None)
+        ahora = time.monotonic()
+        if conexion is not None and ahora - self._local.ultimo_uso > self.intervalo_verificacion:
+            if not self._esta_sana(conexion):
+                self.liberar()
+                conexion = None
+        if conexion is None:
+            conexion = self._registrar_conexion()
+        self._local.ultimo_uso = ahora
+        return conexion
+
+    @contextmanager
+    def transaccion(self, inmediata: bool = True):
+        #Transacción explícita; las transacciones anidadas se integran en la exterior
+        conexion = self.obtener()
+        if conexion.in_transaction:
+            yield conexion
+            return
+        inicio = time.perf_counter()
+        try:
+            conexion.execute("BEGIN IMMEDIATE" if inmediata else "BEGIN")
+        except sqlite3.OperationalError:
+            #Otro escritor retuvo la base más que el timeout de la conexión
+            metricas.incrementar("bd.bloqueada")
+            raise
+        metricas.observar("bd.espera_begin", (time.perf_counter() - inicio) * 1000)
+        try:
+            yield conexion
+        except BaseException:
+            conexion.rollback()
+            metricas.incrementar("bd.rollbacks")
+            raise
+        else:
+            conexion.commit()
+            if inmediata:
+                self.escrituras += 1
+        finally:
+            metricas.observar("bd.transaccion", (time.perf_counter() - inicio) * 1000)
+
+    def liberar(self) -> None:
+        #Cierra la conexión del hilo actual y libera su lugar en el pool
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            return
+        self._local.conexion = None
+        with self._condicion:
+            self._conexiones.pop(threading.get_ident(), None)
+            self._condicion.notify()
+        conexion.close()
+
+    def cerrar_todas(self) -> None:
+        with self._condicion:
+            for _, conexion in self._conexiones.values():
+                conexion.close()
+            self._conexiones.clear()
+            self._condicion.notify_all()
+        self._local = threading.local()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_esquemas_listos = set()
+
+
+def configurar_base_datos(ruta: str) -> None:
+    #Apunta todos los repositorios a otra base (benchmarks, procesos de trabajo, pruebas).
+    #Tienen que compartir la base: las ventas con asientos o retenciones escriben en
+    #varias tablas dentro de una misma transacción del pool
+    for repositorio in (
+        RepositorioEventos,
+        RepositorioVentas,
+        RepositorioAsientos,
+        RepositorioRetenciones,
+        RepositorioReportes
+    ):
+        repositorio.DB = ruta
+
+
+def obtener_pool(ruta: str) -> PoolConexiones:
+    #Un pool por base de datos y por proceso (las conexiones no sobreviven a un fork)
+    clave = (os.getpid(), ruta)
+    pool = _pools.get(clave)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(clave)
+            if pool is None:
+                pool = _pools[clave] = PoolConexiones(ruta)
+                metricas.registrar_medidor(f"bd.conexiones.{os.path.basename(ruta)}", lambda: len(pool._conexiones))
+    return pool
+
+
+#Migraciones del esquema: la posición en la lista es la versión guardada en PRAGMA user_version
+MIGRACIONES = [
+    #1: esquema inicial
+    (
+        """
+        CREATE TABLE IF NOT EXISTS eventos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            lugar TEXT NOT NULL,
+            precio REAL NOT NULL,
+            boletos_disponibles INTEGER NOT NULL,
+            boletos_vendidos INTEGER DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ventas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            evento_id INTEGER NOT NULL,
+            cliente_nombre TEXT NOT NULL,
+            cliente_gmail TEXT NOT NULL,
+            cantidad_boletos INTEGER NOT NULL,
+            total REAL NOT NULL,
+            fecha_venta TEXT NOT NULL,
+            FOREIGN KEY (evento_id) REFERENCES eventos (id)
+        )
+        """,
+    ),
+    #2: índices para el historial ordenado y para las búsquedas/agregados por evento.
+    #El índice por evento es cubriente: SUM(cantidad_boletos) y SUM(total) no tocan la tabla
+    (
+        "CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas (fecha_venta, id)",
+        "CREATE INDEX IF NOT EXISTS idx_ventas_evento ON ventas (evento_id, cantidad_boletos, total)",
+        "ANALYZE",
+    ),
+    #3: resúmenes mantenidos al momento de la venta por un trigger, para que los reportes
+    #no dependan del tamaño del historial. Son acumulativos: no se descuentan si una venta
+    #sale de la tabla caliente
+    (
+        """
+        CREATE TABLE IF NOT EXISTS resumen_ventas_hora (
+            hora TEXT NOT NULL,
+            evento_id INTEGER NOT NULL,
+            ventas INTEGER NOT NULL,
+            boletos INTEGER NOT NULL,
+            ingresos REAL NOT NULL,
+            PRIMARY KEY (hora, evento_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS resumen_clientes (
+            cliente_gmail TEXT PRIMARY KEY,
+            ventas INTEGER NOT NULL,
+            boletos INTEGER NOT NULL,
+            ingresos REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_resumen_clientes_ingresos ON resumen_clientes (ingresos)",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_ventas_resumen AFTER INSERT ON ventas
+        BEGIN
+            INSERT INTO resumen_ventas_hora (hora, evento_id, ventas, boletos, ingresos)
+            VALUES (substr(NEW.fecha_venta, 1, 13), NEW.evento_id, 1, NEW.cantidad_boletos, NEW.total)
+            ON CONFLICT (hora, evento_id) DO UPDATE SET
+                ventas = ventas + 1,
+                boletos = boletos + excluded.boletos,
+                ingresos = ingresos + excluded.ingresos;
+            INSERT INTO resumen_clientes (cliente_gmail, ventas, boletos, ingresos)
+            VALUES (NEW.cliente_gmail, 1, NEW.cantidad_boletos, NEW.total)
+            ON CONFLICT (cliente_gmail) DO UPDATE SET
+                ventas = ventas + 1,
+                boletos = boletos + excluded.boletos,
+                ingresos = ingresos + excluded.ingresos;
+        END
+        """,
+        """
+        INSERT INTO resumen_ventas_hora (hora, evento_id, ventas, boletos, ingresos)
+        SELECT substr(fecha_venta, 1, 13), evento_id, COUNT(*), SUM(cantidad_boletos), SUM(total)
+        FROM ventas GROUP BY 1, 2
+        """,
+        """
+        INSERT INTO resumen_clientes (cliente_gmail, ventas, boletos, ingresos)
+        SELECT cliente_gmail, COUNT(*), SUM(cantidad_boletos), SUM(total)
+        FROM ventas GROUP BY 1
+        """,
+    ),
+    #4: última secuencia del diario de ventas pendientes ya volcada a la tabla ventas
+    (
+        """
+        CREATE TABLE IF NOT EXISTS estado_cola_ventas (
+            diario TEXT PRIMARY KEY,
+            ultima_secuencia INTEGER NOT NULL
+        )
+        """,
+    ),
+    #5: mapas de asientos (una fila de la sala por registro, ocupación como bits empaquetados)
+    #y la ubicación asignada en cada venta con asientos numerados
+    (
+        """
+        CREATE TABLE IF NOT EXISTS mapas_asientos (
+            evento_id INTEGER NOT NULL,
+            seccion TEXT NOT NULL,
+            fila TEXT NOT NULL,
+            prioridad INTEGER NOT NULL,
+            asientos INTEGER NOT NULL,
+            ocupados BLOB NOT NULL,
+            PRIMARY KEY (evento_id, seccion, fila),
+            FOREIGN KEY (evento_id) REFERENCES eventos(id)
+        ) WITHOUT ROWID
+        """,
+        "ALTER TABLE ventas ADD COLUMN asientos TEXT",
+    ),
+    #6: reservas con vencimiento. Los boletos retenidos cuentan como ocupados para la
+    #reserva condicional; cada retención guarda lo necesario para liberarla o confirmarla
+    (
+        "ALTER TABLE eventos ADD COLUMN boletos_retenidos INTEGER NOT NULL DEFAULT 0",
+        """
+        CREATE TABLE IF NOT EXISTS retenciones (
+            id INTEGER PRIMARY KEY,
+            evento_id INTEGER NOT NULL,
+            cantidad INTEGER NOT NULL,
+            vence REAL NOT NULL,
+            seccion TEXT,
+            fila TEXT,
+            mascara BLOB,
+            asientos TEXT,
+            FOREIGN KEY (evento_id) REFERENCES eventos(id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_retenciones_vence ON retenciones(vence)",
+    ),
+    #7: clave de idempotencia de las compras; el índice parcial sólo incluye las ventas
+    #que la traen y garantiza que la misma clave no se registre dos veces
+    (
+        "ALTER TABLE ventas ADD COLUMN clave_idempotencia TEXT",
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_ventas_clave_idempotencia
+        ON ventas(clave_idempotencia) WHERE clave_idempotencia IS NOT NULL
+        """,
+    ),
+    #8: archivo de ventas de eventos pasados (ver ServicioArchivoVentas). particiones_ventas
+    #lista los archivos por período; ventas_archivadas guarda los totales de cada evento
+    #archivado para no tener que abrir los archivos al sincronizar contadores
+    (
+        """
+        CREATE TABLE IF NOT EXISTS particiones_ventas (
+            periodo TEXT PRIMARY KEY,
+            archivo TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ventas_archivadas (
+            evento_id INTEGER PRIMARY KEY,
+            periodo TEXT NOT NULL,
+            ventas INTEGER NOT NULL,
+            boletos INTEGER NOT NULL,
+            ingresos REAL NOT NULL
+        )
+        """,
+    ),
+    #9: los ids de retenciones no se reutilizan (AUTOINCREMENT): la rueda de temporizadores
+    #y la clave de idempotencia de la confirmación se refieren a la retención por su id
+    (
+        """
+        CREATE TABLE retenciones_nueva (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            evento_id INTEGER NOT NULL,
+            cantidad INTEGER NOT NULL,
+            vence REAL NOT NULL,
+            seccion TEXT,
+            fila TEXT,
+            mascara BLOB,
+            asientos TEXT,
+            FOREIGN KEY (evento_id) REFERENCES eventos(id)
+        )
+        """,
+        """
+        INSERT INTO retenciones_nueva (id, evento_id, cantidad, vence, seccion, fila, mascara, asientos)
+        SELECT id, evento_id, cantidad, vence, seccion, fila, mascara, asientos FROM retenciones
+        """,
+        "DROP TABLE retenciones",
+        "ALTER TABLE retenciones_nueva RENAME TO retenciones",
+        "CREATE INDEX IF NOT EXISTS idx_retenciones_vence ON retenciones(vence)",
+    ),
+    #10: la secuencia de retenciones arranca después de todo id ya usado como clave de
+    #idempotencia ("retencion:<id>"), aunque la retención se haya borrado antes de la migración 9
+    (
+        """
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'retenciones', 0
+        WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'retenciones')
+        """,
+        """
+        UPDATE sqlite_sequence SET seq = MAX(seq, (
+            SELECT COALESCE(MAX(CAST(substr(clave_idempotencia, 11) AS INTEGER)), 0)
+            FROM ventas
+            WHERE clave_idempotencia >= 'retencion:' AND clave_idempotencia < 'retencion;'
+        ))
+        WHERE name = 'retenciones'
+        """,
+    ),
+]
+
+
+def migrar_esquema(conexion: sqlite3.Connection) -> int:
+    #Aplica las migraciones pendientes; devuelve la versión final del esquema
+    version = conexion.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(MIGRACIONES):
+        return version
+    conexion.execute("BEGIN IMMEDIATE")
+    try:
+        #Otro proceso pudo haber migrado mientras esperábamos el lock de escritura
+        version = conexion.execute("PRAGMA user_version").fetchone()[0]
+        for numero in range(version + 1, len(MIGRACIONES) + 1):
+            for sentencia in MIGRACIONES[numero - 1]:
+                conexion.execute(sentencia)
+            conexion.execute(f"PRAGMA user_version = {numero}")
+    except BaseException:
+        conexion.rollback()
+        raise
+    conexion.commit()
+    return len(MIGRACIONES)
+
+
+def inicializar_esquema(ruta: str) -> None:
+    #Migra el esquema una sola vez por base de datos en lugar de en cada repositorio
+    if ruta in _esquemas_listos:
+        return
+    with _pools_lock:
+        if ruta in _esquemas_listos:
+            return
+        migrar_esquema(obtener_pool(ruta).obtener())
+        _esquemas_listos.add(ruta)
+
+
 class RepositorioEventos:
     DB = "entradas.db"
 
     def __init__(self):
-        self._inicializar_bd()
-
-    def _inicializar_bd(self) -> None:
-        with sqlite3.connect(self.DB) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS eventos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nombre TEXT NOT NULL,
-                    fecha TEXT NOT NULL,
-                    lugar TEXT NOT NULL,
-                    precio REAL NOT NULL,
-                    boletos_disponibles INTEGER NOT NULL,
-                    boletos_vendidos INTEGER DEFAULT 0
-                )
-            """)
-            conn.commit()
+        self.pool = obtener_pool(self.DB)
+        inicializar_esquema(self.DB)
 
     def insertar_evento(
         self,
@@ -79,83 +509,396 @@ class RepositorioEventos:
         precio: float,
         disponibles: int
     ) -> None:
-        with sqlite3.connect(self.DB) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO eventos (nombre, fecha, lugar, precio, boletos_disponibles)
-                VALUES (?, ?, ?, ?, ?)
-            """, (nombre, fecha, lugar, precio, disponibles))
-            conn.commit()
+        self.pool.obtener().execute("""
+            INSERT INTO eventos (nombre, fecha, lugar, precio, boletos_disponibles)
+            VALUES (?, ?, ?, ?, ?)
+        """, (nombre, fecha, lugar, precio, disponibles))
+
+    def insertar_eventos(self, filas) -> None:
+        #Inserta varios eventos (nombre, fecha, lugar, precio, disponibles) con executemany
+        self.pool.obtener().executemany("""
+            INSERT INTO eventos (nombre, fecha, lugar, precio, boletos_disponibles)
+            VALUES (?, ?, ?, ?, ?)
+        """, filas)
 
+    @metricas.cronometrar("repositorio_eventos.listar_eventos")
     def listar_eventos(self) -> List[Evento]:
-        with sqlite3.connect(self.DB) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, nombre, fecha, lugar, precio,
-                       boletos_disponibles, boletos_vendidos
-                FROM eventos
-            """)
-            filas = cursor.fetchall()
+        filas = self.pool.obtener().execute("""
+            SELECT id, nombre, fecha, lugar, precio,
+                   boletos_disponibles, boletos_vendidos, boletos_retenidos
+            FROM eventos
+        """).fetchall()
         return [Evento(*fila) for fila in filas]
 
+    @metricas.cronometrar("repositorio_eventos.obtener_evento_por_id")
     def obtener_evento_por_id(self, evento_id: int) -> Evento | None:
         #Obtiene un evento específico por su ID
-        with sqlite3.connect(self.DB) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, nombre, fecha, lugar, precio,
-                       boletos_disponibles, boletos_vendidos
-                FROM eventos WHERE id = ?
-            """, (evento_id,))
-            fila = cursor.fetchone()
+        fila = self.pool.obtener().execute("""
+            SELECT id, nombre, fecha, lugar, precio,
+                   boletos_disponibles, boletos_vendidos, boletos_retenidos
+            FROM eventos WHERE id = ?
+        """, (evento_id,)).fetchone()
         return Evento(*fila) if fila else None
 
     def actualizar_boletos_vendidos(self, evento_id: int, cantidad: int) -> None:
         #Actualiza el contador de boletos vendidos de un evento
-        with sqlite3.connect(self.DB) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE eventos
-                SET boletos_vendidos = boletos_vendidos + ?
-                WHERE id = ?
-            """, (cantidad, evento_id))
-            conn.commit()
+        self.pool.obtener().execute("""
+            UPDATE eventos
+            SET boletos_vendidos = boletos_vendidos + ?
+            WHERE id = ?
+        """, (cantidad, evento_id))
+
+    @metricas.cronometrar("repositorio_eventos.reservar_boletos")
+    def reservar_boletos(self, evento_id: int, cantidad: int) -> int | None:
+        #Suma los boletos sólo si alcanzan; la verificación y el incremento son una sola sentencia.
+        #Devuelve el nuevo total vendido, o None si no se pudo reservar
+        fila = self.pool.obtener().execute("""
+            UPDATE eventos
+            SET boletos_vendidos = boletos_vendidos + ?
+            WHERE id = ? AND boletos_vendidos + boletos_retenidos + ? <= boletos_disponibles
+            RETURNING boletos_vendidos
+        """, (cantidad, evento_id, cantidad)).fetchall()
+        return fila[0][0] if fila else None
+
+    @metricas.cronometrar("repositorio_eventos.retener_boletos")
+    def retener_boletos(self, evento_id: int, cantidad: int) -> int | None:
+        #Como reservar_boletos pero aparta los boletos sin venderlos.
+        #Devuelve el nuevo total retenido, o None si no alcanzan
+        fila = self.pool.obtener().execute("""
+            UPDATE eventos
+            SET boletos_retenidos = boletos_retenidos + ?
+            WHERE id = ? AND boletos_vendidos + boletos_retenidos + ? <= boletos_disponibles
+            RETURNING boletos_retenidos
+        """, (cantidad, evento_id, cantidad)).fetchall()
+        return fila[0][0] if fila else None
+
+    def confirmar_retenidos(self, evento_id: int, cantidad: int) -> tuple[int, int]:
+        #Pasa boletos retenidos a vendidos; devuelve (vendidos, retenidos)
+        return self.pool.obtener().execute("""
+            UPDATE eventos
+            SET boletos_vendidos = boletos_vendidos + ?,
+                boletos_retenidos = boletos_retenidos - ?
+            WHERE id = ?
+            RETURNING boletos_vendidos, boletos_retenidos
+        """, (cantidad, cantidad, evento_id)).fetchone()
+
+    def liberar_retenidos(self, cantidades: dict) -> None:
+        #Devuelve {evento_id: cantidad} boletos retenidos al stock
+        self.pool.obtener().executemany("""
+            UPDATE eventos
+            SET boletos_retenidos = boletos_retenidos - ?
+            WHERE id = ?
+        """, [(cantidad, evento_id) for evento_id, cantidad in cantidades.items()])
+
+    @metricas.cronometrar("repositorio_eventos.disponibilidad_eventos")
+    def disponibilidad_eventos(self, ids) -> dict:
+        #{evento_id: (nombre, precio, boletos_disponibles, boletos_vendidos)} para los ids pedidos;
+        #los boletos retenidos se descuentan de boletos_disponibles
+        ids = list(ids)
+        if not ids:
+            return {}
+        marcadores = ", ".join("?" for _ in ids)
+        filas = self.pool.obtener().execute(f"""
+            SELECT id, nombre, precio, boletos_disponibles - boletos_retenidos, boletos_vendidos
+            FROM eventos WHERE id IN ({marcadores})
+        """, ids).fetchall()
+        return {fila[0]: fila[1:] for fila in filas}
+
+    @metricas.cronometrar("repositorio_eventos.sumar_boletos_vendidos")
+    def sumar_boletos_vendidos(self, cantidades: dict) -> int:
+        #Suma {evento_id: cantidad} con la misma condición que reservar_boletos;
+        #devuelve cuántos eventos se actualizaron
+        cursor = self.pool.obtener().executemany("""
+            UPDATE eventos
+            SET boletos_vendidos = boletos_vendidos + ?
+            WHERE id = ? AND boletos_vendidos + boletos_retenidos + ? <= boletos_disponibles
+        """, [(cantidad, evento_id, cantidad) for evento_id, cantidad in cantidades.items()])
+        return cursor.rowcount
+
+    @metricas.cronometrar("repositorio_eventos.contadores_vendidos")
+    def contadores_vendidos(self) -> dict:
+        #Contador de boletos vendidos de cada evento, sin construir objetos Evento
+        filas = self.pool.obtener().execute("SELECT id, boletos_vendidos FROM eventos").fetchall()
+        return dict(filas)
 
     def establecer_boletos_vendidos(self, evento_id: int, cantidad: int) -> None:
         #Establece directamente el contador de boletos vendidos de un evento
-        with sqlite3.connect(self.DB) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE eventos
-                SET boletos_vendidos = ?
-                WHERE id = ?
-            """, (cantidad, evento_id))
-            conn.commit()
+        self.pool.obtener().execute("""
+            UPDATE eventos
+            SET boletos_vendidos = ?
+            WHERE id = ?
+        """, (cantidad, evento_id))
+
+
+class BusNotificaciones:
+    #Publicación/suscripción en memoria entre componentes del mismo proceso.
+    #Los callbacks corren en el hilo que publica (por ejemplo, el de una venta), así que
+    #deben ser rápidos y no bloquear: lo habitual es dejar el aviso en una cola propia.
+
+    def __init__(self):
+        self._suscriptores = {}
+        self._lock = threading.Lock()
+
+    def suscribir(self, tema: str, callback) -> None:
+        with self._lock:
+            self._suscriptores.setdefault(tema, []).append(callback)
+
+    def desuscribir(self, tema: str, callback) -> None:
+        with self._lock:
+            if callback in self._suscriptores.get(tema, []):
+                self._suscriptores[tema].remove(callback)
+
+    def publicar(self, tema: str, **datos) -> None:
+        for callback in list(self._suscriptores.get(tema, ())):
+            try:
+                callback(datos)
+            except Exception as e:
+                print(f"Error notificando '{tema}': {e}")
+
+
+#Tema publicado por InventarioCache cada vez que cambia la disponibilidad de un evento
+TEMA_INVENTARIO = "inventario_cambiado"
+bus_notificaciones = BusNotificaciones()
+
+
+class InventarioCache:
+    #Cache en memoria de los eventos delante de RepositorioEventos.
+    #Las lecturas son accesos O(1) a un diccionario; las ventas actualizan la cache
+    #(write-through) y la cache se recarga al vencer el TTL o cuando PRAGMA data_version
+    #indica que otra conexión escribió en la base. La versión se consulta como mucho una
+    #vez por intervalo_version. Las escrituras del propio pool también cambian data_version
+    #pero ya están reflejadas: si el pool confirmó escrituras desde la última consulta no se
+    #recarga, y lo que otro proceso haya escrito en ese intervalo se ve al vencer el TTL.
+    #Los lectores reciben copias: la cache actualiza sus eventos en el lugar.
+    #La base sigue siendo la autoridad: la reserva condicional en SQL decide cada venta.
+
+    def __init__(
+        self,
+        repositorio: RepositorioEventos,
+        ttl: float = 5.0,
+        intervalo_version: float = 0.25
+    ):
+        self.repositorio = repositorio
+        self.ttl = ttl
+        self.intervalo_version = intervalo_version
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+        self._lock = threading.RLock()
+        self._eventos = {}
+        self._cargado_en = None
+        self._verificado_en = 0.0
+        self._version = None
+        self._escrituras = None
+        self._conexion_version = None
+
+    def _leer_version(self) -> int:
+        #data_version es por conexión, por eso la cache usa una conexión propia
+        if self._conexion_version is None:
+            self._conexion_version = sqlite3.connect(self.repositorio.DB, check_same_thread=False)
+        return self._conexion_version.execute("PRAGMA data_version").fetchone()[0]
+
+    def _vigente(self) -> bool:
+        ahora = time.monotonic()
+        if self._cargado_en is None or ahora - self._cargado_en > self.ttl:
+            return False
+        if ahora - self._verificado_en < self.intervalo_version:
+            return True
+        self._verificado_en = ahora
+        version = self._leer_version()
+        if version == self._version:
+            return True
+        escrituras = self.repositorio.pool.escrituras
+        if escrituras != self._escrituras:
+            #Cambio atribuible a este proceso (ya aplicado por write-through)
+            self._version, self._escrituras = version, escrituras
+            return True
+        return False
+
+    def _notificar(self, evento: Evento) -> None:
+        bus_notificaciones.publicar(
+            TEMA_INVENTARIO,
+            evento_id=evento.id,
+            nombre=evento.nombre,
+            disponibles=evento.restantes
+        )
+
+    @metricas.cronometrar("inventario.recargar")
+    def _recargar(self) -> None:
+        escrituras = self.repositorio.pool.escrituras
+        version = self._leer_version()
+        anteriores = self._eventos
+        self._eventos = {evento.id: evento for evento in self.repositorio.listar_eventos()}
+        self._version, self._escrituras = version, escrituras
+        self._cargado_en = self._verificado_en = time.monotonic()
+        #Cambios hechos por otros procesos o fuera de la cache
+        for evento in self._eventos.values():
+            anterior = anteriores.get(evento.id)
+            if (
+                anterior is None
+                or anterior.boletos_vendidos != evento.boletos_vendidos
+                or anterior.boletos_retenidos != evento.boletos_retenidos
+                or anterior.boletos_disponibles != evento.boletos_disponibles
+            ):
+                self._notificar(evento)
+
+    def _asegurar_vigente(self) -> None:
+        if self._vigente():
+            self.aciertos += 1
+        else:
+            self.fallos += 1
+            self._recargar()
+
+    def listar_eventos(self) -> List[Evento]:
+        with self._lock:
+            self._asegurar_vigente()
+            return [evento.copiar() for evento in self._eventos.values()]
+
+    def obtener_evento(self, evento_id: int) -> Evento | None:
+        with self._lock:
+            self._asegurar_vigente()
+            evento = self._eventos.get(evento_id)
+            if evento is None:
+                #Puede ser un evento recién creado por otro proceso
+                evento = self.repositorio.obtener_evento_por_id(evento_id)
+                if evento is None:
+                    return None
+                self._eventos[evento_id] = evento
+            return evento.copiar()
+
+    def disponibles(self, evento_id: int) -> int | None:
+        evento = self.obtener_evento(evento_id)
+        if evento is None:
+            return None
+        return evento.restantes
+
+    def actualizar_vendidos(self, evento_id: int, vendidos: int) -> None:
+        #Write-through: refleja en memoria un contador ya confirmado en la base. Se llama
+        #después del commit, así que dos ventas pueden llegar en otro orden: el contador
+        #sólo sube (las correcciones del sincronizador pasan por invalidar)
+        with self._lock:
+            evento = self._eventos.get(evento_id)
+            if evento is not None and vendidos > evento.boletos_vendidos:
+                evento.boletos_vendidos = vendidos
+                self._notificar(evento)
+
+    def actualizar_retenidos(self, evento_id: int, retenidos: int, vendidos: int | None = None) -> None:
+        with self._lock:
+            evento = self._eventos.get(evento_id)
+            if evento is not None:
+                evento.boletos_retenidos = retenidos
+                if vendidos is not None and vendidos > evento.boletos_vendidos:
+                    evento.boletos_vendidos = vendidos
+                self._notificar(evento)
+
+    def actualizar_evento(self, evento: Evento) -> None:
+        with self._lock:
+            anterior = self._eventos.get(evento.id)
+            self._eventos[evento.id] = evento.copiar()
+            if anterior is None or anterior.restantes != evento.restantes:
+                self._notificar(evento)
+
+    def invalidar(self) -> None:
+        with self._lock:
+            self._cargado_en = None
+            self.invalidaciones += 1
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "invalidaciones": self.invalidaciones,
+                "eventos": len(self._eventos),
+            }
+
+
+_inventarios = {}
+_inventarios_lock = threading.Lock()
+
+
+def obtener_inventario(ruta: str | None = None) -> InventarioCache:
+    #Cache de inventario compartida por todos los gestores e hilos del proceso
+    ruta = ruta or RepositorioEventos.DB
+    clave = (os.getpid(), ruta)
+    inventario = _inventarios.get(clave)
+    if inventario is None:
+        with _inventarios_lock:
+            inventario = _inventarios.get(clave)
+            if inventario is None:
+                repositorio = RepositorioEventos()
+                inventario = _inventarios[clave] = InventarioCache(repositorio)
+                metricas.registrar_medidor("inventario.aciertos", lambda: inventario.aciertos)
+                metricas.registrar_medidor("inventario.fallos", lambda: inventario.fallos)
+                metricas.registrar_medidor("inventario.invalidaciones", lambda: inventario.invalidaciones)
+    return inventario
+
+
+#Cantidad máxima de archivos de ventas adjuntos a la vez en cada conexión (SQLite admite 10)
+MAX_ARCHIVOS_ADJUNTOS = 8
+
+
+def adjuntar_archivo(conexion: sqlite3.Connection, periodo: str, ruta: str) -> str:
+    #ATTACH a demanda del archivo de ventas de un período; devuelve el esquema a usar en las
+    #consultas. Si ya hay MAX_ARCHIVOS_ADJUNTOS adjuntos se suelta uno antes
+    esquema = "archivo_" + "".join(c if c.isalnum() else "_" for c in periodo)
+    adjuntos = [fila[1] for fila in conexion.execute("PRAGMA database_list")]
+    if esquema in adjuntos:
+        return esquema
+    if conexion.in_transaction:
+        raise sqlite3.OperationalError("No se puede adjuntar un archivo de ventas dentro de una transacción")
+    archivos = [nombre for nombre in adjuntos if nombre.startswith("archivo_")]
+    if len(archivos) >= MAX_ARCHIVOS_ADJUNTOS:
+        conexion.execute(f"DETACH DATABASE {archivos[0]}")
+    conexion.execute(f"ATTACH DATABASE ? AS {esquema}", (ruta,))
+    return esquema
 
 
 class RepositorioVentas:
+    #Las ventas de eventos pasados pueden estar archivadas en un archivo por período
+    #(ServicioArchivoVentas). Las consultas de historial recorren la tabla caliente y los
+    #archivos que pueden tener filas del filtro, adjuntados a demanda; el camino de compra
+    #y la sincronización de contadores sólo tocan la base principal.
     DB = "entradas.db"
 
     def __init__(self):
-        self._inicializar_bd()
-
-    def _inicializar_bd(self) -> None:
-        with sqlite3.connect(self.DB) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ventas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    evento_id INTEGER NOT NULL,
-                    cliente_nombre TEXT NOT NULL,
-                    cliente_gmail TEXT NOT NULL,
-                    cantidad_boletos INTEGER NOT NULL,
-                    total REAL NOT NULL,
-                    fecha_venta TEXT NOT NULL,
-                    FOREIGN KEY (evento_id) REFERENCES eventos (id)
-                )
-            """)
-            conn.commit()
+        self.pool = obtener_pool(self.DB)
+        inicializar_esquema(self.DB)
+
+    def _particiones(self, evento_id: int | None = None, desde: str | None = None) -> list:
+        #None (la tabla caliente) más los (período, ruta) de los archivos que pueden tener
+        #ventas del filtro. Las ventas se archivan según la fecha del evento, que nunca es
+        #anterior a la de la venta
+        conexion = self.pool.obtener()
+        if evento_id is not None:
+            particiones = conexion.execute("""
+                SELECT p.periodo, p.archivo FROM ventas_archivadas a
+                JOIN particiones_ventas p ON p.periodo = a.periodo
+                WHERE a.evento_id = ?
+            """, (evento_id,)).fetchall()
+        else:
+            #Se compara con el prefijo de `desde` del largo del período (año o año-mes)
+            particiones = conexion.execute("""
+                SELECT periodo, archivo FROM particiones_ventas
+                WHERE periodo >= substr(?, 1, length(periodo))
+                ORDER BY periodo DESC
+            """, (desde or "",)).fetchall()
+        directorio = os.path.dirname(os.path.abspath(self.DB))
+        return [None] + [(periodo, os.path.join(directorio, archivo)) for periodo, archivo in particiones]
+
+    def adjuntar_particiones(self, evento_id: int | None = None, desde: str | None = None) -> None:
+        #ATTACH no se puede dentro de una transacción: quien lee ventas dentro de una
+        #(por ejemplo un reporte en una sola instantánea) adjunta antes los archivos que necesita
+        for particion in self._particiones(evento_id, desde)[1:]:
+            self._esquema(particion)
+
+    def _esquema(self, particion) -> str:
+        #Nombre de esquema para consultar la partición, adjuntando el archivo si hace falta
+        if particion is None:
+            return "main"
+        return adjuntar_archivo(self.pool.obtener(), *particion)
 
+    @metricas.cronometrar("repositorio_ventas.insertar_venta")
     def insertar_venta(
         self,
         evento_id: int,
@@ -163,279 +906,1827 @@ class RepositorioVentas:
         gmail: str,
         cantidad_boletos: int,
         total: float,
-        fecha_venta: str
+        fecha_venta: str,
+        asientos: str | None = None,
+        clave_idempotencia: str | None = None
     ) -> None:
-        with sqlite3.connect(self.DB) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO ventas (
-                    evento_id, cliente_nombre, cliente_gmail,
-                    cantidad_boletos, total, fecha_venta
-                ) VALUES (?, ?, ?, ?, ?, ?)
-            """, (evento_id, cliente, gmail, cantidad_boletos, total, fecha_venta))
-            conn.commit()
+        #Con clave_idempotencia repetida falla con sqlite3.IntegrityError (índice único)
+        self.pool.obtener().execute("""
+            INSERT INTO ventas (
+                evento_id, cliente_nombre, cliente_gmail,
+                cantidad_boletos, total, fecha_venta, asientos, clave_idempotencia
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (evento_id, cliente, gmail, cantidad_boletos, total, fecha_venta, asientos, clave_idempotencia))
+
+    @metricas.cronometrar("repositorio_ventas.venta_por_clave")
+    def venta_por_clave(self, clave_idempotencia: str) -> tuple | None:
+        #(evento_id, cantidad_boletos, total, fecha_venta, asientos) de la venta registrada con esa clave
+        return self.pool.obtener().execute("""
+            SELECT evento_id, cantidad_boletos, total, fecha_venta, asientos
+            FROM ventas WHERE clave_idempotencia = ?
+        """, (clave_idempotencia,)).fetchone()
+
+    @metricas.cronometrar("repositorio_ventas.insertar_ventas")
+    def insertar_ventas(self, filas) -> None:
+        #Inserta varias ventas (evento_id, cliente, gmail, cantidad, total, fecha) con executemany
+        self.pool.obtener().executemany("""
+            INSERT INTO ventas (
+                evento_id, cliente_nombre, cliente_gmail,
+                cantidad_boletos, total, fecha_venta
+            ) VALUES (?, ?, ?, ?, ?, ?)
+        """, filas)
+
+    def secuencia_diario(self, diario: str) -> int:
+        fila = self.pool.obtener().execute(
+            "SELECT ultima_secuencia FROM estado_cola_ventas WHERE diario = ?", (diario,)
+        ).fetchone()
+        return fila[0] if fila else 0
+
+    def marcar_diario(self, diario: str, secuencia: int) -> None:
+        self.pool.obtener().execute("""
+            INSERT INTO estado_cola_ventas (diario, ultima_secuencia) VALUES (?, ?)
+            ON CONFLICT (diario) DO UPDATE SET ultima_secuencia = excluded.ultima_secuencia
+        """, (diario, secuencia))
+
+    @staticmethod
+    def _filtros(evento_id: int | None, desde: str | None, hasta: str | None) -> tuple[list, list]:
+        condiciones = []
+        parametros = []
+        if evento_id is not None:
+            condiciones.append("evento_id = ?")
+            parametros.append(evento_id)
+        if desde is not None:
+            condiciones.append("fecha_venta >= ?")
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append("fecha_venta < ?")
+            parametros.append(hasta)
+        return condiciones, parametros
+
+    @metricas.cronometrar("repositorio_ventas.columnas_ventas")
+    def columnas_ventas(
+        self,
+        evento_id: int | None = None,
+        desde: str | None = None,
+        hasta: str | None = None,
+        tamano_lote: int = 10000
+    ) -> dict:
+        #Lectura columnar para análisis: {"id", "evento_id", "cantidad_boletos", "total"}
+        #como array.array (8 bytes por valor) en lugar de un objeto Venta por fila.
+        #Mismos filtros que iterar_ventas; las filas se leen por lotes de tamano_lote
+        columnas = {
+            "id": array("q"),
+            "evento_id": array("q"),
+            "cantidad_boletos": array("q"),
+            "total": array("d"),
+        }
+        destinos = list(columnas.values())
+        for lote in self.lotes_columnas(evento_id, desde, hasta, tamano_lote):
+            for destino, valores in zip(destinos, lote):
+                destino.extend(valores)
+        return columnas
+
+    def lotes_columnas(
+        self,
+        evento_id: int | None = None,
+        desde: str | None = None,
+        hasta: str | None = None,
+        tamano_lote: int = 10000
+    ) -> Iterator[tuple]:
+        #Igual que columnas_ventas pero de a un lote: cada elemento es la tupla de columnas
+        #(ids, evento_ids, cantidades, totales) de hasta tamano_lote filas, para quien sólo
+        #acumula y no necesita tener todas las ventas en memoria
+        condiciones, parametros = self._filtros(evento_id, desde, hasta)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        for particion in self._particiones(evento_id, desde):
+            cursor = self.pool.obtener().execute(f"""
+                SELECT id, evento_id, cantidad_boletos, total
+                FROM {self._esquema(particion)}.ventas
+                {where}
+            """, parametros)
+            try:
+                while True:
+                    filas = cursor.fetchmany(tamano_lote)
+                    if not filas:
+                        break
+                    yield tuple(zip(*filas))
+            finally:
+                cursor.close()
 
     def listar_ventas(self) -> List[Venta]:
-        with sqlite3.connect(self.DB) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+        #Materializa todo el historial; para historiales grandes usar iterar_ventas
+        return list(self.iterar_ventas())
+
+    def iterar_ventas(
+        self,
+        evento_id: int | None = None,
+        desde: str | None = None,
+        hasta: str | None = None,
+        tamano_pagina: int = 500
+    ) -> Iterator[Venta]:
+        #Recorre las ventas de la más reciente a la más antigua en páginas de tamano_pagina,
+        #usando paginación por clave (fecha_venta, id) en lugar de OFFSET. No deja cursores
+        #abiertos entre páginas, así que la memoria no depende del tamaño de la tabla.
+        #Filtros opcionales: evento y rango de fechas [desde, hasta). Con ventas archivadas
+        #cada partición se pagina por separado y se mezclan manteniendo el orden
+        condiciones, parametros = self._filtros(evento_id, desde, hasta)
+        particiones = self._particiones(evento_id, desde)
+        if len(particiones) == 1:
+            yield from self._iterar_particion(None, condiciones, parametros, tamano_pagina)
+            return
+        yield from heapq.merge(
+            *(self._iterar_particion(particion, condiciones, parametros, tamano_pagina) for particion in particiones),
+            key=lambda venta: (venta.fecha_venta, venta.id),
+            reverse=True
+        )
+
+    def _iterar_particion(self, particion, condiciones: list, parametros: list, tamano_pagina: int) -> Iterator[Venta]:
+        ultima_clave = None
+        while True:
+            filtro = list(condiciones)
+            valores = list(parametros)
+            if ultima_clave is not None:
+                filtro.append("(fecha_venta, id) < (?, ?)")
+                valores.extend(ultima_clave)
+            where = f"WHERE {' AND '.join(filtro)}" if filtro else ""
+            cursor = self.pool.obtener().cursor()
+            cursor.arraysize = tamano_pagina
+            #Se adjunta en cada página: otra partición pudo soltar el archivo entre medio
+            cursor.execute(f"""
                 SELECT id, evento_id, cliente_nombre, cliente_gmail,
                        cantidad_boletos, total, fecha_venta
-                FROM ventas
-                ORDER BY fecha_venta DESC
-            """)
-            filas = cursor.fetchall()
-        return [Venta(*fila) for fila in filas]
+                FROM {self._esquema(particion)}.ventas
+                {where}
+                ORDER BY fecha_venta DESC, id DESC
+                LIMIT ?
+            """, (*valores, tamano_pagina))
+            filas = cursor.fetchmany()
+            cursor.close()
+            for fila in filas:
+                yield Venta(*fila)
+            if len(filas) < tamano_pagina:
+                return
+            ultima_clave = (filas[-1][6], filas[-1][0])
+
+    @metricas.cronometrar("repositorio_ventas.totales_boletos_por_evento")
+    def totales_boletos_por_evento(self, desde_id: int = 0) -> tuple[dict, int]:
+        #Boletos vendidos por evento entre las ventas con id > desde_id y el mayor id considerado.
+        #La pasada completa recorre el índice cubriente y suma los totales de las ventas
+        #archivadas; la incremental va por rango de rowid
+        conexion = self.pool.obtener()
+        if desde_id:
+            filas = conexion.execute("""
+                SELECT evento_id, SUM(cantidad_boletos)
+                FROM ventas NOT INDEXED WHERE id > ?
+                GROUP BY evento_id
+            """, (desde_id,)).fetchall()
+        else:
+            filas = conexion.execute("""
+                SELECT evento_id, SUM(boletos) FROM (
+                    SELECT evento_id, SUM(cantidad_boletos) AS boletos
+                    FROM ventas
+                    GROUP BY evento_id
+                    UNION ALL
+                    SELECT evento_id, boletos FROM ventas_archivadas
+                )
+                GROUP BY evento_id
+            """).fetchall()
+        marca = conexion.execute("SELECT MAX(id) FROM ventas").fetchone()[0]
+        return dict(filas), marca or desde_id
+
+    def ventas_archivadas(self) -> int:
+        #Cantidad de ventas movidas a archivos; si cambia, los totales incrementales no sirven
+        return self.pool.obtener().execute(
+            "SELECT COALESCE(SUM(ventas), 0) FROM ventas_archivadas"
+        ).fetchone()[0]
 
+    @metricas.cronometrar("repositorio_ventas.obtener_ventas_por_evento")
     def obtener_ventas_por_evento(self, evento_id: int) -> List[Venta]:
-        #Obtiene todas las ventas de un evento específico
-        with sqlite3.connect(self.DB) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+        #Obtiene todas las ventas de un evento específico, estén o no archivadas
+        ventas = []
+        for particion in self._particiones(evento_id):
+            filas = self.pool.obtener().execute(f"""
                 SELECT id, evento_id, cliente_nombre, cliente_gmail,
                        cantidad_boletos, total, fecha_venta
-                FROM ventas WHERE evento_id = ?
-            """, (evento_id,))
-            filas = cursor.fetchall()
-        return [Venta(*fila) for fila in filas]
+                FROM {self._esquema(particion)}.ventas WHERE evento_id = ?
+            """, (evento_id,)).fetchall()
+            ventas.extend(Venta(*fila) for fila in filas)
+        return ventas
+
+
+
+class MapaAsientos:
+    #Ocupación de los asientos de un evento: un entero por fila de la sala usado como
+    #máscara de bits (bit i = asiento i+1 ocupado). Las filas están ordenadas por prioridad
+    #(menor es mejor) y los tramos de N asientos libres contiguos se encuentran con
+    #desplazamientos y AND sobre la fila entera, sin recorrer asiento por asiento.
+
+    __slots__ = ("evento_id", "filas")
+
+    def __init__(self, evento_id: int, filas):
+        #filas: [seccion, fila, prioridad, asientos, ocupados] ordenadas por prioridad
+        self.evento_id = evento_id
+        self.filas = [list(fila) for fila in filas]
+
+    @staticmethod
+    def empaquetar(ocupados: int, asientos: int) -> bytes:
+        return ocupados.to_bytes((asientos + 7) // 8, "little")
+
+    @staticmethod
+    def desempaquetar(blob: bytes) -> int:
+        return int.from_bytes(blob, "little")
+
+    @staticmethod
+    def _inicios_libres(libres: int, cantidad: int) -> int:
+        #Bit i encendido si los asientos i .. i+cantidad-1 están libres.
+        #Cada paso duplica el largo del tramo verificado: O(log cantidad) operaciones
+        tramos = libres
+        largo = 1
+        while largo < cantidad:
+            paso = min(largo, cantidad - largo)
+            tramos &= tramos >> paso
+            largo += paso
+        return tramos
+
+    @staticmethod
+    def _mas_cercano(inicios: int, centro: int) -> int | None:
+        #Posición de inicio más cercana al centro de la fila
+        mejor = None
+        derecha = inicios >> centro
+        if derecha:
+            mejor = centro + (derecha & -derecha).bit_length() - 1
+        izquierda = inicios & ((1 << centro) - 1)
+        if izquierda:
+            candidato = izquierda.bit_length() - 1
+            if mejor is None or centro - candidato < mejor - centro:
+                mejor = candidato
+        return mejor
+
+    def mejores(self, cantidad: int) -> tuple[int, int] | None:
+        #(índice de fila, primer asiento) de los mejores `cantidad` asientos contiguos:
+        #la fila de mejor prioridad que tenga lugar y, dentro de ella, lo más centrado posible
+        mejor = None
+        for indice, (_, _, prioridad, asientos, ocupados) in enumerate(self.filas):
+            if mejor is not None and prioridad > mejor[0]:
+                break
+            if cantidad > asientos:
+                continue
+            libres = ~ocupados & ((1 << asientos) - 1)
+            inicios = self._inicios_libres(libres, cantidad)
+            if not inicios:
+                continue
+            centro = (asientos - cantidad) // 2
+            inicio = self._mas_cercano(inicios, centro)
+            distancia = abs(inicio - centro)
+            if mejor is None or distancia < mejor[1]:
+                mejor = (prioridad, distancia, indice, inicio)
+        return None if mejor is None else (mejor[2], mejor[3])
+
+    def indice(self, seccion: str, fila: str) -> int | None:
+        for indice, (nombre_seccion, nombre_fila, _, _, _) in enumerate(self.filas):
+            if nombre_seccion == seccion and nombre_fila == fila:
+                return indice
+        return None
+
+    def buscar(self, seccion: str, fila: str, numeros) -> tuple[int, int] | None:
+        #(índice de fila, máscara) de asientos pedidos por número (desde 1), o None si no están libres
+        indice = self.indice(seccion, fila)
+        if indice is None:
+            return None
+        asientos, ocupados = self.filas[indice][3:]
+        if not numeros or any(numero < 1 or numero > asientos for numero in numeros):
+            return None
+        mascara = 0
+        for numero in numeros:
+            mascara |= 1 << (numero - 1)
+        return None if ocupados & mascara else (indice, mascara)
+
+    def ocupar(self, indice: int, mascara: int) -> None:
+        fila = self.filas[indice]
+        if fila[4] & mascara:
+            raise ValueError("Asientos ya ocupados")
+        fila[4] |= mascara
+
+    def liberar(self, indice: int, mascara: int) -> None:
+        self.filas[indice][4] &= ~mascara
+
+    def describir(self, indice: int, mascara: int) -> str:
+        seccion, fila, _, asientos, _ = self.filas[indice]
+        numeros = [numero for numero in range(1, asientos + 1) if mascara >> (numero - 1) & 1]
+        if numeros == list(range(numeros[0], numeros[-1] + 1)) and len(numeros) > 1:
+            return f"{seccion} fila {fila}, asientos {numeros[0]}-{numeros[-1]}"
+        return f"{seccion} fila {fila}, asientos {', '.join(map(str, numeros))}"
+
+    def libres(self) -> int:
+        return sum(asientos - ocupados.bit_count() for _, _, _, asientos, ocupados in self.filas)
+
+
+class RepositorioAsientos:
+    #Persistencia de los mapas de asientos en mapas_asientos: cada fila de la sala es un
+    #registro con su ocupación empaquetada (1 bit por asiento), así una venta reescribe sólo
+    #el blob de la fila que tocó
+    DB = "entradas.db"
+
+    def __init__(self):
+        self.pool = obtener_pool(self.DB)
+        inicializar_esquema(self.DB)
+
+    def tiene_mapa(self, evento_id: int) -> bool:
+        return self.pool.obtener().execute(
+            "SELECT 1 FROM mapas_asientos WHERE evento_id = ? LIMIT 1", (evento_id,)
+        ).fetchone() is not None
+
+    def eventos_con_mapa(self, ids) -> set:
+        ids = list(ids)
+        if not ids:
+            return set()
+        marcadores = ", ".join("?" for _ in ids)
+        filas = self.pool.obtener().execute(
+            f"SELECT DISTINCT evento_id FROM mapas_asientos WHERE evento_id IN ({marcadores})", ids
+        ).fetchall()
+        return {fila[0] for fila in filas}
+
+    def crear_mapa(self, evento_id: int, secciones) -> int:
+        #secciones: (nombre, filas, asientos_por_fila, prioridad) con la fila 1 como la mejor
+        #de cada sección. Reemplaza el mapa anterior y deja boletos_disponibles igual a la
+        #capacidad de la sala; devuelve la cantidad total de asientos
+        registros = []
+        for seccion, filas, asientos_por_fila, prioridad in secciones:
+            for numero in range(1, filas + 1):
+                registros.append((
+                    evento_id, seccion, str(numero), prioridad + numero - 1,
+                    asientos_por_fila, MapaAsientos.empaquetar(0, asientos_por_fila)
+                ))
+        conexion = self.pool.obtener()
+        conexion.execute("DELETE FROM mapas_asientos WHERE evento_id = ?", (evento_id,))
+        conexion.executemany("""
+            INSERT INTO mapas_asientos (evento_id, seccion, fila, prioridad, asientos, ocupados)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, registros)
+        total = sum(registro[4] for registro in registros)
+        conexion.execute("UPDATE eventos SET boletos_disponibles = ? WHERE id = ?", (total, evento_id))
+        return total
+
+    @metricas.cronometrar("repositorio_asientos.cargar_mapa")
+    def cargar_mapa(self, evento_id: int) -> MapaAsientos | None:
+        filas = self.pool.obtener().execute("""
+            SELECT seccion, fila, prioridad, asientos, ocupados
+            FROM mapas_asientos WHERE evento_id = ?
+            ORDER BY prioridad
+        """, (evento_id,)).fetchall()
+        if not filas:
+            return None
+        return MapaAsientos(evento_id, [
+            (seccion, fila, prioridad, asientos, MapaAsientos.desempaquetar(ocupados))
+            for seccion, fila, prioridad, asientos, ocupados in filas
+        ])
+
+    def guardar_fila(self, mapa: MapaAsientos, indice: int) -> None:
+        seccion, fila, _, asientos, ocupados = mapa.filas[indice]
+        self.pool.obtener().execute("""
+            UPDATE mapas_asientos SET ocupados = ?
+            WHERE evento_id = ? AND seccion = ? AND fila = ?
+        """, (MapaAsientos.empaquetar(ocupados, asientos), mapa.evento_id, seccion, fila))
+
+
+class RepositorioRetenciones:
+    #Reservas pendientes de confirmar (ver GestorReservas). Tomar una retención es un
+    #DELETE ... RETURNING: confirmarla y vencerla compiten por la misma fila y sólo una
+    #de las dos la obtiene
+    DB = "entradas.db"
+
+    COLUMNAS = "id, evento_id, cantidad, seccion, fila, mascara, asientos"
+
+    def __init__(self):
+        self.pool = obtener_pool(self.DB)
+        inicializar_esquema(self.DB)
+
+    def insertar(
+        self,
+        evento_id: int,
+        cantidad: int,
+        vence: float,
+        seccion: str | None = None,
+        fila: str | None = None,
+        mascara: bytes | None = None,
+        asientos: str | None = None
+    ) -> int:
+        return self.pool.obtener().execute("""
+            INSERT INTO retenciones (evento_id, cantidad, vence, seccion, fila, mascara, asientos)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (evento_id, cantidad, vence, seccion, fila, mascara, asientos)).lastrowid
+
+    def tomar(self, retencion_id: int, vigente_en: float | None = None) -> tuple | None:
+        #Borra y devuelve la retención; con vigente_en, sólo si todavía no venció
+        if vigente_en is None:
+            return self.pool.obtener().execute(
+                f"DELETE FROM retenciones WHERE id = ? RETURNING {self.COLUMNAS}", (retencion_id,)
+            ).fetchone()
+        return self.pool.obtener().execute(
+            f"DELETE FROM retenciones WHERE id = ? AND vence > ? RETURNING {self.COLUMNAS}",
+            (retencion_id, vigente_en)
+        ).fetchone()
+
+    def tomar_vencidas(self, ids, ahora: float) -> list[tuple]:
+        ids = list(ids)
+        if not ids:
+            return []
+        marcadores = ", ".join("?" for _ in ids)
+        return self.pool.obtener().execute(
+            f"DELETE FROM retenciones WHERE id IN ({marcadores}) AND vence <= ? RETURNING {self.COLUMNAS}",
+            (*ids, ahora)
+        ).fetchall()
+
+    def ids_vencidas(self, ahora: float, limite: int) -> list[int]:
+        filas = self.pool.obtener().execute(
+            "SELECT id FROM retenciones WHERE vence <= ? LIMIT ?", (ahora, limite)
+        ).fetchall()
+        return [fila[0] for fila in filas]
+
+    def pendientes(self) -> Iterator[tuple[int, float]]:
+        #(id, vence) de las retenciones vigentes, para volver a programarlas al iniciar
+        yield from self.pool.obtener().execute("SELECT id, vence FROM retenciones")
+
+
+class ColaVentasPendientes:
+    #Cola de escritura diferida de ventas.
+    #La compra reserva los boletos en la base y deja aquí el registro de la venta;
+    #HiloProcesadorVentas lo vuelca por lotes con executemany en una sola transacción.
+    #- Contrapresión: antes de reservar se toma un lugar (tomar_lugar); si la cola está
+    #  llena durante `timeout` segundos la compra se rechaza sin haber reservado nada.
+    #- Durabilidad: cada venta se agrega a un diario en disco antes de quedar en memoria.
+    #  La última secuencia volcada se guarda en estado_cola_ventas en la misma transacción
+    #  que el lote, así al reiniciar se reinsertan sólo las ventas que no llegaron a la base.
+    #- Consistencia: boletos_en_vuelo() informa por evento los boletos reservados cuya venta
+    #  aún no está en la tabla, para que la sincronización no los "corrija".
+    #- Cierre: cerrar() deja de dar lugares y espera a que las compras que ya reservaron
+    #  encolen su venta antes de volcar todo y cerrar el diario.
+    #El diario es de un solo proceso: cada proceso que use la cola necesita su propio archivo.
+
+    def __init__(
+        self,
+        ruta_diario: str = "ventas_pendientes.log",
+        capacidad: int = 10000,
+        tamano_lote: int = 500,
+        timeout: float = 2.0,
+        sincronizar_diario: bool = False
+    ):
+        self.ruta_diario = ruta_diario
+        self.capacidad = capacidad
+        self.tamano_lote = tamano_lote
+        self.timeout = timeout
+        self.sincronizar_diario = sincronizar_diario
+        self.repositorio = RepositorioVentas()
+        self._pendientes = deque()
+        self._condicion = threading.Condition()
+        self._espacios = threading.Semaphore(capacidad)
+        self._lock_vaciado = threading.Lock()
+        self._en_vuelo = {}
+        self._despertar = False
+        self._secuencia = 0
+        self._confirmada = 0
+        self.total_encoladas = 0
+        #Lugares tomados cuya venta todavía no se encoló (reserva en curso)
+        self._sin_encolar = 0
+        self._cerrando = False
+        self._recuperar()
+        self._diario = open(self.ruta_diario, "a", encoding="utf-8")
+        metricas.registrar_medidor("cola.pendientes", self.pendientes)
+        metricas.registrar_medidor("cola.boletos_en_vuelo", lambda: sum(self.boletos_en_vuelo().values()))
+
+    def _recuperar(self) -> None:
+        #Vuelca las ventas del diario que no llegaron a la base antes de una caída
+        self._confirmada = self.repositorio.secuencia_diario(self.ruta_diario)
+        recuperadas = []
+        ultima = self._confirmada
+        if os.path.exists(self.ruta_diario):
+            with open(self.ruta_diario, encoding="utf-8") as diario:
+                for linea in diario:
+                    try:
+                        secuencia, *venta = json.loads(linea)
+                    except ValueError:
+                        #Línea incompleta por una caída a mitad de escritura
+                        continue
+                    ultima = max(ultima, secuencia)
+                    if secuencia > self._confirmada:
+                        recuperadas.append(venta)
+        if recuperadas:
+            with self.repositorio.pool.transaccion():
+                self.repositorio.insertar_ventas(recuperadas)
+                self.repositorio.marcar_diario(self.ruta_diario, ultima)
+            print(f"Recuperadas {len(recuperadas)} ventas pendientes del diario")
+        self._secuencia = self._confirmada = ultima
+        open(self.ruta_diario, "w").close()
+
+    def tomar_lugar(self, evento_id: int, cantidad: int) -> bool:
+        #Se llama antes de reservar; False si la cola sigue llena al vencer el timeout
+        inicio = time.perf_counter()
+        if self._cerrando:
+            return False
+        if not self._espacios.acquire(timeout=self.timeout):
+            metricas.incrementar("cola.llena")
+            return False
+        metricas.observar("cola.espera_lugar", (time.perf_counter() - inicio) * 1000)
+        with self._condicion:
+            if self._cerrando:
+                self._espacios.release()
+                return False
+            self._en_vuelo[evento_id] = self._en_vuelo.get(evento_id, 0) + cantidad
+            self._sin_encolar += 1
+        return True
+
+    def devolver_lugar(self, evento_id: int, cantidad: int) -> None:
+        #La reserva no se concretó
+        with self._condicion:
+            self._sin_encolar -= 1
+            self._condicion.notify_all()
+        self._liberar([(evento_id, cantidad)])
+
+    def _liberar(self, lugares) -> None:
+        with self._condicion:
+            for evento_id, cantidad in lugares:
+                restantes = self._en_vuelo.get(evento_id, 0) - cantidad
+                if restantes > 0:
+                    self._en_vuelo[evento_id] = restantes
+                else:
+                    self._en_vuelo.pop(evento_id, None)
+        for _ in lugares:
+            self._espacios.release()
+
+    def encolar(
+        self,
+        evento_id: int,
+        cliente: str,
+        gmail: str,
+        cantidad: int,
+        total: float,
+        fecha_venta: str
+    ) -> None:
+        #Se llama con la reserva ya confirmada y el lugar tomado, por eso nunca bloquea
+        with self._condicion:
+            self._sin_encolar -= 1
+            self._condicion.notify_all()
+            if not self._diario.closed:
+                self._secuencia += 1
+                venta = (self._secuencia, evento_id, cliente, gmail, cantidad, total, fecha_venta)
+                self._diario.write(json.dumps(venta, ensure_ascii=False) + "\n")
+                self._diario.flush()
+                if self.sincronizar_diario:
+                    os.fsync(self._diario.fileno())
+                self._pendientes.append(venta)
+                self.total_encoladas += 1
+                if len(self._pendientes) >= self.tamano_lote:
+                    self._condicion.notify_all()
+                return
+        #cerrar() dejó de esperar a esta compra: la venta se registra directo en la base
+        metricas.incrementar("cola.ventas_tras_cierre")
+        with self.repositorio.pool.transaccion():
+            self.repositorio.insertar_ventas([(evento_id, cliente, gmail, cantidad, total, fecha_venta)])
+        self._liberar([(evento_id, cantidad)])
+
+    def esperar_lote(self, timeout: float) -> None:
+        #Espera hasta que haya un lote completo, venza el timeout o se pida despertar
+        with self._condicion:
+            self._condicion.wait_for(
+                lambda: len(self._pendientes) >= self.tamano_lote or self._despertar, timeout
+            )
+            self._despertar = False
+
+    def despertar(self) -> None:
+        with self._condicion:
+            self._despertar = True
+            self._condicion.notify_all()
+
+    @metricas.cronometrar("cola.vaciar")
+    def vaciar(self) -> int:
+        #Vuelca hasta un lote en una transacción; devuelve cuántas ventas se escribieron
+        with self._lock_vaciado:
+            with self._condicion:
+                lote = [self._pendientes.popleft() for _ in range(min(self.tamano_lote, len(self._pendientes)))]
+            if not lote:
+                return 0
+            try:
+                with self.repositorio.pool.transaccion():
+                    self.repositorio.insertar_ventas([venta[1:] for venta in lote])
+                    self.repositorio.marcar_diario(self.ruta_diario, lote[-1][0])
+            except BaseException:
+                with self._condicion:
+                    self._pendientes.extendleft(reversed(lote))
+                raise
+            self._liberar([(venta[1], venta[4]) for venta in lote])
+            metricas.incrementar("cola.ventas_volcadas", len(lote))
+            with self._condicion:
+                self._confirmada = lote[-1][0]
+                if self._confirmada == self._secuencia:
+                    #Todo lo escrito en el diario ya está en la base
+                    self._diario.truncate(0)
+            return len(lote)
+
+    def vaciar_todo(self) -> int:
+        total = 0
+        while True:
+            escritas = self.vaciar()
+            if not escritas:
+                return total
+            total += escritas
+
+    def pausar_vaciado(self):
+        #Context manager que impide volcar lotes mientras está tomado
+        return self._lock_vaciado
+
+    def boletos_en_vuelo(self) -> dict:
+        with self._condicion:
+            return dict(self._en_vuelo)
+
+    def pendientes(self) -> int:
+        with self._condicion:
+            return len(self._pendientes)
+
+    def cerrar(self, espera: float = 10.0) -> None:
+        #Deja de dar lugares, espera hasta `espera` segundos a las compras que ya reservaron
+        #y vuelca todo antes de cerrar el diario
+        with self._condicion:
+            self._cerrando = True
+            self._condicion.wait_for(lambda: self._sin_encolar <= 0, espera)
+        self.vaciar_todo()
+        with self._condicion:
+            self._diario.close()
+
+
+class RepositorioReportes:
+    #Consultas de reportes sobre las tablas de resumen: el costo depende de la cantidad
+    #de horas y eventos con ventas, no de la cantidad de ventas.
+    #distribucion_ventas no forma parte de generar_reporte: recorre las ventas recientes y
+    #se pide a demanda
+    DB = "entradas.db"
+    #Límites superiores de las cubetas de distribucion_ventas (como metricas.Histograma)
+    LIMITES_BOLETOS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50, 100)
+    LIMITES_TOTAL = (
+        10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000
+    )
+
+    def __init__(self):
+        self.pool = obtener_pool(self.DB)
+        inicializar_esquema(self.DB)
+
+    def totales(self) -> dict:
+        fila = self.pool.obtener().execute("""
+            SELECT COALESCE(SUM(ventas), 0), COALESCE(SUM(boletos), 0),
+                   COALESCE(SUM(ingresos), 0), COUNT(DISTINCT evento_id)
+            FROM resumen_ventas_hora
+        """).fetchone()
+        total_ventas, boletos, ingresos, eventos_con_ventas = fila
+        return {
+            "total_ventas": total_ventas,
+            "boletos_vendidos": boletos,
+            "ingresos_totales": ingresos,
+            "promedio_venta": ingresos / total_ventas if total_ventas else 0.0,
+            "eventos_con_ventas": eventos_con_ventas,
+        }
+
+    def ingresos_por_evento(self) -> List[dict]:
+        #Ingresos por evento y porcentaje de boletos vendidos sobre los disponibles
+        filas = self.pool.obtener().execute("""
+            SELECT e.id, e.nombre, e.boletos_disponibles, e.boletos_vendidos,
+                   COALESCE(r.ventas, 0), COALESCE(r.ingresos, 0)
+            FROM eventos e
+            LEFT JOIN (
+                SELECT evento_id, SUM(ventas) AS ventas, SUM(ingresos) AS ingresos
+                FROM resumen_ventas_hora GROUP BY evento_id
+            ) r ON r.evento_id = e.id
+            ORDER BY 6 DESC
+        """).fetchall()
+        return [
+            {
+                "evento_id": evento_id,
+                "nombre": nombre,
+                "ventas": ventas,
+                "ingresos": ingresos,
+                "ocupacion": vendidos / disponibles if disponibles else 0.0,
+            }
+            for evento_id, nombre, disponibles, vendidos, ventas, ingresos in filas
+        ]
+
+    def ventas_por_periodo(self, por_dia: bool = False, limite: int = 48) -> List[dict]:
+        #Últimos `limite` periodos (horas 'YYYY-MM-DD HH' o días 'YYYY-MM-DD')
+        largo = 10 if por_dia else 13
+        filas = self.pool.obtener().execute("""
+            SELECT substr(hora, 1, ?) AS periodo, SUM(ventas), SUM(boletos), SUM(ingresos)
+            FROM resumen_ventas_hora
+            GROUP BY periodo
+            ORDER BY periodo DESC
+            LIMIT ?
+        """, (largo, limite)).fetchall()
+        return [
+            {"periodo": periodo, "ventas": ventas, "boletos": boletos, "ingresos": ingresos}
+            for periodo, ventas, boletos, ingresos in filas
+        ]
+
+    def mejores_clientes(self, limite: int = 10) -> List[dict]:
+        filas = self.pool.obtener().execute("""
+            SELECT cliente_gmail, ventas, boletos, ingresos
+            FROM resumen_clientes
+            ORDER BY ingresos DESC
+            LIMIT ?
+        """, (limite,)).fetchall()
+        return [
+            {"gmail": gmail, "ventas": ventas, "boletos": boletos, "ingresos": ingresos}
+            for gmail, ventas, boletos, ingresos in filas
+        ]
+
+    @staticmethod
+    def _hace(horas: int) -> str:
+        return datetime.fromtimestamp(time.time() - horas * 3600).strftime("%Y-%m-%d %H:%M:%S")
+
+    def distribucion_ventas(self, horas: int = 24) -> dict:
+        #Percentiles de boletos y montos por venta en las últimas `horas`. Los resúmenes sólo
+        #guardan sumas, así que se recorren las ventas por lotes de columnas y se cuentan en
+        #cubetas fijas: la memoria no crece con la cantidad de ventas y los percentiles son
+        #aproximados (límite superior de la cubeta, como en metricas.Histograma)
+        limites = (self.LIMITES_BOLETOS, self.LIMITES_TOTAL)
+        cubetas = ([0] * (len(self.LIMITES_BOLETOS) + 1), [0] * (len(self.LIMITES_TOTAL) + 1))
+        maximos = [0, 0.0]
+        ventas = 0
+        for _, _, cantidades, totales in RepositorioVentas().lotes_columnas(desde=self._hace(horas)):
+            ventas += len(cantidades)
+            for columna, valores in enumerate((cantidades, totales)):
+                maximos[columna] = max(maximos[columna], max(valores))
+                for valor in valores:
+                    cubetas[columna][bisect.bisect_left(limites[columna], valor)] += 1
+
+        def percentiles(columna) -> dict:
+            def en(p):
+                acumulado = 0
+                for indice, cantidad in enumerate(cubetas[columna]):
+                    acumulado += cantidad
+                    if cantidad and acumulado >= p * ventas:
+                        if indice < len(limites[columna]):
+                            return min(limites[columna][indice], maximos[columna])
+                        return maximos[columna]
+                return 0
+            return {"p50": en(0.50), "p90": en(0.90), "p99": en(0.99), "max": maximos[columna]}
+        return {
+            "horas": horas,
+            "ventas": ventas,
+            "boletos_por_venta": percentiles(0),
+            "total_por_venta": percentiles(1),
+        }
+
+    @metricas.cronometrar("repositorio_reportes.generar_reporte")
+    def generar_reporte(self) -> dict:
+        #Todas las secciones se leen en la misma instantánea
+        with self.pool.transaccion(inmediata=False):
+            return {
+                "generado": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "totales": self.totales(),
+                "por_evento": self.ingresos_por_evento(),
+                "por_hora": self.ventas_por_periodo(),
+                "por_dia": self.ventas_por_periodo(por_dia=True, limite=30),
+                "mejores_clientes": self.mejores_clientes(),
+            }
+
+
+def guardar_reporte(reporte: dict, ruta: str) -> None:
+    #Escribe el reporte de forma atómica para que nadie lea un archivo a medio escribir
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump(reporte, archivo, ensure_ascii=False, indent=2)
+    os.replace(temporal, ruta)
+
+
+
+class ServicioRespaldos:
+    #Respaldos en caliente con la API de backup de SQLite.
+    #La copia se hace por pasos de `paginas_por_paso` páginas con una pausa entre pasos
+    #para no frenar las ventas; una transacción de lectura abierta en el origen fija la
+    #instantánea (con WAL los escritores siguen trabajando y la copia no se reinicia).
+    #Cada respaldo se verifica con integrity_check y se conservan sólo los últimos `conservar`.
+
+    def __init__(
+        self,
+        ruta_bd: str | None = None,
+        directorio: str = ".",
+        paginas_por_paso: int = 256,
+        pausa: float = 0.005,
+        conservar: int = 12
+    ):
+        self.ruta_bd = ruta_bd or RepositorioEventos.DB
+        self.directorio = directorio
+        self.paginas_por_paso = paginas_por_paso
+        self.pausa = pausa
+        self.conservar = conservar
+
+    def _pausar(self, estado, restantes, total) -> None:
+        time.sleep(self.pausa)
+
+    def copiar(self, destino: str) -> None:
+        #Copia la base a `destino` como archivo autónomo (sin WAL)
+        origen = sqlite3.connect(self.ruta_bd, isolation_level=None)
+        copia = sqlite3.connect(destino)
+        try:
+            origen.execute("BEGIN")
+            origen.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+            origen.backup(copia, pages=self.paginas_por_paso, progress=self._pausar)
+            origen.execute("COMMIT")
+            copia.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            copia.close()
+            origen.close()
+
+    @staticmethod
+    def verificar(ruta: str) -> bool:
+        conexion = sqlite3.connect(ruta)
+        try:
+            return conexion.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        except sqlite3.DatabaseError:
+            return False
+        finally:
+            conexion.close()
+
+    def crear_respaldo(self, prefijo: str = "respaldo_entradas") -> str:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        destino = os.path.join(self.directorio, f"{prefijo}_{timestamp}.db")
+        temporal = f"{destino}.parcial"
+        try:
+            self.copiar(temporal)
+            if not self.verificar(temporal):
+                raise sqlite3.DatabaseError(f"El respaldo {destino} no pasó la verificación de integridad")
+            os.replace(temporal, destino)
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        self.rotar(prefijo)
+        return destino
+
+    def rotar(self, prefijo: str) -> List[str]:
+        #Elimina los respaldos más viejos de `prefijo`; devuelve los eliminados
+        respaldos = sorted(glob.glob(os.path.join(self.directorio, f"{prefijo}_*.db")))
+        sobrantes = respaldos[:-self.conservar] if self.conservar > 0 else []
+        for ruta in sobrantes:
+            os.remove(ruta)
+        return sobrantes
+
+
+
+class ServicioRespaldosComprimidos(ServicioRespaldos):
+    #Cadenas de respaldo comprimidas: una base completa más incrementales.
+    #La base es una copia en caliente comprimida por bloques (memoria constante). Cada
+    #incremental guarda sólo las ventas con id mayor a la marca anterior y, de las tablas
+    #versionadas (eventos, filas de mapas de asientos y retenciones), las filas cuyo contenido
+    #cambió y las claves de las que se borraron, como líneas JSON comprimidas (los blobs
+    #viajan en hexadecimal). El manifiesto de la cadena
+    #({prefijo}_{timestamp}.json) lista los archivos en orden para poder restaurar.
+    #Las ventas se consideran de sólo inserción: borrados y ediciones no viajan en los incrementales.
+
+    EXTENSIONES = {"xz": lzma, "gz": gzip}
+    TAMANO_BLOQUE = 1024 * 1024
+    #Tablas que viajan por huella de contenido: tabla -> cantidad de columnas de la clave
+    TABLAS_VERSIONADAS = {"eventos": 1, "mapas_asientos": 3, "retenciones": 1}
+    #Columnas BLOB de las tablas versionadas (se guardan en hexadecimal)
+    COLUMNAS_BLOB = {"mapas_asientos": "ocupados", "retenciones": "mascara"}
+
+    def __init__(self, *args, formato: str = "xz", completo_cada: int = 24, **kwargs):
+        super().__init__(*args, **kwargs)
+        if formato not in self.EXTENSIONES:
+            raise ValueError(f"Formato de compresión no soportado: {formato}")
+        self.formato = formato
+        self.completo_cada = completo_cada
+
+    def _abrir_comprimido(self, ruta: str, modo: str):
+        return self.EXTENSIONES[ruta.rsplit(".", 1)[-1]].open(ruta, modo)
+
+    @staticmethod
+    def _serializable(fila) -> list:
+        return [valor.hex() if isinstance(valor, bytes) else valor for valor in fila]
+
+    @classmethod
+    def _huella(cls, fila) -> str:
+        return hashlib.sha1(json.dumps(cls._serializable(fila), ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _clave(fila, columnas_clave: int) -> str:
+        return "/".join(str(valor) for valor in fila[:columnas_clave])
+
+    def _manifiestos(self, prefijo: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directorio, f"{prefijo}_*.json")))
+
+    def _guardar_manifiesto(self, ruta: str, manifiesto: dict) -> None:
+        temporal = f"{ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump(manifiesto, archivo, indent=2)
+        os.replace(temporal, ruta)
+
+    def crear_respaldo_completo(self, prefijo: str = "respaldo_completo") -> str:
+        #Inicia una cadena nueva; devuelve la ruta del manifiesto
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        base = os.path.join(self.directorio, f"{prefijo}_{timestamp}")
+        temporal = f"{base}.db.parcial"
+        comprimido = f"{base}.db.{self.formato}"
+        comprimido_parcial = f"{base}.parcial.{self.formato}"
+        try:
+            self.copiar(temporal)
+            if not self.verificar(temporal):
+                raise sqlite3.DatabaseError(f"El respaldo {comprimido} no pasó la verificación de integridad")
+            copia = sqlite3.connect(temporal)
+            try:
+                marca = copia.execute("SELECT COALESCE(MAX(id), 0) FROM ventas").fetchone()[0]
+                huellas = {
+                    tabla: {
+                        self._clave(fila, columnas_clave): self._huella(fila)
+                        for fila in copia.execute(f"SELECT * FROM {tabla}")
+                    }
+                    for tabla, columnas_clave in self.TABLAS_VERSIONADAS.items()
+                }
+            finally:
+                copia.close()
+            with open(temporal, "rb") as origen, self._abrir_comprimido(comprimido_parcial, "wb") as destino:
+                shutil.copyfileobj(origen, destino, self.TAMANO_BLOQUE)
+            os.replace(comprimido_parcial, comprimido)
+        finally:
+            for resto in (temporal, comprimido_parcial):
+                if os.path.exists(resto):
+                    os.remove(resto)
+        manifiesto = {
+            "base": os.path.basename(comprimido),
+            "marca_ventas": marca,
+            **huellas,
+            "incrementales": [],
+        }
+        ruta_manifiesto = f"{base}.json"
+        self._guardar_manifiesto(ruta_manifiesto, manifiesto)
+        self.rotar_cadenas(prefijo)
+        return ruta_manifiesto
+
+    def crear_respaldo_incremental(self, ruta_manifiesto: str) -> str | None:
+        #Agrega un incremental a la cadena; None si no hubo cambios
+        with open(ruta_manifiesto, encoding="utf-8") as archivo:
+            manifiesto = json.load(archivo)
+        numero = len(manifiesto["incrementales"]) + 1
+        ruta = f"{ruta_manifiesto[:-len('.json')]}_inc{numero:04d}.jsonl.{self.formato}"
+        conexion = sqlite3.connect(self.ruta_bd, isolation_level=None)
+        cambios = 0
+        #Las cadenas anteriores a los mapas de asientos no tienen su sección de huellas
+        huellas = {tabla: dict(manifiesto.get(tabla, {})) for tabla in self.TABLAS_VERSIONADAS}
+        marca = manifiesto["marca_ventas"]
+        try:
+            conexion.execute("BEGIN")
+            with self._abrir_comprimido(ruta, "wt") as salida:
+                for tabla, columnas_clave in self.TABLAS_VERSIONADAS.items():
+                    cursor = conexion.execute(f"SELECT * FROM {tabla}")
+                    columnas = [columna[0] for columna in cursor.description]
+                    salida.write(json.dumps({"tabla": tabla, "columnas": columnas}) + "\n")
+                    vigentes = set()
+                    for fila in cursor:
+                        clave = self._clave(fila, columnas_clave)
+                        huella = self._huella(fila)
+                        vigentes.add(clave)
+                        if huellas[tabla].get(clave) != huella:
+                            huellas[tabla][clave] = huella
+                            salida.write(json.dumps(self._serializable(fila), ensure_ascii=False) + "\n")
+                            cambios += 1
+                    #Filas borradas desde el respaldo anterior (retenciones confirmadas o vencidas)
+                    borradas = sorted(set(huellas[tabla]) - vigentes)
+                    if borradas:
+                        salida.write(json.dumps({"tabla": tabla, "borradas": borradas}, ensure_ascii=False) + "\n")
+                        for clave in borradas:
+                            del huellas[tabla][clave]
+                        cambios += len(borradas)
+                cursor = conexion.execute("SELECT * FROM ventas WHERE id > ? ORDER BY id", (marca,))
+                columnas = [columna[0] for columna in cursor.description]
+                salida.write(json.dumps({"tabla": "ventas", "columnas": columnas}) + "\n")
+                for fila in cursor:
+                    marca = fila[0]
+                    salida.write(json.dumps(fila, ensure_ascii=False) + "\n")
+                    cambios += 1
+            conexion.execute("COMMIT")
+        finally:
+            conexion.close()
+        if not cambios:
+            os.remove(ruta)
+            return None
+        manifiesto["incrementales"].append(os.path.basename(ruta))
+        manifiesto["marca_ventas"] = marca
+        manifiesto.update(huellas)
+        self._guardar_manifiesto(ruta_manifiesto, manifiesto)
+        return ruta
+
+    def respaldar(self, prefijo: str = "respaldo_completo") -> str | None:
+        #Incremental sobre la última cadena, o una base nueva cada `completo_cada` incrementales
+        manifiestos = self._manifiestos(prefijo)
+        if manifiestos:
+            with open(manifiestos[-1], encoding="utf-8") as archivo:
+                incrementales = len(json.load(archivo)["incrementales"])
+            if incrementales < self.completo_cada:
+                return self.crear_respaldo_incremental(manifiestos[-1])
+        return self.crear_respaldo_completo(prefijo)
+
+    def rotar_cadenas(self, prefijo: str) -> None:
+        manifiestos = self._manifiestos(prefijo)
+        sobrantes = manifiestos[:-self.conservar] if self.conservar > 0 else []
+        for ruta_manifiesto in sobrantes:
+            with open(ruta_manifiesto, encoding="utf-8") as archivo:
+                manifiesto = json.load(archivo)
+            for nombre in [manifiesto["base"], *manifiesto["incrementales"]]:
+                ruta = os.path.join(os.path.dirname(ruta_manifiesto), nombre)
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+            os.remove(ruta_manifiesto)
+
+    def _borrar_filas(self, conexion: sqlite3.Connection, tabla: str, claves: set) -> None:
+        #Las claves del manifiesto son texto: se buscan las filas cuya clave coincide
+        columnas_clave = self.TABLAS_VERSIONADAS[tabla]
+        nombres = [fila[1] for fila in conexion.execute(f"PRAGMA table_info({tabla})")][:columnas_clave]
+        filas = [
+            fila for fila in conexion.execute(f"SELECT {', '.join(nombres)} FROM {tabla}")
+            if self._clave(fila, columnas_clave) in claves
+        ]
+        condicion = " AND ".join(f"{nombre} = ?" for nombre in nombres)
+        conexion.executemany(f"DELETE FROM {tabla} WHERE {condicion}", filas)
+
+    def restaurar(self, ruta_manifiesto: str, destino: str) -> None:
+        #Reconstruye la base en `destino` a partir de la cadena del manifiesto
+        if os.path.exists(destino):
+            raise FileExistsError(f"{destino} ya existe; no se sobrescribe una base al restaurar")
+        directorio = os.path.dirname(ruta_manifiesto)
+        with open(ruta_manifiesto, encoding="utf-8") as archivo:
+            manifiesto = json.load(archivo)
+        with self._abrir_comprimido(os.path.join(directorio, manifiesto["base"]), "rb") as origen, open(destino, "wb") as salida:
+            shutil.copyfileobj(origen, salida, self.TAMANO_BLOQUE)
+        conexion = sqlite3.connect(destino)
+        try:
+            for nombre in manifiesto["incrementales"]:
+                with self._abrir_comprimido(os.path.join(directorio, nombre), "rt") as entrada:
+                    sentencia = None
+                    blob = None
+                    for linea in entrada:
+                        dato = json.loads(linea)
+                        if isinstance(dato, dict) and "borradas" in dato:
+                            self._borrar_filas(conexion, dato["tabla"], set(dato["borradas"]))
+                        elif isinstance(dato, dict):
+                            columnas = ", ".join(dato["columnas"])
+                            marcadores = ", ".join("?" for _ in dato["columnas"])
+                            #Tablas versionadas: la última versión gana; ventas: nunca se duplican
+                            accion = "REPLACE" if dato["tabla"] in self.TABLAS_VERSIONADAS else "IGNORE"
+                            sentencia = f"INSERT OR {accion} INTO {dato['tabla']} ({columnas}) VALUES ({marcadores})"
+                            columna_blob = self.COLUMNAS_BLOB.get(dato["tabla"])
+                            blob = dato["columnas"].index(columna_blob) if columna_blob else None
+                        else:
+                            if blob is not None and dato[blob] is not None:
+                                dato[blob] = bytes.fromhex(dato[blob])
+                            conexion.execute(sentencia, dato)
+                conexion.commit()
+            if conexion.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+                raise sqlite3.DatabaseError(f"La base restaurada en {destino} no pasó la verificación de integridad")
+        finally:
+            conexion.close()
+
+
+class ServicioMantenimiento:
+    #Mantenimiento adaptativo de la base, en pasos cortos que se intercalan con las ventas.
+    #Primero mide la fragmentación (páginas libres sobre páginas totales) y el tamaño del WAL:
+    #- Checkpoint PASSIVE en cada pasada (no espera a nadie); TRUNCATE sólo con poco tráfico
+    #  y si el WAL pasó `limite_wal` bytes.
+    #- PRAGMA incremental_vacuum de a `paginas_por_paso` páginas, cada paso en su propia
+    #  transacción con una pausa entre pasos (requiere auto_vacuum=INCREMENTAL).
+    #- PRAGMA optimize con analysis_limit: ANALYZE acotado y sólo de lo que cambió.
+    #- VACUUM completo únicamente en la ventana de poco tráfico, si la fragmentación supera
+    #  `umbral_vacuum` o si hace falta para pasar la base a auto_vacuum=INCREMENTAL.
+    #Cada paso informa cuánto esperó el lock (espera_ms) y cuánto frenó a los escritores (bloqueo_ms).
+
+    AUTO_VACUUM_INCREMENTAL = 2
+
+    def __init__(
+        self,
+        ruta_bd: str | None = None,
+        paginas_por_paso: int = 512,
+        max_pasos: int = 64,
+        pausa: float = 0.05,
+        umbral_vacuum: float = 0.25,
+        limite_wal: int = 64 * 1024 * 1024,
+        ventana: tuple[str, str] = ("03:00", "05:00"),
+        ventas_max_ventana: int = 10,
+        minutos_actividad: int = 10,
+        limite_analisis: int = 400,
+        timeout: float = 5.0
+    ):
+        self.ruta_bd = ruta_bd or RepositorioEventos.DB
+        self.paginas_por_paso = paginas_por_paso
+        self.max_pasos = max_pasos
+        self.pausa = pausa
+        self.umbral_vacuum = umbral_vacuum
+        self.limite_wal = limite_wal
+        self.ventana = tuple(datetime.strptime(hora, "%H:%M").time() for hora in ventana)
+        self.ventas_max_ventana = ventas_max_ventana
+        self.minutos_actividad = minutos_actividad
+        self.limite_analisis = limite_analisis
+        self.timeout = timeout
+
+    def medir(self, conexion: sqlite3.Connection) -> dict:
+        page_size = conexion.execute("PRAGMA page_size").fetchone()[0]
+        paginas = conexion.execute("PRAGMA page_count").fetchone()[0]
+        libres = conexion.execute("PRAGMA freelist_count").fetchone()[0]
+        ruta_wal = f"{self.ruta_bd}-wal"
+        return {
+            "page_size": page_size,
+            "paginas": paginas,
+            "paginas_libres": libres,
+            "fragmentacion": round(libres / paginas, 4) if paginas else 0.0,
+            "auto_vacuum": conexion.execute("PRAGMA auto_vacuum").fetchone()[0],
+            "bytes_wal": os.path.getsize(ruta_wal) if os.path.exists(ruta_wal) else 0,
+        }
+
+    def en_ventana(self, ahora: datetime | None = None) -> bool:
+        hora = (ahora or datetime.now()).time()
+        inicio, fin = self.ventana
+        if inicio <= fin:
+            return inicio <= hora < fin
+        #Ventana que cruza la medianoche, por ejemplo 23:00-02:00
+        return hora >= inicio or hora < fin
+
+    def ventas_recientes(self, conexion: sqlite3.Connection) -> int:
+        desde = datetime.fromtimestamp(time.time() - self.minutos_actividad * 60).strftime("%Y-%m-%d %H:%M:%S")
+        return conexion.execute("SELECT COUNT(*) FROM ventas WHERE fecha_venta >= ?", (desde,)).fetchone()[0]
+
+    def poco_trafico(self, conexion: sqlite3.Connection) -> bool:
+        return self.en_ventana() and self.ventas_recientes(conexion) <= self.ventas_max_ventana
+
+    def _paso(
+        self,
+        conexion: sqlite3.Connection,
+        nombre: str,
+        sentencia: str,
+        transaccion: bool = True,
+        repeticiones: int = 1
+    ) -> dict:
+        #Ejecuta un paso y mide la espera del lock y el tiempo que tuvo la base tomada.
+        #Los pasos sin transacción (checkpoint, VACUUM) cuentan su duración completa
+        inicio = time.perf_counter()
+        if transaccion:
+            conexion.execute("BEGIN IMMEDIATE")
+        tomado = time.perf_counter()
+        try:
+            for _ in range(repeticiones):
+                resultado = conexion.execute(sentencia).fetchall()
+            if transaccion:
+                conexion.execute("COMMIT")
+        except BaseException:
+            if conexion.in_transaction:
+                conexion.execute("ROLLBACK")
+            raise
+        fin = time.perf_counter()
+        paso = {
+            "paso": nombre,
+            "espera_ms": round((tomado - inicio) * 1000, 3),
+            "bloqueo_ms": round((fin - tomado) * 1000, 3),
+            "resultado": resultado[0] if len(resultado) == 1 else None,
+        }
+        metricas.observar(f"mantenimiento.bloqueo.{nombre.split('(')[0]}", paso["bloqueo_ms"])
+        return paso
+
+    def ejecutar(self) -> dict:
+        #Una pasada de mantenimiento; devuelve el informe con cada paso
+        conexion = sqlite3.connect(self.ruta_bd, timeout=self.timeout, isolation_level=None)
+        try:
+            antes = self.medir(conexion)
+            tranquilo = self.poco_trafico(conexion)
+            pasos = [self._paso(conexion, "wal_checkpoint(PASSIVE)", "PRAGMA wal_checkpoint(PASSIVE)", transaccion=False)]
+
+            vacuum_completo = tranquilo and (
+                antes["fragmentacion"] >= self.umbral_vacuum
+                or antes["auto_vacuum"] != self.AUTO_VACUUM_INCREMENTAL
+            )
+            if vacuum_completo:
+                conexion.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                pasos.append(self._paso(conexion, "vacuum", "VACUUM", transaccion=False))
+            elif antes["auto_vacuum"] == self.AUTO_VACUUM_INCREMENTAL:
+                for _ in range(self.max_pasos):
+                    if conexion.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+                        break
+                    #incremental_vacuum no devuelve filas y el módulo sqlite3 avanza la sentencia
+                    #un solo paso, que libera una página: por eso se repite dentro de la transacción
+                    pasos.append(self._paso(
+                        conexion, "incremental_vacuum", "PRAGMA incremental_vacuum(1)",
+                        repeticiones=self.paginas_por_paso
+                    ))
+                    time.sleep(self.pausa)
+
+            conexion.execute(f"PRAGMA analysis_limit={int(self.limite_analisis)}")
+            pasos.append(self._paso(conexion, "optimize", "PRAGMA optimize"))
+
+            despues = self.medir(conexion)
+            if tranquilo and (vacuum_completo or despues["bytes_wal"] > self.limite_wal):
+                #TRUNCATE espera a los lectores y frena a los escritores mientras dura
+                pasos.append(self._paso(conexion, "wal_checkpoint(TRUNCATE)", "PRAGMA wal_checkpoint(TRUNCATE)", transaccion=False))
+                despues = self.medir(conexion)
+        finally:
+            conexion.close()
+        return {
+            "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "poco_trafico": tranquilo,
+            "vacuum_completo": vacuum_completo,
+            "antes": antes,
+            "despues": despues,
+            "pasos": pasos,
+            "bloqueo_total_ms": round(sum(paso["bloqueo_ms"] for paso in pasos), 3),
+            "bloqueo_max_ms": max(paso["bloqueo_ms"] for paso in pasos),
+        }
+
+
+class ServicioArchivoVentas:
+    #Mueve las ventas de eventos ya realizados (eventos.fecha anterior a hoy menos
+    #`dias_gracia`) a un archivo SQLite por período de la fecha del evento
+    #(ventas_AAAA.db o ventas_AAAA-MM.db en `directorio`), así la base principal, sus
+    #respaldos y su VACUUM no crecen con los años de historial.
+    #Cada lote (`tamano_lote` ventas) es una transacción que copia las filas al archivo
+    #adjunto, suma sus totales en ventas_archivadas y las borra de la tabla caliente, con
+    #una pausa entre lotes. Los resúmenes (resumen_ventas_hora, resumen_clientes) no se tocan:
+    #siguen cubriendo todo el historial. Con WAL la transacción es atómica en cada archivo
+    #pero no entre ambos: si se corta entre los dos commits quedan filas repetidas en el
+    #archivo y en la tabla caliente, y la próxima pasada las termina de mover (INSERT OR IGNORE).
+
+    PERIODOS = {"anual": 4, "mensual": 7}
+
+    def __init__(
+        self,
+        ruta_bd: str | None = None,
+        directorio: str = "archivo_ventas",
+        dias_gracia: int = 30,
+        periodo: str = "anual",
+        tamano_lote: int = 5000,
+        pausa: float = 0.05,
+        timeout: float = 5.0
+    ):
+        if periodo not in self.PERIODOS:
+            raise ValueError(f"Período de archivo no soportado: {periodo}")
+        self.ruta_bd = ruta_bd or RepositorioVentas.DB
+        self.directorio = directorio
+        self.dias_gracia = dias_gracia
+        self.largo_periodo = self.PERIODOS[periodo]
+        self.tamano_lote = tamano_lote
+        self.pausa = pausa
+        self.timeout = timeout
+
+    def _preparar_archivo(self, conexion: sqlite3.Connection, ruta: str) -> None:
+        #La tabla del archivo copia las columnas actuales de ventas (sin claves foráneas:
+        #eventos queda en la base principal); si la principal ganó columnas, se agregan
+        columnas = conexion.execute("PRAGMA main.table_info(ventas)").fetchall()
+        archivo = sqlite3.connect(ruta, timeout=self.timeout)
+        try:
+            #En WAL, los pools que leen el archivo adjunto no bloquean el commit de cada lote
+            archivo.execute("PRAGMA journal_mode=WAL")
+            definiciones = [
+                f"{nombre} {tipo}" + (" PRIMARY KEY" if clave else "")
+                for _, nombre, tipo, _, _, clave in columnas
+            ]
+            archivo.execute(f"CREATE TABLE IF NOT EXISTS ventas ({', '.join(definiciones)})")
+            existentes = {fila[1] for fila in archivo.execute("PRAGMA table_info(ventas)")}
+            for _, nombre, tipo, _, _, _ in columnas:
+                if nombre not in existentes:
+                    archivo.execute(f"ALTER TABLE ventas ADD COLUMN {nombre} {tipo}")
+            archivo.execute("CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas (fecha_venta, id)")
+            archivo.execute("CREATE INDEX IF NOT EXISTS idx_ventas_evento ON ventas (evento_id)")
+            archivo.commit()
+        finally:
+            archivo.close()
+
+    def _mover_lote(self, conexion: sqlite3.Connection, esquema: str, periodo: str, eventos: str, columnas: str) -> int:
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            ids = conexion.execute("""
+                SELECT json_group_array(id) FROM (
+                    SELECT id FROM main.ventas
+                    WHERE evento_id IN (SELECT value FROM json_each(?))
+                    LIMIT ?
+                )
+            """, (eventos, self.tamano_lote)).fetchone()[0]
+            movidas = conexion.execute(f"""
+                INSERT OR IGNORE INTO {esquema}.ventas ({columnas})
+                SELECT {columnas} FROM main.ventas WHERE id IN (SELECT value FROM json_each(?))
+            """, (ids,)).rowcount
+            conexion.execute("""
+                INSERT INTO ventas_archivadas (evento_id, periodo, ventas, boletos, ingresos)
+                SELECT evento_id, ?, COUNT(*), SUM(cantidad_boletos), SUM(total)
+                FROM main.ventas WHERE id IN (SELECT value FROM json_each(?))
+                GROUP BY evento_id
+                ON CONFLICT (evento_id) DO UPDATE SET
+                    ventas = ventas + excluded.ventas,
+                    boletos = boletos + excluded.boletos,
+                    ingresos = ingresos + excluded.ingresos
+            """, (periodo, ids))
+            borradas = conexion.execute(
+                "DELETE FROM main.ventas WHERE id IN (SELECT value FROM json_each(?))", (ids,)
+            ).rowcount
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+        metricas.incrementar("archivo.ventas_movidas", borradas)
+        if movidas != borradas:
+            #Filas que ya estaban en el archivo por una pasada interrumpida
+            metricas.incrementar("archivo.ventas_repetidas", borradas - movidas)
+        return borradas
+
+    def archivar(self) -> dict:
+        #Una pasada de archivo; devuelve {período: ventas movidas}
+        limite = (datetime.now() - timedelta(days=self.dias_gracia)).strftime("%Y-%m-%d")
+        os.makedirs(os.path.join(os.path.dirname(os.path.abspath(self.ruta_bd)), self.directorio), exist_ok=True)
+        conexion = sqlite3.connect(self.ruta_bd, timeout=self.timeout, isolation_level=None)
+        movidas = {}
+        try:
+            por_periodo = {}
+            for evento_id, fecha in conexion.execute("""
+                SELECT id, fecha FROM eventos
+                WHERE fecha < ? AND id IN (SELECT DISTINCT evento_id FROM ventas)
+            """, (limite,)):
+                por_periodo.setdefault(fecha[:self.largo_periodo], []).append(evento_id)
+            columnas = ", ".join(fila[1] for fila in conexion.execute("PRAGMA main.table_info(ventas)"))
+            for periodo, eventos in sorted(por_periodo.items()):
+                archivo = os.path.join(self.directorio, f"ventas_{periodo}.db")
+                ruta = os.path.join(os.path.dirname(os.path.abspath(self.ruta_bd)), archivo)
+                self._preparar_archivo(conexion, ruta)
+                conexion.execute(
+                    "INSERT OR IGNORE INTO particiones_ventas (periodo, archivo) VALUES (?, ?)", (periodo, archivo)
+                )
+                esquema = adjuntar_archivo(conexion, periodo, ruta)
+                movidas[periodo] = 0
+                with metricas.medir("archivo.periodo"):
+                    while True:
+                        cantidad = self._mover_lote(conexion, esquema, periodo, json.dumps(eventos), columnas)
+                        movidas[periodo] += cantidad
+                        if cantidad < self.tamano_lote:
+                            break
+                        time.sleep(self.pausa)
+                conexion.execute(f"DETACH DATABASE {esquema}")
+        finally:
+            conexion.close()
+        return movidas
 
 
 
 # 5 Hilos
 class HiloSimuladorComprasConcurrentes(threading.Thread):
     # Simula varias personas comprando boletos al mismo tiempo.
-    def __init__(self, gestor_ventas, intervalo_min=30, intervalo_max=45):
+    # esperar_siguiente, elegir_evento e intentar_compra se pueden redefinir para generar
+    # otros patrones de carga (ver benchmark_compras.py).
+    NOMBRES = ["Ana", "Luis", "Pedro", "Sofía", "Juan", "Lucía", "Carlos", "María"]
+    GMAILS = ["ana@gmail.com", "luis@gmail.com", "pedro@gmail.com", "sofia@gmail.com", "juan@gmail.com", "lucia@gmail.com", "carlos@gmail.com", "maria@gmail.com"]
+
+    def __init__(
+        self,
+        gestor_ventas,
+        intervalo_min=30,
+        intervalo_max=45,
+        coordinador=None,
+        cantidad_max=3,
+        omitir_agotados=True,
+        semilla=None
+    ):
         super().__init__()
         self.daemon = True
         self.activo = True
         self.gestor_ventas = gestor_ventas
+        self.coordinador = coordinador
         self.intervalo_min = intervalo_min
         self.intervalo_max = intervalo_max
+        self.cantidad_max = cantidad_max
+        self.omitir_agotados = omitir_agotados
+        self.aleatorio = random.Random(semilla)
+        self._detenido = threading.Event()
+
+    def esperar_siguiente(self) -> None:
+        # Espera aleatoria entre intentos de compra (detener() la interrumpe)
+        self._detenido.wait(self.aleatorio.uniform(self.intervalo_min, self.intervalo_max))
+
+    def detener(self) -> None:
+        self.activo = False
+        self._detenido.set()
+
+    def elegir_evento(self, eventos: List[Evento]) -> Evento:
+        return self.aleatorio.choice(eventos)
+
+    def intentar_compra(self):
+        # Un intento de compra; devuelve el resultado (desempaquetable como (exito, mensaje))
+        # o None si no había nada para comprar
+        eventos = self.gestor_ventas.inventario.listar_eventos()
+        if not eventos:
+            return None
+        evento = self.elegir_evento(eventos)
+        disponibles = evento.restantes
+        if disponibles <= 0 and self.omitir_agotados:
+            return None
+        tope = min(self.cantidad_max, disponibles) if self.omitir_agotados else self.cantidad_max
+        cantidad = self.aleatorio.randint(1, tope)
+        nombre = self.aleatorio.choice(self.NOMBRES)
+        gmail = self.aleatorio.choice(self.GMAILS)
+        # Con coordinador sólo se compite por el lock de este evento
+        if self.coordinador is not None:
+            return self.coordinador.comprar(evento.id, nombre, gmail, cantidad)
+        return self.gestor_ventas.vender_boletos(evento.id, nombre, gmail, cantidad)
 
     def run(self):
-        import random
-        nombres = ["Ana", "Luis", "Pedro", "Sofía", "Juan", "Lucía", "Carlos", "María"]
-        gmails = ["ana@gmail.com", "luis@gmail.com", "pedro@gmail.com", "sofia@gmail.com", "juan@gmail.com", "lucia@gmail.com", "carlos@gmail.com", "maria@gmail.com"]
         while self.activo:
             try:
-                # Espera aleatoria entre intentos de compra
-                time.sleep(random.randint(self.intervalo_min, self.intervalo_max))
-                eventos = self.gestor_ventas.repositorio_eventos.listar_eventos()
-                if not eventos:
-                    continue
-                evento = random.choice(eventos)
-                disponibles = evento.boletos_disponibles - evento.boletos_vendidos
-                if disponibles <= 0:
+                self.esperar_siguiente()
+                if not self.activo:
+                    break
+                with metricas.medir("hilos.simulador_compras"):
+                    resultado = self.intentar_compra()
+                if resultado is None:
                     continue
-                cantidad = random.randint(1, min(3, disponibles))
-                nombre = random.choice(nombres)
-                gmail = random.choice(gmails)
-                # Intenta comprar usando el lock global
-                if compra_lock.acquire(blocking=False):
-                    try:
-                        exito, mensaje = self.gestor_ventas.vender_boletos(evento.id, nombre, gmail, cantidad)
-                        if exito:
-                            print(f"[Simulación] {mensaje}")
-                        else:
-                            print(f"[Simulación] Falló compra: {mensaje}")
-                        # Simula el tiempo de procesamiento de la compra (lock ocupado)
-                        tiempo_procesando = random.randint(60, 120)
-                        print(f"[Simulación] Procesando compra durante {tiempo_procesando} segundos...")
-                        time.sleep(tiempo_procesando)
-                    finally:
-                        compra_lock.release()
+                exito, mensaje = resultado
+                if exito:
+                    print(f"[Simulación] {mensaje}")
                 else:
-                    # Otra compra está en curso
-                    pass
+                    print(f"[Simulación] Falló compra: {mensaje}")
             except Exception as e:
                 print(f"Error en simulador de compras: {e}")
                 pass
 
 class HiloProcesadorVentas(threading.Thread):
-    #Hilo para procesar ventas pendientes en segundo plano
+    #Hilo para procesar ventas pendientes en segundo plano: vuelca la ColaVentasPendientes
+    #por lotes, apenas se junta un lote completo o cada `intervalo` segundos
     
-    def __init__(self):
+    def __init__(self, cola: ColaVentasPendientes | None = None, intervalo: float = 0.5):
         super().__init__()
         self.daemon = True
         self.activo = True
+        self.cola = cola
+        self.intervalo = intervalo
 
     def run(self):
         #Ejecuta el procesamiento de ventas en segundo plano
         while self.activo:
             try:
-                time.sleep(5)
-            except:
-                pass
+                if self.cola is None:
+                    time.sleep(5)
+                    continue
+                self.cola.esperar_lote(self.intervalo)
+                with metricas.medir("hilos.procesador_ventas"):
+                    while self.cola.vaciar() == self.cola.tamano_lote:
+                        pass
+            except Exception as e:
+                print(f"Error procesando ventas pendientes: {e}")
+                time.sleep(self.intervalo)
+
+    def detener(self) -> None:
+        #Detiene el hilo y vuelca lo que haya quedado en la cola
+        self.activo = False
+        if self.cola is not None:
+            self.cola.despertar()
+        self.join()
+        if self.cola is not None:
+            self.cola.vaciar_todo()
 
 
 class HiloMonitorEventos(threading.Thread):
-    #Hilo para monitorear eventos con baja disponibilidad
+    #Hilo para monitorear eventos con baja disponibilidad.
+    #Reacciona a los avisos de TEMA_INVENTARIO en lugar de consultar la base periódicamente.
+    #Cada evento alerta una sola vez al bajar de `umbral` (y otra al agotarse) y sólo vuelve
+    #a alertar después de recuperarse por encima de `umbral + histeresis`.
     
-    def __init__(self):
+    def __init__(self, umbral: int = 5, histeresis: int = 3):
         super().__init__()
         self.daemon = True
         self.activo = True
+        self.umbral = umbral
+        self.histeresis = histeresis
+        self._avisos = queue.SimpleQueue()
+        self._estado = {}
+
+    def _recibir(self, datos: dict) -> None:
+        self._avisos.put(datos)
+
+    NIVELES = {None: 0, "bajo": 1, "agotado": 2}
+
+    def evaluar(self, evento_id: int, nombre: str, disponibles: int) -> str | None:
+        #Devuelve la alerta a emitir, o None si no corresponde (ya emitida o sin agravarse)
+        anterior = self._estado.get(evento_id)
+        if disponibles <= 0:
+            nivel = "agotado"
+        elif disponibles <= self.umbral:
+            nivel = "bajo"
+        elif anterior is not None and disponibles <= self.umbral + self.histeresis:
+            #Dentro de la banda de histéresis el evento sigue alertado
+            nivel = "bajo"
+        else:
+            nivel = None
+        self._estado[evento_id] = nivel
+        if self.NIVELES[nivel] <= self.NIVELES[anterior]:
+            return None
+        if nivel == "agotado":
+            return f"ALERTA: Evento '{nombre}' agotó sus boletos"
+        # Alerta por baja disponibilidad de boletos
+        return f"ALERTA: Evento '{nombre}' tiene solo {disponibles} boletos disponibles"
 
     def run(self):
         #Monitoreo de disponibilidad de boletos
-        while self.activo:
-            try:
-                repositorio_eventos = RepositorioEventos()
-                eventos = repositorio_eventos.listar_eventos()
-                
-                for evento in eventos:
-                    disponibles = evento.boletos_disponibles - evento.boletos_vendidos
-                    if disponibles <= 5 and disponibles > 0:
-                        # Alerta por baja disponibilidad de boletos
-                        print(f"ALERTA: Evento '{evento.nombre}' tiene solo {disponibles} boletos disponibles")
-                
-                time.sleep(10)
-            except Exception as e:
-                print(f"Error en monitoreo de eventos: {e}")
-                pass
+        bus_notificaciones.suscribir(TEMA_INVENTARIO, self._recibir)
+        try:
+            #Estado inicial con una sola lectura; después sólo se procesan avisos
+            for evento in obtener_inventario().listar_eventos():
+                self._recibir({
+                    "evento_id": evento.id,
+                    "nombre": evento.nombre,
+                    "disponibles": evento.restantes,
+                })
+            while self.activo:
+                try:
+                    datos = self._avisos.get(timeout=1)
+                except queue.Empty:
+                    continue
+                try:
+                    with metricas.medir("hilos.monitor_eventos"):
+                        alerta = self.evaluar(datos["evento_id"], datos["nombre"], datos["disponibles"])
+                    if alerta:
+                        metricas.incrementar("monitor.alertas")
+                        print(alerta)
+                except Exception as e:
+                    print(f"Error en monitoreo de eventos: {e}")
+        finally:
+            bus_notificaciones.desuscribir(TEMA_INVENTARIO, self._recibir)
 
 
 class HiloGeneradorReportes(threading.Thread):
-    #Genera reportes automáticos
+    #Genera reportes automáticos a partir de las tablas de resumen.
+    #ejecutar() es una pasada; run() la repite cada `intervalo` segundos
+    #(GestorConcurrencia la programa en su PlanificadorTareas en lugar de usar el hilo)
     
-    def __init__(self):
+    def __init__(self, intervalo: float = 360, ruta_reporte: str = "reporte_ventas.json"):
         super().__init__()
         self.daemon = True
         self.activo = True
+        self.intervalo = intervalo
+        self.ruta_reporte = ruta_reporte
+        self._repositorio = None
+
+    def ejecutar(self) -> None:
+        if self._repositorio is None:
+            self._repositorio = RepositorioReportes()
+        with metricas.medir("hilos.generador_reportes"):
+            reporte = self._repositorio.generar_reporte()
+        totales = reporte["totales"]
+        
+        if totales["total_ventas"]:
+            #Guardar el reporte
+            guardar_reporte(reporte, self.ruta_reporte)
+            print(f"Reporte generado: {totales['total_ventas']} ventas, ${totales['ingresos_totales']:.2f} en ingresos")
 
     def run(self):
         #Ejecuta la generación de reportes automáticos
         while self.activo:
             try:
-                repositorio_ventas = RepositorioVentas()
-                ventas = repositorio_ventas.listar_ventas()
-                
-                if ventas:
-                    total_ventas = len(ventas)
-                    total_ingresos = sum(venta.total for venta in ventas)
-                    #Guardar el reporte
-                    print(f"Reporte generado: {total_ventas} ventas, ${total_ingresos:.2f} en ingresos")
-                
-                time.sleep(360)
+                self.ejecutar()
+                time.sleep(self.intervalo)
             except Exception as e:
                 print(f"Error generando reporte: {e}")
                 pass
 
 
 class HiloRespaldoAutomatico(threading.Thread):
-    #Realizar respaldos automáticos
+    #Realizar respaldos automáticos (ejecutar() crea uno; run() lo repite cada `intervalo`)
     
-    def __init__(self):
+    def __init__(self, intervalo: float = 300, conservar: int = 12):
         super().__init__()
         self.daemon = True
         self.activo = True
+        self.intervalo = intervalo
+        self.conservar = conservar
+        self._servicio = None
+
+    def ejecutar(self) -> None:
+        if self._servicio is None:
+            self._servicio = ServicioRespaldos(conservar=self.conservar)
+        with metricas.medir("hilos.respaldo_automatico"):
+            ruta_respaldo = self._servicio.crear_respaldo("respaldo_entradas")
+        print(f"Respaldo automático creado: {ruta_respaldo}")
 
     def run(self):
         #Ejecuta el respaldo automático de la base de datos
         while self.activo:
             try:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                ruta_respaldo = f"respaldo_entradas_{timestamp}.db"
-                shutil.copy2("entradas.db", ruta_respaldo)
-                print(f"Respaldo automático creado: {ruta_respaldo}")
-                time.sleep(300) 
+                self.ejecutar()
+                time.sleep(self.intervalo) 
             except Exception as e:
                 print(f"Error en respaldo automático: {e}")
                 pass
 
 
 class HiloSincronizadorDatos(threading.Thread):
-    #Sincronizar datos entre tablas
+    #Sincronizar datos entre tablas.
+    #Cada pasada suma sólo las ventas nuevas desde la última marca (ventas.id) con una
+    #consulta agrupada; cada `verificacion_completa_cada` pasadas recalcula todo desde cero.
     
-    def __init__(self):
+    def __init__(
+        self,
+        intervalo: float = 30,
+        verificacion_completa_cada: int = 20,
+        cola: ColaVentasPendientes | None = None
+    ):
         super().__init__()
         self.daemon = True
         self.activo = True
+        self.intervalo = intervalo
+        self.cola = cola
+        self.verificacion_completa_cada = verificacion_completa_cada
+        self._totales = {}
+        self._marca = None
+        self._archivadas = None
+        self._pasadas = 0
+        self._repositorios = None
+
+    def sincronizar(self, repositorio_eventos, repositorio_ventas) -> dict:
+        #Devuelve las correcciones aplicadas {evento_id: nuevo_total}
+        completa = self._marca is None or self._pasadas % self.verificacion_completa_cada == 0
+        self._pasadas += 1
+        #Ventas y contadores se leen en la misma instantánea. Con escritura diferida, mientras
+        #dura la lectura no se vuelcan lotes y se omiten los eventos con ventas en vuelo
+        #(reservadas pero todavía no registradas), que se leen después de fijar la instantánea
+        with self.cola.pausar_vaciado() if self.cola is not None else nullcontext():
+            with repositorio_eventos.pool.transaccion(inmediata=False):
+                #Si se archivaron ventas desde la pasada anterior hay que recalcular todo
+                archivadas = repositorio_ventas.ventas_archivadas()
+                completa = completa or archivadas != self._archivadas
+                self._archivadas = archivadas
+                if completa:
+                    self._totales, marca = repositorio_ventas.totales_boletos_por_evento()
+                else:
+                    nuevos, marca = repositorio_ventas.totales_boletos_por_evento(self._marca)
+                    for evento_id, cantidad in nuevos.items():
+                        self._totales[evento_id] = self._totales.get(evento_id, 0) + cantidad
+                contadores = repositorio_eventos.contadores_vendidos()
+                en_vuelo = self.cola.boletos_en_vuelo() if self.cola is not None else {}
+        self._marca = max(marca, self._marca or 0)
+
+        correcciones = {}
+        for evento_id, vendidos in contadores.items():
+            total_vendido = self._totales.get(evento_id, 0)
+            if total_vendido != vendidos and evento_id not in en_vuelo:
+                #Se corrige por diferencia para no pisar ventas confirmadas después de la lectura
+                repositorio_eventos.actualizar_boletos_vendidos(evento_id, total_vendido - vendidos)
+                correcciones[evento_id] = total_vendido
+        return correcciones
+
+    def ejecutar(self) -> None:
+        #Una pasada de sincronización
+        if self._repositorios is None:
+            self._repositorios = (RepositorioEventos(), RepositorioVentas())
+        with metricas.medir("hilos.sincronizador"):
+            correcciones = self.sincronizar(*self._repositorios)
+        metricas.incrementar("sincronizador.correcciones", len(correcciones))
+        if correcciones:
+            obtener_inventario().invalidar()
+        for evento_id, total_vendido in correcciones.items():
+            print(f"Sincronizado evento {evento_id}: {total_vendido} boletos vendidos")
 
     def run(self):
         #Ejecuta la sincronización de datos entre tablas
         while self.activo:
             try:
-                repositorio_eventos = RepositorioEventos()
-                repositorio_ventas = RepositorioVentas()
-                
-                eventos = repositorio_eventos.listar_eventos()
-                for evento in eventos:
-                    ventas_evento = repositorio_ventas.obtener_ventas_por_evento(evento.id)
-                    total_vendido = sum(venta.cantidad_boletos for venta in ventas_evento)
-                    
-                    if total_vendido != evento.boletos_vendidos:
-                        # Sincronizar contador
-                        repositorio_eventos.establecer_boletos_vendidos(evento.id, total_vendido)
-                        print(f"Sincronizado evento {evento.id}: {total_vendido} boletos vendidos")
-                
-                time.sleep(30)  
+                self.ejecutar()
+                time.sleep(self.intervalo)  
             except Exception as e:
                 print(f"Error en sincronización: {e}")
                 pass
 
+class HiloExportadorMetricas(threading.Thread):
+    #Vuelca las métricas del proceso a un archivo JSON cada `intervalo` segundos y,
+    #si se indica un puerto, las sirve por HTTP (GET /metricas y /metricas.json)
+
+    def __init__(self, intervalo: float = 30, ruta: str | None = "metricas.json", puerto: int | None = None):
+        super().__init__()
+        self.daemon = True
+        self.activo = True
+        self.intervalo = intervalo
+        self.ruta = ruta
+        self.puerto = puerto
+
+    def ejecutar(self) -> None:
+        if self.ruta:
+            metricas.volcar(self.ruta)
+
+    def run(self):
+        servidor = servir_http(self.puerto) if self.puerto is not None else None
+        proximo = time.monotonic()
+        try:
+            while self.activo:
+                if time.monotonic() >= proximo:
+                    try:
+                        self.ejecutar()
+                    except Exception as e:
+                        print(f"Error exportando métricas: {e}")
+                    proximo = time.monotonic() + self.intervalo
+                #Pausas cortas para que detener_concurrencia no espere un intervalo entero
+                time.sleep(min(0.5, self.intervalo))
+            self.ejecutar()
+        finally:
+            if servidor is not None:
+                servidor.shutdown()
+
+
+def volcar_metricas_proceso(nombre: str) -> None:
+    #Cada proceso tiene su propio registro de métricas y lo deja en metricas_<nombre>.json
+    try:
+        metricas.volcar(f"metricas_{nombre}.json")
+    except OSError as e:
+        print(f"Error exportando métricas de {nombre}: {e}")
+
+
 #3 Procesos 
 
 class ProcesoCalculoEstadisticas(multiprocessing.Process):
-    #Proceso para calcular estadísticas 
+    #Proceso para calcular estadísticas periódicamente (con repetir=False, una sola vez)
     
+    def __init__(self, intervalo: float = 600, repetir: bool = True):
+        super().__init__()
+        self.intervalo = intervalo
+        self.repetir = repetir
+
     def run(self):
-        #Se calculan las estadisticas
-        try:
-            with sqlite3.connect("entradas.db") as conexion:
-                cursor = conexion.cursor()
-                cursor.execute("""
-                    SELECT 
-                        COUNT(*) as total_ventas,
-                        SUM(total) as ingresos_totales,
-                        AVG(total) as promedio_venta,
-                        COUNT(DISTINCT evento_id) as eventos_con_ventas
-                    FROM ventas
-                """)
-                estadisticas = cursor.fetchone()
+        #Se calculan las estadisticas a partir de los resúmenes, cada `intervalo` segundos
+        metricas.reiniciar()
+        repositorio_reportes = RepositorioReportes()
+        while True:
+            try:
+                with metricas.medir("procesos.calculo_estadisticas"):
+                    estadisticas = repositorio_reportes.totales()
                 #Se guardan las estadisticas
-                if estadisticas:
-                    total_ventas, ingresos_totales, promedio_venta, eventos_con_ventas = estadisticas
-                    print(f"Estadísticas calculadas: {total_ventas} ventas, ${ingresos_totales or 0:.2f} ingresos, ${promedio_venta or 0:.2f} promedio por venta, {eventos_con_ventas} eventos con ventas")
-        except Exception as e:
-            print(f"Error calculando estadísticas: {e}")
-            pass
+                print(
+                    f"Estadísticas calculadas: {estadisticas['total_ventas']} ventas, "
+                    f"${estadisticas['ingresos_totales']:.2f} ingresos, "
+                    f"${estadisticas['promedio_venta']:.2f} promedio por venta, "
+                    f"{estadisticas['eventos_con_ventas']} eventos con ventas"
+                )
+            except Exception as e:
+                print(f"Error calculando estadísticas: {e}")
+                pass
+            volcar_metricas_proceso(type(self).__name__)
+            if not self.repetir:
+                break
+            time.sleep(self.intervalo)
 
 
 class ProcesoRespaldoCompleto(multiprocessing.Process):
-    #Respaldar la base de datos con compresión
+    #Respaldar la base de datos con compresión (base completa o incremental)
+    #después de `espera` segundos (0 cuando lo lanza el planificador)
     
+    def __init__(self, espera: float = 1000, formato: str = "xz", completo_cada: int = 24):
+        super().__init__()
+        self.espera = espera
+        self.formato = formato
+        self.completo_cada = completo_cada
+
     def run(self):
         #Se respalda la base de datos
+        metricas.reiniciar()
         try:
-            time.sleep(1000)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            ruta_respaldo = f"respaldo_completo_{timestamp}.db"
-            shutil.copy2("entradas.db", ruta_respaldo)
-            print(f"Respaldo completo creado: {ruta_respaldo}")
+            if self.espera:
+                time.sleep(self.espera)
+            servicio = ServicioRespaldosComprimidos(formato=self.formato, completo_cada=self.completo_cada)
+            with metricas.medir("procesos.respaldo_completo"):
+                ruta_respaldo = servicio.respaldar("respaldo_completo")
+            if ruta_respaldo is None:
+                print("Respaldo completo: sin cambios desde el último respaldo")
+            else:
+                print(f"Respaldo completo creado: {ruta_respaldo}")
         except Exception as e:
             print(f"Error en respaldo completo: {e}")
             pass
+        volcar_metricas_proceso(type(self).__name__)
 
 
 class ProcesoMantenimientoBaseDatos(multiprocessing.Process):
-    #Mantener y optimizar la base de datos
+    #Mantener y optimizar la base de datos con ServicioMantenimiento;
+    #el informe de cada pasada queda en `ruta_informe`
     
+    def __init__(self, ruta_informe: str = "mantenimiento.json", **opciones):
+        super().__init__()
+        self.ruta_informe = ruta_informe
+        self.opciones = opciones
+
     def run(self):
         #Se ejecuta
+        metricas.reiniciar()
         try:
-            with sqlite3.connect("entradas.db") as conexion:
-                cursor = conexion.cursor()
-                cursor.execute("VACUUM")
-                cursor.execute("ANALYZE")
-                print("Mantenimiento de base de datos completado")
+            with metricas.medir("procesos.mantenimiento"):
+                informe = ServicioMantenimiento(**self.opciones).ejecutar()
+            guardar_reporte(informe, self.ruta_informe)
+            print(
+                f"Mantenimiento de base de datos completado: fragmentación "
+                f"{informe['antes']['fragmentacion']:.1%} -> {informe['despues']['fragmentacion']:.1%}, "
+                f"{'VACUUM completo, ' if informe['vacuum_completo'] else ''}"
+                f"bloqueo total {informe['bloqueo_total_ms']:.1f} ms (máximo {informe['bloqueo_max_ms']:.1f} ms)"
+            )
         except Exception as e:
             print(f"Error en mantenimiento de BD: {e}")
             pass
-
-# Lock global para simular acceso concurrente a la compra de boletos
-compra_lock = threading.Lock()
-
-
+        volcar_metricas_proceso(type(self).__name__)
 
 
+if __name__ == "__main__":
+    #Restauración: python capa_datos.py restaurar <manifiesto.json> <destino.db>
+    import sys
+    if len(sys.argv) == 4 and sys.argv[1] == "restaurar":
+        ServicioRespaldosComprimidos(formato="xz").restaurar(sys.argv[2], sys.argv[3])
+        print(f"Base restaurada en {sys.argv[3]}")
+    else:
+        print("Uso: python capa_datos.py restaurar <manifiesto.json> <destino.db>")
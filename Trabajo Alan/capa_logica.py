@@ -1,8 +1,34 @@
 # Capa de lógica de negocio del sistema de venta de boletos
 
+import csv
 import datetime
+import heapq
+import itertools
+import math
+import multiprocessing
+import os
+import queue
+import random
 import sqlite3
-from capa_datos import RepositorioEventos, RepositorioVentas, Evento, compra_lock, HiloSimuladorComprasConcurrentes
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from capa_datos import (
+    RepositorioEventos,
+    RepositorioVentas,
+    RepositorioAsientos,
+    RepositorioRetenciones,
+    MapaAsientos,
+    Evento,
+    ColaVentasPendientes,
+    HiloSimuladorComprasConcurrentes,
+    configurar_base_datos,
+    obtener_inventario,
+    obtener_pool,
+    volcar_metricas_proceso
+)
+from metricas import metricas
 
 
 class GestorEventos:
@@ -10,6 +36,7 @@ class GestorEventos:
     
     def __init__(self):
         self.repositorio_eventos = RepositorioEventos()
+        self.inventario = obtener_inventario(self.repositorio_eventos.DB)
 
     def crear_evento(
         self,
@@ -21,114 +48,1642 @@ class GestorEventos:
     ) -> None:
         """Crea un nuevo evento en el sistema"""
         self.repositorio_eventos.insertar_evento(nombre, fecha, lugar, precio, disponibles)
+        self.inventario.invalidar()
+
+    def crear_eventos_lote(self, eventos, tamano_lote: int = 1000) -> list[tuple[int, bool, str]]:
+        """Crea muchos eventos en transacciones por lotes.
+
+        `eventos` es cualquier iterable (por ejemplo leer_csv(archivo)) de
+        diccionarios con nombre, fecha, lugar, precio y disponibles, o de
+        tuplas en ese orden. Devuelve (índice, éxito, mensaje) por elemento.
+        """
+        resultados = []
+        indices = itertools.count()
+        iterador = iter(eventos)
+        while True:
+            bloque = list(itertools.islice(iterador, tamano_lote))
+            if not bloque:
+                break
+            filas = []
+            for fila in bloque:
+                indice = next(indices)
+                try:
+                    valores = _campos(fila, ("nombre", "fecha", "lugar", "precio", "disponibles"))
+                    nombre, fecha, lugar = (str(valor).strip() for valor in valores[:3])
+                    precio, disponibles = float(valores[3]), int(valores[4])
+                    datetime.date.fromisoformat(fecha)
+                    if not nombre or not lugar:
+                        raise ValueError("nombre y lugar son obligatorios")
+                    if precio < 0 or disponibles <= 0:
+                        raise ValueError("precio y boletos disponibles deben ser positivos")
+                except (KeyError, IndexError, TypeError, ValueError) as error:
+                    resultados.append((indice, False, f"Evento inválido: {error}"))
+                    continue
+                filas.append((nombre, fecha, lugar, precio, disponibles))
+                resultados.append((indice, True, f"Evento '{nombre}' creado."))
+            with self.repositorio_eventos.pool.transaccion():
+                self.repositorio_eventos.insertar_eventos(filas)
+        self.inventario.invalidar()
+        return resultados
 
     def obtener_eventos(self) -> list[Evento]:
-        """Obtiene todos los eventos del sistema"""
-        return self.repositorio_eventos.listar_eventos()
+        """Obtiene todos los eventos del sistema desde la cache de inventario"""
+        return self.inventario.listar_eventos()
+
+    def crear_mapa_asientos(self, evento_id: int, secciones) -> int:
+        """Asigna asientos numerados a un evento que todavía no vendió boletos.
+
+        `secciones` son tuplas (nombre, filas, asientos_por_fila, prioridad):
+        menor prioridad es mejor ubicación y dentro de cada sección la fila 1
+        es la mejor. La capacidad del evento pasa a ser la cantidad de
+        asientos. Devuelve esa cantidad.
+        """
+        repositorio_asientos = RepositorioAsientos()
+        for nombre, filas, asientos_por_fila, _ in secciones:
+            if not str(nombre).strip() or filas <= 0 or asientos_por_fila <= 0:
+                raise ValueError("Cada sección necesita nombre, filas y asientos por fila positivos")
+        with self.repositorio_eventos.pool.transaccion():
+            evento = self.repositorio_eventos.obtener_evento_por_id(evento_id)
+            if evento is None:
+                raise ValueError("Evento no encontrado.")
+            if evento.boletos_vendidos:
+                raise ValueError("El evento ya vendió boletos; no se puede cambiar su mapa de asientos")
+            if evento.boletos_retenidos:
+                raise ValueError("El evento tiene boletos reservados; no se puede cambiar su mapa de asientos")
+            total = repositorio_asientos.crear_mapa(evento_id, secciones)
+        self.inventario.invalidar()
+        return total
+
+
+class CacheIdempotencia:
+    """Resultados recientes de compras con clave de idempotencia.
+
+    LRU acotada a `capacidad` claves que además descarta las de más de `ttl`
+    segundos; lo que ya no está en memoria se sigue encontrando en la base
+    por el índice único de ventas.clave_idempotencia. Sólo guarda compras
+    exitosas (un rechazo no escribió nada y se puede volver a intentar).
+    Dos pedidos con la misma clave nunca corren a la vez: el segundo espera
+    a que termine el primero.
+    """
+
+    def __init__(self, capacidad: int = 100000, ttl: float = 3600.0):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._resultados = OrderedDict()
+        self._en_curso = {}
+        self._lock = threading.Lock()
+        metricas.registrar_medidor("idempotencia.claves", lambda: len(self._resultados))
+
+    def _vigente(self, clave: str, ahora: float):
+        #Se llama con el lock tomado
+        guardado = self._resultados.get(clave)
+        if guardado is None:
+            return None
+        resultado, guardado_en = guardado
+        if ahora - guardado_en > self.ttl:
+            del self._resultados[clave]
+            return None
+        self._resultados.move_to_end(clave)
+        return resultado
+
+    def tomar_turno(self, clave: str):
+        """El resultado guardado de la clave, o None si quien llama debe procesarla.
+
+        Con None, quien llama queda a cargo de la clave y debe llamar a
+        terminar() aunque falle.
+        """
+        while True:
+            with self._lock:
+                resultado = self._vigente(clave, time.monotonic())
+                if resultado is not None:
+                    return resultado
+                en_curso = self._en_curso.get(clave)
+                if en_curso is None:
+                    self._en_curso[clave] = threading.Event()
+                    return None
+            en_curso.wait()
+
+    def terminar(self, clave: str, resultado=None) -> None:
+        with self._lock:
+            if resultado is not None:
+                self._resultados[clave] = (resultado, time.monotonic())
+                self._resultados.move_to_end(clave)
+                while len(self._resultados) > self.capacidad:
+                    self._resultados.popitem(last=False)
+            self._en_curso.pop(clave).set()
+
+
+#Una por proceso, compartida por todos los GestorVentas
+cache_idempotencia = CacheIdempotencia()
+
+
+#Ventas confirmadas en este proceso por cualquier camino (simple, por lotes, con asientos,
+#con clave o confirmando una retención); el planificador lo usa como medida de carga
+_ventas_realizadas = 0
+_ventas_lock = threading.Lock()
+
+
+def _contar_ventas(ventas: int, boletos: int) -> None:
+    global _ventas_realizadas
+    with _ventas_lock:
+        _ventas_realizadas += ventas
+    metricas.incrementar("compras.exitosas", ventas)
+    metricas.incrementar("compras.boletos", boletos)
+
+
+def ventas_realizadas() -> int:
+    """Total creciente de ventas confirmadas en este proceso"""
+    return _ventas_realizadas
+
+
+def _mensaje_venta(nombre: str, cantidad: int, total: float, fecha_venta: str, asientos: str | None = None) -> str:
+    mensaje = f"Venta exitosa: {cantidad} boleto(s) para '{nombre}' - Total: ${total:.2f} - Fecha: {fecha_venta}"
+    return f"{mensaje} - Asientos: {asientos}" if asientos else mensaje
 
 
 class GestorVentas:
     """Gestor para manejar la lógica de negocio de ventas"""
     
-    def __init__(self):
+    def __init__(self, cola: ColaVentasPendientes | None = None, idempotencia: CacheIdempotencia | None = None):
         self.repositorio_eventos = RepositorioEventos()
         self.repositorio_ventas = RepositorioVentas()  
+        self.repositorio_asientos = RepositorioAsientos()
+        self.inventario = obtener_inventario(self.repositorio_eventos.DB)
+        self.cola = cola
+        self.idempotencia = idempotencia or cache_idempotencia
 
+    @metricas.cronometrar("compras.vender_boletos")
     def vender_boletos(
         self,
         evento_id: int,
         cliente: str,
         gmail: str,
-        cantidad: int
+        cantidad: int,
+        asientos: tuple[str, str, list[int]] | None = None,
+        clave: str | None = None
+    ) -> tuple[bool, str]:
+        """Procesa la venta de boletos para un evento.
+
+        La verificación de disponibilidad y el incremento del contador
+        ocurren en una única sentencia condicional, por lo que no se necesita
+        ningún lock de Python. Sin cola, la venta se registra en la misma
+        transacción; con cola, se confirma sólo la reserva y el registro de la
+        venta se deja en la ColaVentasPendientes para volcarlo por lotes.
+
+        En eventos con mapa de asientos se asignan los mejores `cantidad`
+        asientos contiguos, o los pedidos en `asientos` como
+        (sección, fila, [números]), dentro de la misma transacción que la
+        reserva. Estas ventas se registran siempre en el momento, sin cola,
+        porque la venta guarda la ubicación asignada.
+
+        Con `clave` (de idempotencia) la compra se hace una sola vez: un
+        reintento con la misma clave devuelve el resultado de la compra
+        original desde la CacheIdempotencia, o desde la venta registrada si
+        ya salió de la cache, sin volver a ejecutar la transacción. Estas
+        ventas también se registran en el momento, con la clave.
+        """
+        if clave is None:
+            return self._vender(evento_id, cliente, gmail, cantidad, asientos)
+
+        resultado = self.idempotencia.tomar_turno(clave)
+        if resultado is not None:
+            metricas.incrementar("idempotencia.aciertos")
+            return resultado
+        try:
+            resultado = self._venta_registrada(clave)
+            if resultado is None:
+                try:
+                    resultado = self._vender(evento_id, cliente, gmail, cantidad, asientos, clave)
+                except sqlite3.IntegrityError:
+                    #Otro proceso registró la misma clave al mismo tiempo: vale su venta
+                    resultado = self._venta_registrada(clave)
+                    if resultado is None:
+                        raise
+        finally:
+            self.idempotencia.terminar(clave, resultado if resultado is not None and resultado[0] else None)
+        return resultado
+
+    def _venta_registrada(self, clave: str) -> tuple[bool, str] | None:
+        venta = self.repositorio_ventas.venta_por_clave(clave)
+        if venta is None:
+            return None
+        evento_id, cantidad, total, fecha_venta, asientos = venta
+        evento = self.inventario.obtener_evento(evento_id)
+        metricas.incrementar("idempotencia.aciertos_bd")
+        return True, _mensaje_venta(evento.nombre if evento else f"#{evento_id}", cantidad, total, fecha_venta, asientos)
+
+    def _vender(
+        self,
+        evento_id: int,
+        cliente: str,
+        gmail: str,
+        cantidad: int,
+        asientos=None,
+        clave: str | None = None
     ) -> tuple[bool, str]:
-        """Procesa la venta de boletos para un evento"""
-        eventos = self.repositorio_eventos.listar_eventos()
-        evento = next((evento for evento in eventos if evento.id == evento_id), None)
+        if cantidad <= 0:
+            return False, "La cantidad de boletos debe ser mayor a cero."
+        if asientos is not None and len(set(asientos[2])) != cantidad:
+            return False, "La cantidad de asientos pedidos no coincide con la cantidad de boletos."
 
+        fecha_venta = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        # Nombre y precio salen de la cache; la disponibilidad la decide la base
+        evento = self.inventario.obtener_evento(evento_id)
         if evento is None:
             return False, "Evento no encontrado."
 
-        entradas_restantes = evento.boletos_disponibles - evento.boletos_vendidos
-        if cantidad > entradas_restantes:
-            return False, f"Sólo quedan {entradas_restantes} boletos disponibles."
-
         total = evento.precio * cantidad
+
+        if self.repositorio_asientos.tiene_mapa(evento_id):
+            return self._vender_con_asientos(evento, cliente, gmail, cantidad, total, fecha_venta, asientos, clave)
+        if asientos is not None:
+            return False, "El evento no tiene asientos numerados."
+
+        # Las compras con clave se registran en el momento: la clave vive en la venta
+        cola = self.cola if clave is None else None
+        if cola is not None and not cola.tomar_lugar(evento_id, cantidad):
+            metricas.incrementar("compras.cola_llena")
+            return False, "Hay demasiadas ventas en proceso. Reintente en unos segundos."
+
+        vendidos = None
+        confirmada = False
+        try:
+            with self.repositorio_eventos.pool.transaccion():
+                vendidos = self.repositorio_eventos.reservar_boletos(evento_id, cantidad)
+                if vendidos is not None and cola is None:
+                    # Registrar la venta en la misma transacción que la reserva
+                    self.repositorio_ventas.insertar_venta(
+                        evento_id, cliente, gmail, cantidad, total, fecha_venta, clave_idempotencia=clave
+                    )
+            confirmada = vendidos is not None
+        finally:
+            if cola is not None and not confirmada:
+                cola.devolver_lugar(evento_id, cantidad)
+
+        if vendidos is None:
+            return self._sin_stock(evento_id)
+
+        if cola is not None:
+            cola.encolar(evento_id, cliente, gmail, cantidad, total, fecha_venta)
+
+        return self._venta_exitosa(evento, cantidad, vendidos, total, fecha_venta)
+
+    def _vender_con_asientos(self, evento, cliente, gmail, cantidad, total, fecha_venta, asientos, clave=None) -> tuple[bool, str]:
+        #El mapa se lee y se reescribe con el lock de escritura tomado (BEGIN IMMEDIATE),
+        #así dos compras nunca eligen los mismos asientos
+        with self.repositorio_eventos.pool.transaccion():
+            mapa = self.repositorio_asientos.cargar_mapa(evento.id)
+            ubicacion = _ubicar_asientos(mapa, cantidad, asientos)
+            if ubicacion is None:
+                vendidos = None
+            else:
+                vendidos = self.repositorio_eventos.reservar_boletos(evento.id, cantidad)
+            if vendidos is not None:
+                mapa.ocupar(*ubicacion)
+                self.repositorio_asientos.guardar_fila(mapa, ubicacion[0])
+                descripcion = mapa.describir(*ubicacion)
+                self.repositorio_ventas.insertar_venta(
+                    evento.id, cliente, gmail, cantidad, total, fecha_venta, descripcion, clave
+                )
+
+        if ubicacion is None:
+            return _sin_asientos(cantidad, asientos)
+        if vendidos is None:
+            return self._sin_stock(evento.id)
+
+        return self._venta_exitosa(evento, cantidad, vendidos, total, fecha_venta, descripcion)
+
+    def _sin_stock(self, evento_id: int) -> tuple[bool, str]:
+        actual = self.repositorio_eventos.obtener_evento_por_id(evento_id)
+        if actual is None:
+            self.inventario.invalidar()
+            return False, "Evento no encontrado."
+        self.inventario.actualizar_evento(actual)
+        entradas_restantes = actual.restantes
+        metricas.incrementar("compras.sin_stock")
+        return False, f"Sólo quedan {entradas_restantes} boletos disponibles."
+
+    def _venta_exitosa(self, evento, cantidad, vendidos, total, fecha_venta, asientos=None) -> tuple[bool, str]:
+        self.inventario.actualizar_vendidos(evento.id, vendidos)
+        _contar_ventas(1, cantidad)
+        return True, _mensaje_venta(evento.nombre, cantidad, total, fecha_venta, asientos)
+
+
+    @metricas.cronometrar("compras.vender_boletos_lote")
+    def vender_boletos_lote(self, pedidos, tamano_lote: int = 500) -> list[tuple[int, bool, str]]:
+        """Procesa muchos pedidos en transacciones por lotes.
+
+        `pedidos` es cualquier iterable (por ejemplo leer_csv(archivo)) de
+        diccionarios con evento_id, cliente, gmail y cantidad, o de tuplas en
+        ese orden. Cada lote se valida en una pasada contra la disponibilidad
+        leída dentro de la transacción, y luego se aplican los contadores y se
+        insertan las ventas con executemany. Los pedidos se atienden en orden:
+        si un evento se queda sin boletos, los pedidos siguientes fallan.
+        Devuelve (índice, éxito, mensaje) por pedido.
+        """
+        resultados = []
+        indices = itertools.count()
+        iterador = iter(pedidos)
+        while True:
+            bloque = list(itertools.islice(iterador, tamano_lote))
+            if not bloque:
+                break
+            validos = []
+            for pedido in bloque:
+                indice = next(indices)
+                try:
+                    evento_id, cliente, gmail, cantidad = _campos(pedido, ("evento_id", "cliente", "gmail", "cantidad"))
+                    evento_id, cantidad = int(evento_id), int(cantidad)
+                    if cantidad <= 0:
+                        raise ValueError("la cantidad de boletos debe ser mayor a cero")
+                except (KeyError, IndexError, TypeError, ValueError) as error:
+                    resultados.append((indice, False, f"Pedido inválido: {error}"))
+                    continue
+                validos.append((indice, evento_id, str(cliente).strip(), str(gmail).strip(), cantidad))
+
+            # Los eventos con asientos numerados necesitan asignar ubicación: van de a uno
+            con_mapa = self.repositorio_asientos.eventos_con_mapa({pedido[1] for pedido in validos})
+            if con_mapa:
+                for indice, evento_id, cliente, gmail, cantidad in validos:
+                    if evento_id in con_mapa:
+                        resultados.append((indice, *self.vender_boletos(evento_id, cliente, gmail, cantidad)))
+                validos = [pedido for pedido in validos if pedido[1] not in con_mapa]
+
+            fecha_venta = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ventas = []
+            cantidades = {}
+            with self.repositorio_eventos.pool.transaccion():
+                eventos = self.repositorio_eventos.disponibilidad_eventos({pedido[1] for pedido in validos})
+                restantes = {evento_id: datos[2] - datos[3] for evento_id, datos in eventos.items()}
+                for indice, evento_id, cliente, gmail, cantidad in validos:
+                    if evento_id not in eventos:
+                        resultados.append((indice, False, "Evento no encontrado."))
+                        continue
+                    if cantidad > restantes[evento_id]:
+                        resultados.append((indice, False, f"Sólo quedan {restantes[evento_id]} boletos disponibles."))
+                        continue
+                    nombre, precio = eventos[evento_id][:2]
+                    restantes[evento_id] -= cantidad
+                    cantidades[evento_id] = cantidades.get(evento_id, 0) + cantidad
+                    ventas.append((evento_id, cliente, gmail, cantidad, precio * cantidad, fecha_venta))
+                    resultados.append((indice, True, f"Venta exitosa: {cantidad} boleto(s) para '{nombre}'"))
+                # Con el lock de escritura tomado la condición siempre se cumple; es una salvaguarda
+                if self.repositorio_eventos.sumar_boletos_vendidos(cantidades) != len(cantidades):
+                    raise RuntimeError("La disponibilidad cambió durante el lote")
+                self.repositorio_ventas.insertar_ventas(ventas)
+
+            _contar_ventas(len(ventas), sum(cantidades.values()))
+            for evento_id in cantidades:
+                self.inventario.actualizar_vendidos(evento_id, eventos[evento_id][2] - restantes[evento_id])
+        resultados.sort()
+        return resultados
+
+
+def _ubicar_asientos(mapa: MapaAsientos, cantidad: int, asientos) -> tuple[int, int] | None:
+    """(índice de fila, máscara) de los mejores asientos contiguos o de los pedidos en `asientos`"""
+    if asientos is None:
+        mejores = mapa.mejores(cantidad)
+        if mejores is None:
+            return None
+        indice, inicio = mejores
+        return indice, ((1 << cantidad) - 1) << inicio
+    seccion, fila, numeros = asientos
+    return mapa.buscar(str(seccion), str(fila), sorted(set(numeros)))
+
+
+def _sin_asientos(cantidad: int, asientos) -> tuple[bool, str]:
+    metricas.incrementar("compras.sin_asientos")
+    if asientos is not None:
+        return False, "Los asientos pedidos no existen o ya están ocupados."
+    return False, f"No hay {cantidad} asientos contiguos disponibles."
+
+
+class RuedaTemporizadores:
+    """Rueda de temporizadores (hashed timing wheel) para vencimientos masivos.
+
+    Cada clave cae en la ranura de su instante de vencimiento redondeado a
+    `resolucion` segundos, módulo la cantidad de ranuras. Agregar y cancelar
+    son O(1) y cada tic revisa sólo la ranura que le toca; una clave que
+    vence a más de una vuelta de distancia se saltea hasta su vuelta. No es
+    thread-safe: quien la comparte debe protegerla con un lock.
+    """
+
+    def __init__(self, resolucion: float = 1.0, ranuras: int = 4096):
+        self.resolucion = resolucion
+        self._ranuras = [{} for _ in range(ranuras)]
+        self._ubicacion = {}
+        self._tic = math.floor(time.time() / resolucion)
+
+    def __len__(self) -> int:
+        return len(self._ubicacion)
+
+    def agregar(self, clave, vence: float) -> None:
+        self.cancelar(clave)
+        #Lo ya vencido se atiende en el próximo tic
+        tic = max(math.ceil(vence / self.resolucion), self._tic + 1)
+        ranura = tic % len(self._ranuras)
+        self._ranuras[ranura][clave] = vence
+        self._ubicacion[clave] = ranura
+
+    def cancelar(self, clave) -> bool:
+        ranura = self._ubicacion.pop(clave, None)
+        if ranura is None:
+            return False
+        del self._ranuras[ranura][clave]
+        return True
+
+    def avanzar(self, ahora: float) -> list:
+        """Mueve la rueda hasta `ahora` y devuelve (quitándolas) las claves vencidas"""
+        tic_actual = math.floor(ahora / self.resolucion)
+        #Tras una pausa larga alcanza con recorrer una vuelta completa
+        desde = max(self._tic + 1, tic_actual - len(self._ranuras) + 1)
+        vencidas = []
+        for tic in range(desde, tic_actual + 1):
+            ranura = self._ranuras[tic % len(self._ranuras)]
+            listas = [clave for clave, vence in ranura.items() if vence <= ahora]
+            for clave in listas:
+                del ranura[clave]
+                del self._ubicacion[clave]
+            vencidas.extend(listas)
+        self._tic = max(self._tic, tic_actual)
+        return vencidas
+
+
+class GestorReservas:
+    """Reservas con vencimiento: retener, confirmar o liberar boletos.
+
+    retener() aparta boletos (y asientos, si el evento tiene mapa) por `ttl`
+    segundos; confirmar() los convierte en venta y liberar() los devuelve.
+    Las que no se confirman a tiempo las libera un único hilo que avanza una
+    RuedaTemporizadores y devuelve las vencidas por lotes, en una transacción
+    por lote. Las retenciones viven en la base: al iniciar se liberan las que
+    vencieron con el sistema detenido y se vuelven a programar las demás.
+    """
+
+    def __init__(self, ttl: float = 600.0, resolucion: float = 1.0, tamano_lote: int = 500):
+        self.ttl = ttl
+        self.tamano_lote = tamano_lote
+        self.repositorio_eventos = RepositorioEventos()
+        self.repositorio_ventas = RepositorioVentas()
+        self.repositorio_asientos = RepositorioAsientos()
+        self.repositorio_retenciones = RepositorioRetenciones()
+        self.inventario = obtener_inventario(self.repositorio_eventos.DB)
+        self.rueda = RuedaTemporizadores(resolucion)
+        self.vencidas = 0
+        self.cancelado = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = None
+        metricas.registrar_medidor("reservas.pendientes", lambda: len(self.rueda))
+
+    @metricas.cronometrar("reservas.retener")
+    def retener(
+        self,
+        evento_id: int,
+        cantidad: int,
+        asientos: tuple[str, str, list[int]] | None = None
+    ) -> tuple[bool, str, int | None]:
+        """Aparta boletos; devuelve (éxito, mensaje, id de la retención)"""
+        if cantidad <= 0:
+            return False, "La cantidad de boletos debe ser mayor a cero.", None
+        if asientos is not None and len(set(asientos[2])) != cantidad:
+            return False, "La cantidad de asientos pedidos no coincide con la cantidad de boletos.", None
+        if self.inventario.obtener_evento(evento_id) is None:
+            return False, "Evento no encontrado.", None
+
+        vence = time.time() + self.ttl
+        ubicacion = descripcion = None
+        with self.repositorio_eventos.pool.transaccion():
+            mapa = self.repositorio_asientos.cargar_mapa(evento_id)
+            if mapa is not None:
+                ubicacion = _ubicar_asientos(mapa, cantidad, asientos)
+                if ubicacion is None:
+                    return (*_sin_asientos(cantidad, asientos), None)
+            elif asientos is not None:
+                return False, "El evento no tiene asientos numerados.", None
+            retenidos = self.repositorio_eventos.retener_boletos(evento_id, cantidad)
+            if retenidos is None:
+                retencion_id = None
+            elif mapa is None:
+                retencion_id = self.repositorio_retenciones.insertar(evento_id, cantidad, vence)
+            else:
+                indice, mascara = ubicacion
+                mapa.ocupar(indice, mascara)
+                self.repositorio_asientos.guardar_fila(mapa, indice)
+                seccion, fila, _, total_asientos, _ = mapa.filas[indice]
+                descripcion = mapa.describir(indice, mascara)
+                retencion_id = self.repositorio_retenciones.insertar(
+                    evento_id, cantidad, vence, seccion, fila,
+                    MapaAsientos.empaquetar(mascara, total_asientos), descripcion
+                )
+
+        if retencion_id is None:
+            actual = self.repositorio_eventos.obtener_evento_por_id(evento_id)
+            self.inventario.actualizar_evento(actual)
+            metricas.incrementar("reservas.sin_stock")
+            return False, f"Sólo quedan {actual.restantes} boletos disponibles.", None
+
+        with self._lock:
+            self.rueda.agregar(retencion_id, vence)
+        self.inventario.actualizar_retenidos(evento_id, retenidos)
+        metricas.incrementar("reservas.retenidas")
+        plazo = f"{self.ttl / 60:.0f} minuto(s)" if self.ttl >= 60 else f"{self.ttl:.0f} segundo(s)"
+        mensaje = f"Reservados {cantidad} boleto(s) por {plazo}"
+        if descripcion:
+            mensaje += f" - Asientos: {descripcion}"
+        return True, mensaje, retencion_id
+
+    @metricas.cronometrar("reservas.confirmar")
+    def confirmar(self, retencion_id: int, cliente: str, gmail: str) -> tuple[bool, str]:
+        """Convierte una retención vigente en venta.
+
+        Confirmar dos veces la misma retención (un reintento del cliente)
+        devuelve la venta ya hecha: la venta lleva la retención como clave de
+        idempotencia.
+        """
+        clave = f"retencion:{retencion_id}"
         fecha_venta = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.repositorio_eventos.pool.transaccion():
+            retencion = self.repositorio_retenciones.tomar(retencion_id, vigente_en=time.time())
+            if retencion is not None:
+                _, evento_id, cantidad, _, _, _, asientos = retencion
+                evento = self.repositorio_eventos.obtener_evento_por_id(evento_id)
+                total = evento.precio * cantidad
+                vendidos, retenidos = self.repositorio_eventos.confirmar_retenidos(evento_id, cantidad)
+                self.repositorio_ventas.insertar_venta(
+                    evento_id, cliente, gmail, cantidad, total, fecha_venta, asientos, clave
+                )
+        if retencion is None:
+            venta = self.repositorio_ventas.venta_por_clave(clave)
+            if venta is not None:
+                metricas.incrementar("idempotencia.aciertos_bd")
+                evento = self.inventario.obtener_evento(venta[0])
+                return True, _mensaje_venta(evento.nombre if evento else f"#{venta[0]}", *venta[1:])
+            metricas.incrementar("reservas.confirmacion_tardia")
+            return False, "La reserva venció o no existe."
+
+        with self._lock:
+            self.rueda.cancelar(retencion_id)
+        self.inventario.actualizar_retenidos(evento_id, retenidos, vendidos)
+        metricas.incrementar("reservas.confirmadas")
+        _contar_ventas(1, cantidad)
+        return True, _mensaje_venta(evento.nombre, cantidad, total, fecha_venta, asientos)
+
+    def liberar(self, retencion_id: int) -> bool:
+        """Devuelve los boletos de una retención antes de que venza"""
+        with self.repositorio_eventos.pool.transaccion():
+            retencion = self.repositorio_retenciones.tomar(retencion_id)
+            if retencion is not None:
+                self._devolver([retencion])
+        with self._lock:
+            self.rueda.cancelar(retencion_id)
+        if retencion is not None:
+            self.inventario.invalidar()
+        return retencion is not None
+
+    def _devolver(self, retenciones) -> None:
+        #Se llama dentro de una transacción: un UPDATE por evento y una escritura por fila de asientos
+        cantidades = Counter()
+        por_mapa = {}
+        for _, evento_id, cantidad, seccion, fila, mascara, _ in retenciones:
+            cantidades[evento_id] += cantidad
+            if mascara is not None:
+                por_mapa.setdefault(evento_id, []).append((seccion, fila, MapaAsientos.desempaquetar(mascara)))
+        self.repositorio_eventos.liberar_retenidos(cantidades)
+        for evento_id, liberados in por_mapa.items():
+            #Si el mapa ya no tiene esas filas no hay asientos que devolver, sólo la cantidad
+            mapa = self.repositorio_asientos.cargar_mapa(evento_id)
+            if mapa is None:
+                continue
+            tocadas = set()
+            for seccion, fila, mascara in liberados:
+                indice = mapa.indice(seccion, fila)
+                if indice is None:
+                    continue
+                mapa.liberar(indice, mascara)
+                tocadas.add(indice)
+            for indice in tocadas:
+                self.repositorio_asientos.guardar_fila(mapa, indice)
+
+    @metricas.cronometrar("reservas.vencer")
+    def _vencer(self, ids, ahora: float) -> int:
+        liberadas = 0
+        for inicio in range(0, len(ids), self.tamano_lote):
+            with self.repositorio_eventos.pool.transaccion():
+                retenciones = self.repositorio_retenciones.tomar_vencidas(ids[inicio:inicio + self.tamano_lote], ahora)
+                if retenciones:
+                    self._devolver(retenciones)
+            liberadas += len(retenciones)
+        if liberadas:
+            self.vencidas += liberadas
+            metricas.incrementar("reservas.vencidas", liberadas)
+            self.inventario.invalidar()
+        return liberadas
+
+    def recuperar(self) -> int:
+        """Libera las retenciones vencidas guardadas en la base y programa el resto"""
+        ahora = time.time()
+        liberadas = 0
+        while True:
+            ids = self.repositorio_retenciones.ids_vencidas(ahora, self.tamano_lote)
+            if not ids:
+                break
+            liberadas += self._vencer(ids, ahora)
+        with self._lock:
+            for retencion_id, vence in self.repositorio_retenciones.pendientes():
+                self.rueda.agregar(retencion_id, vence)
+        return liberadas
+
+    def _bucle(self) -> None:
+        while not self.cancelado.wait(self.rueda.resolucion):
+            ahora = time.time()
+            with self._lock:
+                ids = self.rueda.avanzar(ahora)
+            if ids:
+                try:
+                    self._vencer(ids, ahora)
+                except Exception as error:
+                    #Se reprograman para la próxima vuelta; las que ya se liberaron no
+                    #están en la base y tomar_vencidas las ignora
+                    metricas.incrementar("reservas.errores")
+                    print(f"Error al liberar reservas vencidas: {error}")
+                    with self._lock:
+                        for retencion_id in ids:
+                            self.rueda.agregar(retencion_id, ahora)
+
+    def iniciar(self) -> None:
+        self.recuperar()
+        self._hilo = threading.Thread(target=self._bucle, daemon=True, name="reservas")
+        self._hilo.start()
+
+    def detener(self) -> None:
+        self.cancelado.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+
+def _campos(fila, nombres: tuple) -> tuple:
+    """Extrae los campos de un diccionario (p. ej. una fila de CSV) o de una secuencia"""
+    if isinstance(fila, dict):
+        return tuple(fila[nombre] for nombre in nombres)
+    if len(fila) < len(nombres):
+        raise ValueError(f"se esperaban {len(nombres)} campos")
+    return tuple(fila[:len(nombres)])
+
+
+def leer_csv(archivo):
+    """Lee filas de un CSV con encabezado como diccionarios, sin cargarlo completo"""
+    return csv.DictReader(archivo)
+
+
+class ResultadoCompra:
+    """Resultado de un intento de compra coordinado.
+
+    Se puede desempaquetar como la tupla (exito, mensaje) que devuelve
+    GestorVentas.vender_boletos. `reintentar` indica que la compra no se
+    intentó porque el evento estaba ocupado. Si la rechazó el ControlAdmision,
+    `posicion` y `espera_estimada` (segundos) informan la sala de espera.
+    En ControlAdmision.retener, `retencion_id` es la retención creada.
+    """
+
+    def __init__(
+        self,
+        exito: bool,
+        mensaje: str,
+        reintentar: bool = False,
+        espera_lock: float = 0.0,
+        posicion: int | None = None,
+        espera_estimada: float | None = None,
+        retencion_id: int | None = None
+    ):
+        self.exito = exito
+        self.mensaje = mensaje
+        self.reintentar = reintentar
+        self.espera_lock = espera_lock
+        self.posicion = posicion
+        self.espera_estimada = espera_estimada
+        self.retencion_id = retencion_id
+
+    def __iter__(self):
+        return iter((self.exito, self.mensaje))
+
+
+class CerrojoJusto:
+    """Lock con cola FIFO: los hilos lo obtienen en el orden en que llegaron"""
+
+    def __init__(self):
+        self._condicion = threading.Condition(threading.Lock())
+        self._ocupado = False
+        self._cola = deque()
+
+    def adquirir(self, timeout: float | None = None) -> bool:
+        """Espera su turno; devuelve False si vence el timeout"""
+        with self._condicion:
+            if not self._ocupado and not self._cola:
+                self._ocupado = True
+                return True
+            turno = object()
+            self._cola.append(turno)
+            limite = None if timeout is None else time.monotonic() + timeout
+            while self._ocupado or self._cola[0] is not turno:
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0:
+                    self._cola.remove(turno)
+                    self._condicion.notify_all()
+                    return False
+                self._condicion.wait(restante)
+            self._cola.popleft()
+            self._ocupado = True
+            return True
+
+    def liberar(self) -> None:
+        with self._condicion:
+            self._ocupado = False
+            self._condicion.notify_all()
+
+
+class CoordinadorCompras:
+    """Coordina las compras repartiendo los locks por evento.
+
+    Cada evento cae en una franja de una tabla de locks justos, de modo que
+    compras de eventos distintos no se esperan entre sí y las del mismo
+    evento se atienden en orden de llegada. Si no se obtiene el turno dentro
+    del timeout, se devuelve un resultado de "ocupado, reintente".
+    """
+
+    MENSAJE_OCUPADO = "El evento está muy solicitado en este momento. Reintente en unos segundos."
 
-        # Registrar la venta en la base de datos
-        self.repositorio_ventas.insertar_venta(
-            evento_id, cliente, gmail, cantidad, total, fecha_venta
+    def __init__(self, gestor_ventas: "GestorVentas", franjas: int = 64, timeout: float = 5.0):
+        if franjas <= 0:
+            raise ValueError("La cantidad de franjas debe ser mayor a cero")
+        self.gestor_ventas = gestor_ventas
+        self.timeout = timeout
+        self._franjas = [CerrojoJusto() for _ in range(franjas)]
+
+    def _franja(self, evento_id: int) -> CerrojoJusto:
+        return self._franjas[hash(evento_id) % len(self._franjas)]
+
+    def comprar(
+        self,
+        evento_id: int,
+        cliente: str,
+        gmail: str,
+        cantidad: int,
+        timeout: float | None = None,
+        asientos: tuple[str, str, list[int]] | None = None,
+        clave: str | None = None
+    ) -> ResultadoCompra:
+        """Vende boletos tomando sólo el lock de la franja del evento"""
+        cerrojo = self._franja(evento_id)
+        inicio = time.perf_counter()
+        if not cerrojo.adquirir(self.timeout if timeout is None else timeout):
+            metricas.incrementar("locks.franja_ocupada")
+            return ResultadoCompra(False, self.MENSAJE_OCUPADO, True, time.perf_counter() - inicio)
+        espera = time.perf_counter() - inicio
+        metricas.observar("locks.espera_franja", espera * 1000)
+        try:
+            exito, mensaje = self.gestor_ventas.vender_boletos(evento_id, cliente, gmail, cantidad, asientos, clave)
+        finally:
+            cerrojo.liberar()
+        return ResultadoCompra(exito, mensaje, espera_lock=espera)
+
+
+class ProcesoCompras(multiprocessing.Process):
+    """Proceso de trabajo que vende boletos tomando pedidos de una cola compartida.
+
+    Cada proceso abre sus propias conexiones y su propia cache de inventario;
+    la coordinación entre procesos la hace SQLite: la reserva condicional
+    corre en una transacción BEGIN IMMEDIATE y, si la base sigue ocupada al
+    vencer el busy timeout, el pedido se reintenta con espera exponencial
+    y aleatoria. Un pedido None detiene el proceso después del pedido en curso.
+    `en_curso` (memoria compartida) guarda el número del pedido que se está
+    atendiendo, 0 si ninguno y -1 si el proceso se retiró por un None.
+    """
+
+    def __init__(
+        self,
+        pedidos,
+        resultados,
+        ruta_bd: str,
+        timeout_bd: float = 2.0,
+        max_reintentos: int = 5,
+        espera_base: float = 0.01
+    ):
+        super().__init__()
+        self.daemon = True
+        self.pedidos = pedidos
+        self.resultados = resultados
+        self.ruta_bd = ruta_bd
+        self.timeout_bd = timeout_bd
+        self.max_reintentos = max_reintentos
+        self.espera_base = espera_base
+        self.en_curso = multiprocessing.Value("q", 0, lock=False)
+
+    def _vender(self, gestor_ventas: GestorVentas, evento_id, cliente, gmail, cantidad, clave) -> tuple[bool, str, int]:
+        for intento in range(self.max_reintentos + 1):
+            try:
+                exito, mensaje = gestor_ventas.vender_boletos(evento_id, cliente, gmail, cantidad, clave=clave)
+                return exito, mensaje, intento
+            except sqlite3.OperationalError as error:
+                ocupada = "locked" in str(error) or "busy" in str(error)
+                if not ocupada or intento == self.max_reintentos:
+                    raise
+                metricas.incrementar("trabajadores.reintentos_bd")
+                time.sleep(random.uniform(0, self.espera_base * 2 ** intento))
+
+    def run(self):
+        configurar_base_datos(self.ruta_bd)
+        metricas.reiniciar()
+        obtener_pool(self.ruta_bd).timeout = self.timeout_bd
+        gestor_ventas = GestorVentas()
+        pid = os.getpid()
+        while True:
+            pedido = self.pedidos.get()
+            if pedido is None:
+                self.en_curso.value = -1
+                break
+            numero, evento_id, cliente, gmail, cantidad, vence, clave = pedido
+            self.en_curso.value = numero
+            if vence is not None and time.time() > vence:
+                #El pedido esperó en la cola más de lo que el cliente aceptaba
+                self.resultados.put((numero, pid, False, CoordinadorCompras.MENSAJE_OCUPADO, True, 0))
+                continue
+            try:
+                exito, mensaje, reintentos = self._vender(gestor_ventas, evento_id, cliente, gmail, cantidad, clave)
+                self.resultados.put((numero, pid, exito, mensaje, False, reintentos))
+            except Exception as error:
+                self.resultados.put((numero, pid, False, f"Error procesando la compra: {error}", False, self.max_reintentos))
+            self.en_curso.value = 0
+        volcar_metricas_proceso(self.name)
+
+
+class PoolProcesosCompras:
+    """Reparte las compras entre varios procesos de trabajo.
+
+    Tiene la misma interfaz comprar() que CoordinadorCompras, así que puede
+    reemplazarlo en el menú o en el servidor. Los pedidos van por una
+    multiprocessing.Queue compartida (el proceso libre toma el siguiente) y
+    un hilo del padre recibe los resultados, resuelve el Future de cada
+    pedido y acumula los totales por proceso. escalar(n) agrega procesos o
+    retira los sobrantes cuando terminan su pedido en curso.
+
+    El mismo hilo revisa cada `intervalo_revision` segundos que los procesos
+    sigan vivos: el pedido que tenía tomado un proceso caído se responde
+    con error (la venta pudo haberse hecho; con clave, reintentar es
+    seguro) y, si no queda ningún proceso, también los que esperan en la
+    cola. comprar() no espera el resultado más de `espera_resultado`
+    segundos (más su timeout de cola).
+    """
+
+    MENSAJE_CAIDO = (
+        "El proceso que atendía la compra terminó inesperadamente; "
+        "revise el historial antes de reintentar sin clave."
+    )
+
+    def __init__(
+        self,
+        trabajadores: int | None = None,
+        ruta_bd: str | None = None,
+        espera_resultado: float = 30.0,
+        intervalo_revision: float = 1.0,
+        **opciones_trabajador
+    ):
+        self.trabajadores = trabajadores or os.cpu_count() or 1
+        self.ruta_bd = ruta_bd or RepositorioEventos.DB
+        self.espera_resultado = espera_resultado
+        self.intervalo_revision = intervalo_revision
+        self.opciones_trabajador = opciones_trabajador
+        self._pedidos = multiprocessing.Queue()
+        self._resultados = multiprocessing.Queue()
+        self._procesos = []
+        self._pendientes = {}
+        self._lock = threading.Lock()
+        self._numeros = itertools.count(1)
+        #Nones enviados que todavía no retiraron a un proceso
+        self._retiros_pendientes = 0
+        #Pedidos de procesos caídos vistos en la revisión anterior (su resultado pudo estar en camino)
+        self._huerfanos = set()
+        self._deteniendo = False
+        self._recolector = None
+        self.totales = Counter()
+        self.por_trabajador = Counter()
+
+    def iniciar(self) -> None:
+        self._recolector = threading.Thread(target=self._recolectar, daemon=True, name="recolector-compras")
+        self._recolector.start()
+        self.escalar(self.trabajadores)
+
+    def _recolectar(self) -> None:
+        revisado = time.monotonic()
+        while True:
+            if time.monotonic() - revisado >= self.intervalo_revision:
+                self._revisar()
+                revisado = time.monotonic()
+            try:
+                resultado = self._resultados.get(timeout=self.intervalo_revision)
+            except queue.Empty:
+                continue
+            if resultado is None:
+                return
+            numero, pid, exito, mensaje, reintentar, reintentos = resultado
+            with self._lock:
+                futuro = self._pendientes.pop(numero, None)
+                self.por_trabajador[pid] += 1
+                self.totales["exitosas" if exito else "ocupado" if reintentar else "fallidas"] += 1
+                self.totales["reintentos_bd"] += reintentos
+            if futuro is not None:
+                futuro.set_result(ResultadoCompra(exito, mensaje, reintentar))
+
+    def _revisar(self) -> None:
+        #Responde los pedidos que ya no va a atender nadie
+        with self._lock:
+            caidos = [proceso for proceso in self._procesos if not proceso.is_alive()]
+            huerfanos = {proceso.en_curso.value for proceso in caidos if proceso.en_curso.value > 0}
+            #Se dan por perdidos en la revisión siguiente: su resultado pudo estar todavía en la cola
+            perdidos = [self._pendientes.pop(numero) for numero in self._huerfanos if numero in self._pendientes]
+            self._huerfanos = huerfanos
+            self._podar()
+            sin_atender = {}
+            if not self._procesos and not self._deteniendo:
+                #Sin procesos (caídos o que no pudieron arrancar) la cola no avanza
+                sin_atender, self._pendientes = self._pendientes, {}
+            self.totales["caidas"] += len(perdidos)
+        if perdidos:
+            metricas.incrementar("trabajadores.pedidos_perdidos", len(perdidos))
+        for futuro in perdidos:
+            futuro.set_result(ResultadoCompra(False, self.MENSAJE_CAIDO))
+        for futuro in sin_atender.values():
+            futuro.set_result(ResultadoCompra(False, "No hay procesos de compras disponibles.", reintentar=True))
+
+    def _podar(self) -> None:
+        #Se llama con el lock tomado: saca los procesos terminados; los que salieron por
+        #un None ya no cuentan como retiro pendiente
+        vivos = []
+        for proceso in self._procesos:
+            if proceso.is_alive():
+                vivos.append(proceso)
+            elif proceso.en_curso.value == -1:
+                self._retiros_pendientes = max(0, self._retiros_pendientes - 1)
+        self._procesos = vivos
+
+    def vivos(self) -> int:
+        with self._lock:
+            self._podar()
+            return len(self._procesos)
+
+    def escalar(self, trabajadores: int) -> None:
+        #Ajusta la cantidad de procesos; los que sobran salen al tomar un None de la cola.
+        #Los que ya recibieron su None y no salieron todavía no cuentan
+        with self._lock:
+            self._podar()
+            actuales = len(self._procesos) - self._retiros_pendientes
+        for _ in range(trabajadores - actuales):
+            proceso = ProcesoCompras(self._pedidos, self._resultados, self.ruta_bd, **self.opciones_trabajador)
+            proceso.start()
+            with self._lock:
+                self._procesos.append(proceso)
+        for _ in range(actuales - trabajadores):
+            with self._lock:
+                self._retiros_pendientes += 1
+            self._pedidos.put(None)
+        self.trabajadores = trabajadores
+
+    def enviar(
+        self,
+        evento_id: int,
+        cliente: str,
+        gmail: str,
+        cantidad: int,
+        timeout: float | None = None,
+        clave: str | None = None
+    ) -> Future:
+        """Encola un pedido y devuelve un Future con su ResultadoCompra.
+
+        Con timeout, el pedido que siga en la cola al vencer no se procesa y
+        se responde "ocupado, reintente"; uno ya tomado por un proceso
+        siempre termina, para no informar un rechazo de una venta hecha.
+        """
+        futuro = Future()
+        numero = futuro.numero = next(self._numeros)
+        with self._lock:
+            self._pendientes[numero] = futuro
+        vence = None if timeout is None else time.time() + timeout
+        self._pedidos.put((numero, evento_id, cliente, gmail, cantidad, vence, clave))
+        return futuro
+
+    def comprar(
+        self,
+        evento_id: int,
+        cliente: str,
+        gmail: str,
+        cantidad: int,
+        timeout: float | None = None,
+        clave: str | None = None
+    ) -> ResultadoCompra:
+        futuro = self.enviar(evento_id, cliente, gmail, cantidad, timeout, clave)
+        try:
+            return futuro.result((timeout or 0) + self.espera_resultado)
+        except FuturesTimeoutError:
+            with self._lock:
+                self._pendientes.pop(futuro.numero, None)
+            metricas.incrementar("trabajadores.sin_respuesta")
+            return ResultadoCompra(
+                False, "La compra no respondió a tiempo; revise el historial antes de reintentar sin clave."
+            )
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "trabajadores": len(self._procesos),
+                "pendientes": len(self._pendientes),
+                "totales": dict(self.totales),
+                "por_trabajador": dict(self.por_trabajador),
+            }
+
+    def detener(self, timeout: float = 10.0) -> None:
+        #Los procesos terminan los pedidos ya encolados antes de tomar su None
+        self._deteniendo = True
+        for _ in range(self.vivos()):
+            self._pedidos.put(None)
+        for proceso in list(self._procesos):
+            proceso.join(timeout)
+            if proceso.is_alive():
+                proceso.terminate()
+                proceso.join()
+        self._resultados.put(None)
+        if self._recolector is not None:
+            self._recolector.join()
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+        for futuro in pendientes.values():
+            futuro.set_result(ResultadoCompra(False, "El servicio de compras se detuvo.", reintentar=True))
+        self._procesos = []
+
+
+class CuboTokens:
+    """Limitador de tasa: `tasa` pedidos por segundo con ráfagas de hasta `capacidad`"""
+
+    __slots__ = ("tasa", "capacidad", "tokens", "actualizado")
+
+    def __init__(self, tasa: float, capacidad: float):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = capacidad
+        self.actualizado = time.monotonic()
+
+    def tomar(self, ahora: float) -> float:
+        #0 si se pudo tomar un token; si no, los segundos hasta que haya uno
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.actualizado) * self.tasa)
+        self.actualizado = ahora
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.tasa
+
+
+class ControlAdmision:
+    """Sala de espera virtual delante de un coordinador de compras.
+
+    Cada compra pasa primero por dos limitadores de tasa (por cliente, según
+    el gmail, y por evento) y después por una cola FIFO que deja entrar como
+    mucho `max_en_curso` compras a la vez: SQLite admite un solo escritor, y
+    más compras simultáneas sólo agregan espera de lock y errores "database
+    is locked" sin vender más rápido. Los turnos se entregan en orden de
+    llegada; quien no entra dentro de `espera_max` segundos, o encuentra la
+    sala llena, recibe un ResultadoCompra con reintentar=True, su posición
+    y la espera estimada. Tiene la misma interfaz comprar() que
+    CoordinadorCompras y PoolProcesosCompras, a los que envuelve; retener()
+    hace pasar por la misma sala las retenciones de un GestorReservas.
+    """
+
+    def __init__(
+        self,
+        coordinador,
+        max_en_curso: int = 4,
+        max_en_espera: int = 10000,
+        espera_max: float = 10.0,
+        tasa_evento: float | None = 500.0,
+        rafaga_evento: float = 1000.0,
+        tasa_cliente: float | None = 5.0,
+        rafaga_cliente: float = 10.0,
+        max_clientes: int = 100000
+    ):
+        self.coordinador = coordinador
+        self.max_en_curso = max_en_curso
+        self.max_en_espera = max_en_espera
+        self.espera_max = espera_max
+        self.tasa_evento = tasa_evento
+        self.rafaga_evento = rafaga_evento
+        self.tasa_cliente = tasa_cliente
+        self.rafaga_cliente = rafaga_cliente
+        self.max_clientes = max_clientes
+        self.en_curso = 0
+        self.totales = Counter()
+        self._lock = threading.Lock()
+        self._cubos_evento = {}
+        self._cubos_cliente = OrderedDict()
+        #Turnos en espera: cada uno con su Event, para despertar sólo al que entra
+        self._turnos = itertools.count()
+        self._fila = deque()
+        self._esperando = {}
+        #Turnos que ya salieron de la fila (admitidos o abandonados), para recalcular la posición
+        self._salidos = 0
+        self._servicio = 0.05
+        metricas.registrar_medidor("admision.en_espera", lambda: len(self._esperando))
+        metricas.registrar_medidor("admision.en_curso", lambda: self.en_curso)
+
+    def _limitar(self, evento_id: int, gmail: str, ahora: float) -> ResultadoCompra | None:
+        #Se llama con el lock tomado
+        if self.tasa_cliente is not None:
+            clave = gmail.strip().lower()
+            cubo = self._cubos_cliente.pop(clave, None) or CuboTokens(self.tasa_cliente, self.rafaga_cliente)
+            #Orden de uso reciente: los clientes inactivos se descartan primero
+            self._cubos_cliente[clave] = cubo
+            if len(self._cubos_cliente) > self.max_clientes:
+                self._cubos_cliente.popitem(last=False)
+            espera = cubo.tomar(ahora)
+            if espera:
+                self.totales["limite_cliente"] += 1
+                return ResultadoCompra(
+                    False, f"Demasiados pedidos de {gmail}. Reintente en {espera:.1f} s.",
+                    True, espera_estimada=espera
+                )
+        if self.tasa_evento is not None:
+            cubo = self._cubos_evento.get(evento_id)
+            if cubo is None:
+                cubo = self._cubos_evento[evento_id] = CuboTokens(self.tasa_evento, self.rafaga_evento)
+            espera = cubo.tomar(ahora)
+            if espera:
+                self.totales["limite_evento"] += 1
+                return ResultadoCompra(
+                    False, f"El evento recibe demasiados pedidos. Reintente en {espera:.1f} s.",
+                    True, espera_estimada=espera
+                )
+        return None
+
+    def _estimar(self, posicion: int) -> float:
+        return round(posicion * self._servicio / self.max_en_curso, 3)
+
+    def _admitir_siguientes(self) -> None:
+        #Se llama con el lock tomado; los turnos abandonados ya no están en _esperando
+        while self._fila and self.en_curso < self.max_en_curso:
+            turno = self._fila.popleft()
+            self._salidos += 1
+            despertar = self._esperando.pop(turno, None)
+            if despertar is not None:
+                self.en_curso += 1
+                self.totales["admitidas"] += 1
+                despertar.set()
+
+    def _entrar(self, evento_id: int, gmail: str) -> ResultadoCompra | None:
+        """Espera el turno; None si se entró (hay que llamar a _salir) o el rechazo"""
+        ahora = time.monotonic()
+        with self._lock:
+            rechazo = self._limitar(evento_id, gmail, ahora)
+            if rechazo is not None:
+                return rechazo
+            if not self._esperando and self.en_curso < self.max_en_curso:
+                self.en_curso += 1
+                self.totales["admitidas"] += 1
+                return None
+            posicion = len(self._esperando) + 1
+            if posicion > self.max_en_espera:
+                self.totales["sala_llena"] += 1
+                return ResultadoCompra(
+                    False, "La sala de espera está llena. Reintente en unos segundos.",
+                    True, posicion=posicion, espera_estimada=self._estimar(posicion)
+                )
+            turno = next(self._turnos)
+            despertar = threading.Event()
+            self._fila.append(turno)
+            self._esperando[turno] = despertar
+            salidos = self._salidos
+        if despertar.wait(self.espera_max):
+            metricas.observar("admision.espera", (time.monotonic() - ahora) * 1000)
+            return None
+        with self._lock:
+            if despertar.is_set():
+                #Entró justo al vencer la espera
+                return None
+            del self._esperando[turno]
+            #Los que estaban adelante al entrar menos los que salieron de la fila desde entonces
+            restantes = max(1, posicion - (self._salidos - salidos))
+            self.totales["espera_vencida"] += 1
+        return ResultadoCompra(
+            False, f"Sigue en la sala de espera (posición {restantes}). Reintente en unos segundos.",
+            True, posicion=restantes, espera_estimada=self._estimar(restantes)
         )
 
-        # Actualizar contador de boletos vendidos
-        with sqlite3.connect(RepositorioEventos.DB) as conexion:
-            cursor = conexion.cursor()
-            cursor.execute("""
-                UPDATE eventos
-                SET boletos_vendidos = boletos_vendidos + ?
-                WHERE id = ?
-            """, (cantidad, evento_id))
-            conexion.commit()
-
-        mensaje = (
-            f"Venta exitosa: {cantidad} boleto(s) para '{evento.nombre}' - "
-            f"Total: ${total:.2f} - Fecha: {fecha_venta}"
+    def _salir(self, duracion: float) -> None:
+        with self._lock:
+            self.en_curso -= 1
+            #Media móvil del tiempo de servicio para estimar la espera
+            self._servicio += 0.1 * (duracion - self._servicio)
+            self._admitir_siguientes()
+
+    def _admitir(self, evento_id: int, gmail: str, funcion) -> ResultadoCompra:
+        #Ejecuta funcion() con un turno de la sala; el rechazo si no se entró
+        rechazo = self._entrar(evento_id, gmail)
+        if rechazo is not None:
+            metricas.incrementar("admision.rechazos")
+            return rechazo
+        inicio = time.monotonic()
+        try:
+            return funcion()
+        finally:
+            self._salir(time.monotonic() - inicio)
+
+    def comprar(
+        self,
+        evento_id: int,
+        cliente: str,
+        gmail: str,
+        cantidad: int,
+        timeout: float | None = None,
+        **opciones
+    ) -> ResultadoCompra:
+        return self._admitir(
+            evento_id, gmail,
+            lambda: self.coordinador.comprar(evento_id, cliente, gmail, cantidad, timeout, **opciones)
         )
-        return True, mensaje
+
+    def retener(
+        self,
+        reservas: GestorReservas,
+        evento_id: int,
+        gmail: str,
+        cantidad: int,
+        asientos: tuple[str, str, list[int]] | None = None
+    ) -> ResultadoCompra:
+        """Aparta boletos con GestorReservas.retener después de pasar por la sala.
+
+        La confirmación no vuelve a esperar turno: sólo convierte en venta
+        boletos que ya entraron por aquí.
+        """
+        def retener():
+            exito, mensaje, retencion_id = reservas.retener(evento_id, cantidad, asientos)
+            return ResultadoCompra(exito, mensaje, retencion_id=retencion_id)
+        return self._admitir(evento_id, gmail, retener)
+
+    def estado(self) -> dict:
+        with self._lock:
+            en_espera = len(self._esperando)
+            return {
+                "en_curso": self.en_curso,
+                "en_espera": en_espera,
+                "espera_estimada": self._estimar(en_espera),
+                "servicio_ms": round(self._servicio * 1000, 3),
+                **self.totales,
+            }
+
+
+class TareaProgramada:
+    """Tarea del PlanificadorTareas: cada `intervalo` segundos y/o a horarios fijos del día"""
+
+    def __init__(
+        self,
+        nombre: str,
+        funcion,
+        intervalo: float | None = None,
+        horarios=(),
+        pesada: bool = False
+    ):
+        if intervalo is None and not horarios:
+            raise ValueError(f"La tarea '{nombre}' necesita un intervalo o al menos un horario")
+        self.nombre = nombre
+        self.funcion = funcion
+        self.intervalo = intervalo
+        self.horarios = [datetime.time.fromisoformat(horario) for horario in horarios]
+        self.pesada = pesada
+        self.en_curso = False
+        self.aplazada_desde = None
+        self.proxima = None
+        self.ejecuciones = 0
+        self.omitidas = 0
+        self.aplazadas = 0
+        self.errores = 0
+        self.ultima_duracion = None
+
+    def siguiente(self, desde: float) -> float:
+        #Próximo momento (time.time()) posterior a `desde`
+        candidatos = []
+        if self.intervalo is not None:
+            candidatos.append(desde + self.intervalo)
+        if self.horarios:
+            momento = datetime.datetime.fromtimestamp(desde)
+            for horario in self.horarios:
+                proximo = datetime.datetime.combine(momento.date(), horario)
+                if proximo <= momento:
+                    proximo += datetime.timedelta(days=1)
+                candidatos.append(proximo.timestamp())
+        return min(candidatos)
+
+
+class PlanificadorTareas:
+    """Ejecuta tareas periódicas en un pool de hilos compartido.
+
+    Un solo hilo lleva la agenda (un heap ordenado por próxima ejecución) y
+    despacha cada tarea vencida al ThreadPoolExecutor. Una tarea nunca se
+    superpone consigo misma: si la ejecución anterior sigue en curso, esta
+    vuelta se omite. Las tareas pesadas se aplazan mientras la carga de
+    compras (ventas por segundo, medida con `contador_actividad`) supere
+    `umbral_carga`; si pasan `max_aplazamiento` segundos así, se omite esa
+    vuelta. detener() corta las esperas al instante y termina los procesos
+    lanzados con en_proceso().
+    """
+
+    def __init__(
+        self,
+        max_hilos: int = 4,
+        contador_actividad=None,
+        umbral_carga: float = 20.0,
+        aplazamiento: float = 60.0,
+        max_aplazamiento: float = 3600.0,
+        intervalo_muestreo: float = 5.0
+    ):
+        self.max_hilos = max_hilos
+        self.contador_actividad = contador_actividad
+        self.umbral_carga = umbral_carga
+        self.aplazamiento = aplazamiento
+        self.max_aplazamiento = max_aplazamiento
+        self.intervalo_muestreo = intervalo_muestreo
+        self.carga = 0.0
+        self.cancelado = threading.Event()
+        self._tareas = {}
+        self._agenda = []
+        self._orden = itertools.count()
+        self._condicion = threading.Condition()
+        self._muestra = None
+        self._executor = None
+        self._hilo = None
+        self._hilos_proceso = []
+
+    def agregar(
+        self,
+        nombre: str,
+        funcion,
+        intervalo: float | None = None,
+        horarios=(),
+        retraso_inicial: float | None = None,
+        pesada: bool = False
+    ) -> TareaProgramada:
+        """Programa `funcion()`; sin retraso_inicial la primera vuelta es la siguiente del calendario"""
+        tarea = TareaProgramada(nombre, funcion, intervalo, horarios, pesada)
+        ahora = time.time()
+        with self._condicion:
+            self._tareas[nombre] = tarea
+            self._programar(tarea, ahora + retraso_inicial if retraso_inicial is not None else tarea.siguiente(ahora))
+        return tarea
+
+    def _programar(self, tarea: TareaProgramada, momento: float) -> None:
+        #Se llama con la condición tomada
+        tarea.proxima = momento
+        heapq.heappush(self._agenda, (momento, next(self._orden), tarea))
+        self._condicion.notify()
+
+    def ejecutar_ahora(self, nombre: str) -> None:
+        with self._condicion:
+            self._programar(self._tareas[nombre], time.time())
+
+    def _medir_carga(self) -> float:
+        if self.contador_actividad is None:
+            return 0.0
+        ahora = time.monotonic()
+        valor = self.contador_actividad()
+        if self._muestra is None:
+            self._muestra = (ahora, valor)
+        elif ahora - self._muestra[0] >= 1.0:
+            anterior, cantidad = self._muestra
+            self.carga = (valor - cantidad) / (ahora - anterior)
+            self._muestra = (ahora, valor)
+        return self.carga
+
+    def _bucle(self) -> None:
+        while not self.cancelado.is_set():
+            with self._condicion:
+                ahora = time.time()
+                if not self._agenda or self._agenda[0][0] > ahora:
+                    espera = self.intervalo_muestreo
+                    if self._agenda:
+                        espera = min(espera, self._agenda[0][0] - ahora)
+                    self._condicion.wait(espera)
+                    vencida = None
+                else:
+                    programada, _, vencida = heapq.heappop(self._agenda)
+                    if vencida.proxima != programada:
+                        #Reprogramada con ejecutar_ahora(); esta entrada quedó vieja
+                        vencida = None
+            self._medir_carga()
+            if vencida is not None and not self.cancelado.is_set():
+                self._despachar(vencida, programada)
+
+    def _despachar(self, tarea: TareaProgramada, programada: float) -> None:
+        ahora = time.time()
+        siguiente = tarea.siguiente(programada)
+        if siguiente <= ahora:
+            #La agenda se atrasó: no se recuperan las vueltas perdidas
+            siguiente = tarea.siguiente(ahora)
+        if tarea.en_curso:
+            tarea.omitidas += 1
+            metricas.incrementar("planificador.omitidas")
+        elif tarea.pesada and self.carga > self.umbral_carga:
+            if tarea.aplazada_desde is None:
+                tarea.aplazada_desde = ahora
+            if ahora - tarea.aplazada_desde < self.max_aplazamiento:
+                tarea.aplazadas += 1
+                metricas.incrementar("planificador.aplazadas")
+                siguiente = min(siguiente, ahora + self.aplazamiento)
+            else:
+                tarea.aplazada_desde = None
+                tarea.omitidas += 1
+                metricas.incrementar("planificador.omitidas")
+        else:
+            tarea.aplazada_desde = None
+            tarea.en_curso = True
+            if getattr(tarea.funcion, "lanza_proceso", False):
+                #Con fork, un proceso creado desde un hilo del executor hereda su registro
+                #de hilos y al salir intenta esperarse a sí mismo (termina con código 1)
+                hilo = threading.Thread(target=self._ejecutar, args=(tarea,), daemon=True, name=f"tarea-{tarea.nombre}")
+                self._hilos_proceso = [h for h in self._hilos_proceso if h.is_alive()] + [hilo]
+                hilo.start()
+            else:
+                self._executor.submit(self._ejecutar, tarea)
+        with self._condicion:
+            self._programar(tarea, siguiente)
+
+    def _ejecutar(self, tarea: TareaProgramada) -> None:
+        inicio = time.perf_counter()
+        try:
+            with metricas.medir(f"tareas.{tarea.nombre}"):
+                tarea.funcion()
+            tarea.ejecuciones += 1
+        except Exception as e:
+            tarea.errores += 1
+            print(f"Error en la tarea '{tarea.nombre}': {e}")
+        finally:
+            tarea.ultima_duracion = time.perf_counter() - inicio
+            tarea.en_curso = False
+
+    def en_proceso(self, fabrica):
+        """Envuelve una fábrica de multiprocessing.Process como tarea.
+
+        Cada vuelta crea un proceso nuevo y espera a que termine sin bloquear
+        la cancelación: si se detiene el planificador, el proceso se termina.
+        """
+        def ejecutar():
+            proceso = fabrica()
+            proceso.start()
+            while proceso.is_alive():
+                if self.cancelado.wait(0.2):
+                    proceso.terminate()
+                    proceso.join()
+                    return
+            proceso.join()
+            if proceso.exitcode:
+                raise RuntimeError(f"el proceso terminó con código {proceso.exitcode}")
+        ejecutar.lanza_proceso = True
+        return ejecutar
+
+    def iniciar(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=self.max_hilos, thread_name_prefix="tareas")
+        self._hilo = threading.Thread(target=self._bucle, daemon=True, name="planificador")
+        self._hilo.start()
+
+    def detener(self) -> None:
+        #Las tareas en curso terminan su vuelta; las que esperan en la agenda se descartan
+        self.cancelado.set()
+        with self._condicion:
+            self._condicion.notify_all()
+        if self._hilo is not None:
+            self._hilo.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        for hilo in self._hilos_proceso:
+            hilo.join()
+
+    def estado(self) -> dict:
+        with self._condicion:
+            tareas = list(self._tareas.values())
+        return {
+            "carga": round(self.carga, 2),
+            "tareas": {
+                tarea.nombre: {
+                    "proxima": datetime.datetime.fromtimestamp(tarea.proxima).isoformat(timespec="seconds"),
+                    "en_curso": tarea.en_curso,
+                    "ejecuciones": tarea.ejecuciones,
+                    "omitidas": tarea.omitidas,
+                    "aplazadas": tarea.aplazadas,
+                    "errores": tarea.errores,
+                    "ultima_duracion": tarea.ultima_duracion,
+                }
+                for tarea in tareas
+            },
+        }
 
 
 class GestorConcurrencia:
-    """Gestor para manejar la concurrencia con hilos y procesos"""
+    """Gestor para manejar la concurrencia con hilos y procesos.
+
+    Los hilos que reaccionan a eventos (procesador de ventas y monitor)
+    corren por su cuenta; las tareas periódicas y los procesos de
+    estadísticas, respaldo completo, mantenimiento y archivo de ventas los lanza un
+    PlanificadorTareas según PROGRAMACION, que se puede ajustar por tarea
+    con el parámetro `programacion`.
+    """
+
+    # nombre: parámetros de PlanificadorTareas.agregar (intervalo, horarios, retraso_inicial, pesada)
+    PROGRAMACION = {
+        "sincronizacion": {"intervalo": 30},
+        "metricas": {"intervalo": 30},
+        "respaldo": {"intervalo": 300},
+        "reportes": {"intervalo": 360},
+        "estadisticas": {"intervalo": 600},
+        "respaldo_completo": {"intervalo": 6 * 3600, "retraso_inicial": 1000, "pesada": True},
+        "mantenimiento": {"intervalo": 3600, "pesada": True},
+        "archivo_ventas": {"horarios": ("04:00",), "pesada": True},
+    }
     
-    def __init__(self):
+    def __init__(self, procesos_compra: int = 0, programacion: dict | None = None):
         from capa_datos import (
             HiloProcesadorVentas, 
             HiloMonitorEventos, 
             HiloGeneradorReportes, 
             HiloRespaldoAutomatico, 
             HiloSincronizadorDatos, 
+            HiloExportadorMetricas,
             ProcesoCalculoEstadisticas, 
             ProcesoRespaldoCompleto, 
-            ProcesoMantenimientoBaseDatos
+            ProcesoMantenimientoBaseDatos,
+            ServicioArchivoVentas
         )
 
-        # Inicializar 5 hilos concurrentes
+        # Cola de escritura diferida compartida por las ventas y el procesador
+        self.cola_ventas = ColaVentasPendientes()
+
+        # Hilos que esperan trabajo (ventas pendientes y avisos de inventario)
+        self.procesador_ventas = HiloProcesadorVentas(self.cola_ventas)
         self.hilos = [
-            HiloProcesadorVentas(),
-            HiloMonitorEventos(),
-            HiloGeneradorReportes(),
-            HiloRespaldoAutomatico(),
-            HiloSincronizadorDatos()
-        ]
-        # Inicializar 3 procesos concurrentes
-        self.procesos = [
-            ProcesoCalculoEstadisticas(),
-            ProcesoRespaldoCompleto(),
-            ProcesoMantenimientoBaseDatos()
+            self.procesador_ventas,
+            HiloMonitorEventos()
         ]
+        # Reservas con vencimiento (carrito): un solo hilo libera las vencidas
+        self.reservas = GestorReservas()
+        # Procesos de trabajo para compras (0 = las compras corren en este proceso)
+        self.pool_compras = PoolProcesosCompras(procesos_compra) if procesos_compra > 0 else None
+
+        # Tareas periódicas: pasadas de los hilos y procesos lanzados a demanda
+        self.planificador = PlanificadorTareas(contador_actividad=self._ventas_realizadas)
+        trabajos = {
+            "sincronizacion": HiloSincronizadorDatos(cola=self.cola_ventas).ejecutar,
+            "metricas": HiloExportadorMetricas().ejecutar,
+            "respaldo": HiloRespaldoAutomatico().ejecutar,
+            "reportes": HiloGeneradorReportes().ejecutar,
+            "estadisticas": self.planificador.en_proceso(lambda: ProcesoCalculoEstadisticas(repetir=False)),
+            "respaldo_completo": self.planificador.en_proceso(lambda: ProcesoRespaldoCompleto(espera=0)),
+            "mantenimiento": self.planificador.en_proceso(ProcesoMantenimientoBaseDatos),
+            "archivo_ventas": ServicioArchivoVentas().archivar,
+        }
+        for nombre, funcion in trabajos.items():
+            parametros = {**self.PROGRAMACION[nombre], **(programacion or {}).get(nombre, {})}
+            self.planificador.agregar(nombre, funcion, **parametros)
         self.simulador = None
+
+    def _ventas_realizadas(self) -> int:
+        #Contador creciente de ventas para que el planificador mida la carga: las de este
+        #proceso (cualquier camino de venta) más las de los procesos de compras
+        total = ventas_realizadas()
+        if self.pool_compras is not None:
+            total += self.pool_compras.totales["exitosas"]
+        return total
     
-    def iniciar_concurrencia(self, gestor_ventas=None):
-        #Inicia todos los hilos y procesos concurrentes
+    def iniciar_concurrencia(self, gestor_ventas=None, coordinador=None):
+        #Inicia los hilos, el planificador y, si corresponde, los procesos de compras
         for hilo in self.hilos:
             hilo.start()
-        for proceso in self.procesos:
-            proceso.start()
+        self.reservas.iniciar()
+        self.planificador.iniciar()
+        if self.pool_compras is not None:
+            self.pool_compras.iniciar()
         # Iniciar simulador si se pasa gestor_ventas
         if gestor_ventas is not None:
-            self.simulador = HiloSimuladorComprasConcurrentes(gestor_ventas, intervalo_min=30, intervalo_max=45)
+            self.simulador = HiloSimuladorComprasConcurrentes(
+                gestor_ventas, intervalo_min=30, intervalo_max=45, coordinador=coordinador
+            )
             self.simulador.start()
     
     def detener_concurrencia(self):
-        #Detiene todos los hilos y procesos concurrentes
+        #Detiene todos los hilos y procesos concurrentes. Quien compra a través de la cola
+        #(el simulador, y el servidor, que se detiene antes) termina antes de cerrarla
+        if self.simulador:
+            self.simulador.detener()
+            self.simulador.join()
+        self.planificador.detener()
+        self.reservas.detener()
+        if self.pool_compras is not None:
+            self.pool_compras.detener()
+        # Primero se vuelcan las ventas pendientes a la base
+        self.procesador_ventas.detener()
+        self.cola_ventas.cerrar()
         for hilo in self.hilos:
             hilo.activo = False
             hilo.join()
-        for proceso in self.procesos:
-            proceso.terminate()
-            proceso.join()
-        if self.simulador:
-            self.simulador.activo = False
-            self.simulador.join()
-        
-
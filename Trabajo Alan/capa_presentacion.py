@@ -1,18 +1,28 @@
 # Capa de presentación e interfaz de usuario del sistema de venta de boletos
 
-from capa_logica import GestorEventos, GestorVentas, GestorConcurrencia, compra_lock
+from capa_logica import GestorEventos, GestorVentas, GestorConcurrencia, CoordinadorCompras, ControlAdmision
+from capa_servidor import ServidorCompras, ClienteCompras, ErrorServidor
 
 
 class InterfazUsuario:
     #Clase principal para manejar la interfaz de usuario del sistema
     
-    def __init__(self):
-        self.gestor_eventos = GestorEventos()
-        self.gestor_ventas = GestorVentas()
+    def __init__(self, puerto: int = 0):
         self.gestor_concurrencia = GestorConcurrencia()
+        self.gestor_eventos = GestorEventos()
+        self.gestor_ventas = GestorVentas(self.gestor_concurrencia.cola_ventas)
+        self.coordinador_compras = CoordinadorCompras(self.gestor_ventas)
         
         # Inicia la concurrencia y el simulador de compras
-        self.gestor_concurrencia.iniciar_concurrencia(self.gestor_ventas)
+        self.gestor_concurrencia.iniciar_concurrencia(self.gestor_ventas, self.coordinador_compras)
+
+        # El menú es un cliente más del servidor de compras (puerto 0: uno libre cualquiera)
+        self.servidor = ServidorCompras(
+            self.gestor_eventos, ControlAdmision(self.coordinador_compras), puerto=puerto,
+            reservas=self.gestor_concurrencia.reservas
+        )
+        self.servidor.iniciar_en_hilo()
+        self.cliente = ClienteCompras(puerto=self.servidor.puerto)
 
     def mostrar_menu_principal(self) -> None:
         print("\n--- MENÚ SISTEMA DE VENTA DE BOLETOS ---")
@@ -31,9 +41,11 @@ class InterfazUsuario:
             precio = float(input("Precio por boleto: $"))
             disponibles = int(input("Cantidad de boletos disponibles: "))
             
-            self.gestor_eventos.crear_evento(nombre, fecha, lugar, precio, disponibles)
+            self.cliente.crear_evento(nombre, fecha, lugar, precio, disponibles)
             print("✓ Evento agregado exitosamente.")
             
+        except ErrorServidor as error:
+            print(f"\n✗ Error: {error}")
         except ValueError:
             print("\n✗ Error: Ingresa valores numéricos válidos.")
         except Exception as error:
@@ -41,14 +53,14 @@ class InterfazUsuario:
 
     def listar_eventos(self) -> None:
         print("\n--- EVENTOS DISPONIBLES ---")
-        eventos = self.gestor_eventos.obtener_eventos()
+        eventos = self.cliente.obtener_eventos()
         
         if not eventos:
             print("No hay eventos registrados en el sistema.")
             return
             
         for evento in eventos:
-            disponibles = evento.boletos_disponibles - evento.boletos_vendidos
+            disponibles = evento.restantes
             print(f"ID {evento.id}: {evento.nombre}")
             print(f"  Fecha: {evento.fecha} | Lugar: {evento.lugar}")
             print(f"  Precio: ${evento.precio:.2f} | Boletos disponibles: {disponibles}")
@@ -57,51 +69,62 @@ class InterfazUsuario:
     def comprar_boletos(self) -> None:
         print("\n--- COMPRAR BOLETOS ---")
         
-        eventos = self.gestor_eventos.obtener_eventos()
+        eventos = self.cliente.obtener_eventos()
         if not eventos:
             print("No hay eventos disponibles para comprar boletos.")
             return
             
         print("Eventos disponibles:")
         for evento in eventos:
-            disponibles = evento.boletos_disponibles - evento.boletos_vendidos
+            disponibles = evento.restantes
             if disponibles > 0:
                 print(f"  ID {evento.id}: {evento.nombre} - ${evento.precio:.2f} - Disponibles: {disponibles}")
         
+        retencion_id = None
         try:
             evento_id = int(input("\nID del evento: "))
-            cliente = input("Nombre del cliente: ").strip()
-            gmail = input("Correo electrónico del cliente: ").strip()
             cantidad = int(input("Cantidad de boletos a comprar: "))
-            print("Intentando comprar boletos...")
-            # Intentar adquirir el lock (espera si está ocupado)
-            if not compra_lock.acquire(blocking=False):
-                print("Hay otras personas comprando en este momento. Por favor espere...")
-                compra_lock.acquire()
-            try:
-                exito, mensaje = self.gestor_ventas.vender_boletos(evento_id, cliente, gmail, cantidad)
-                if exito:
-                    print(mensaje)
-                else:
-                    print(f"\n✗ ADVERTENCIA: {mensaje}\n")
-            finally:
-                compra_lock.release()
+            gmail = input("Correo electrónico del cliente: ").strip()
+            # Los boletos quedan apartados mientras se completan los datos del cliente;
+            # el pedido pasa por la sala de espera como cualquier compra
+            resultado = self.cliente.retener(evento_id, gmail, cantidad)
+            if not resultado.exito:
+                print(f"\n✗ ADVERTENCIA: {resultado.mensaje}\n")
+                return
+            retencion_id = resultado.retencion_id
+            print(f"✓ {resultado.mensaje}")
+            cliente = input("Nombre del cliente: ").strip()
+            print("Confirmando compra...")
+            exito, mensaje = self.cliente.confirmar(retencion_id, cliente, gmail)
+            retencion_id = None
+            if exito:
+                print(mensaje)
+            else:
+                print(f"\n✗ ADVERTENCIA: {mensaje}\n")
                 
+        except ErrorServidor as error:
+            print(f"\n✗ Error: {error}")
         except ValueError:
             print("\n✗ Error: Ingresa valores numéricos válidos.")
         except Exception as error:
             print(f"\n✗ Error: {str(error)}")
+        finally:
+            # Si la compra no llegó a confirmarse se devuelven los boletos sin esperar al vencimiento
+            if retencion_id is not None:
+                try:
+                    self.cliente.liberar(retencion_id)
+                except Exception:
+                    pass
 
-    def mostrar_historial_ventas(self) -> None:
+    def mostrar_historial_ventas(self, ventas_por_pagina: int = 20) -> None:
         print("\n--- HISTORIAL DE VENTAS ---")
         from capa_datos import RepositorioVentas
-        ventas = RepositorioVentas().listar_ventas()
-        
-        if not ventas:
-            print("No hay ventas registradas en el sistema.")
-            return
-            
-        for venta in ventas:
+        # Se recorre el historial por páginas en lugar de cargarlo completo
+        mostradas = 0
+        for venta in RepositorioVentas().iterar_ventas(tamano_pagina=ventas_por_pagina):
+            if mostradas and mostradas % ventas_por_pagina == 0:
+                if input("Enter para ver más, 'q' para volver: ").strip().lower() == "q":
+                    return
             print(f"Venta #{venta.id}")
             print(f"  Evento ID: {venta.evento_id}")
             print(f"  Cliente: {venta.cliente} ({venta.gmail})")
@@ -109,6 +132,10 @@ class InterfazUsuario:
             print(f"  Total: ${venta.total:.2f}")
             print(f"  Fecha: {venta.fecha_venta}")
             print()
+            mostradas += 1
+        
+        if not mostradas:
+            print("No hay ventas registradas en el sistema.")
 
     def ejecutar(self) -> None:
         
@@ -127,6 +154,8 @@ class InterfazUsuario:
             elif opcion == "5":
                 print("\nDeteniendo sistema...")
                 try:
+                    self.cliente.cerrar()
+                    self.servidor.detener()
                     self.gestor_concurrencia.detener_concurrencia()
                 except:
                     pass
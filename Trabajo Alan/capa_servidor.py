@@ -0,0 +1,354 @@
+# Servidor asíncrono de pedidos del sistema de venta de boletos
+
+import asyncio
+import json
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from capa_datos import Evento, RepositorioReportes
+from metricas import metricas
+from capa_logica import (
+    GestorEventos, GestorVentas, GestorConcurrencia, GestorReservas, CoordinadorCompras, PoolProcesosCompras,
+    ControlAdmision, ResultadoCompra
+)
+
+
+class ErrorServidor(Exception):
+    """Error informado por el servidor al atender un pedido (el texto es el mensaje del servidor)"""
+
+
+CAMPOS_EVENTO = (
+    "id", "nombre", "fecha", "lugar", "precio", "boletos_disponibles", "boletos_vendidos", "boletos_retenidos"
+)
+
+
+class ServidorCompras:
+    """Servidor asyncio con un protocolo de líneas JSON.
+
+    Cada línea es un pedido {"id": ..., "accion": ..., ...} y se responde con
+    {"id": ..., "ok": ..., "resultado" | "error": ..., "latencia_ms": ...}.
+    Una conexión puede enviar varios pedidos sin esperar las respuestas; las
+    respuestas llegan a medida que terminan y se asocian por "id". El trabajo
+    con SQLite se hace en un ThreadPoolExecutor acotado y la cantidad de
+    pedidos en curso está limitada para no acumular trabajo sin fin.
+    Con un GestorReservas se habilitan retener, confirmar y liberar.
+    """
+
+    def __init__(
+        self,
+        gestor_eventos: GestorEventos,
+        coordinador: CoordinadorCompras | PoolProcesosCompras | ControlAdmision,
+        host: str = "127.0.0.1",
+        puerto: int = 8765,
+        ruta_unix: str | None = None,
+        max_hilos: int = 8,
+        max_en_curso: int = 1000,
+        reservas: GestorReservas | None = None
+    ):
+        self.gestor_eventos = gestor_eventos
+        self.coordinador = coordinador
+        self.reservas = reservas
+        self.host = host
+        self.puerto = puerto
+        self.ruta_unix = ruta_unix
+        self.max_en_curso = max_en_curso
+        self._executor = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="servidor-compras")
+        self._latencias = deque(maxlen=10000)
+        self._atendidos = 0
+        self._servidor = None
+        self._bucle = None
+        self._hilo = None
+        self._listo = threading.Event()
+        self._error_inicio = None
+        self._cupo = None
+        self._parar = None
+        self._conexiones = set()
+        self._acciones = {
+            "listar_eventos": self._listar_eventos,
+            "comprar": self._comprar,
+            "crear_evento": self._crear_evento,
+            "estadisticas": self._estadisticas,
+            "metricas": self._metricas,
+            "distribucion_ventas": self._distribucion_ventas,
+            "sala_espera": self._sala_espera,
+        }
+        if reservas is not None:
+            self._acciones.update({
+                "retener": self._retener,
+                "confirmar": self._confirmar,
+                "liberar": self._liberar,
+            })
+
+    def _listar_eventos(self, pedido: dict):
+        return [
+            {campo: getattr(evento, campo) for campo in CAMPOS_EVENTO}
+            for evento in self.gestor_eventos.obtener_eventos()
+        ]
+
+    def _comprar(self, pedido: dict):
+        resultado = self.coordinador.comprar(
+            int(pedido["evento_id"]), pedido["cliente"], pedido["gmail"], int(pedido["cantidad"]),
+            clave=pedido.get("clave")
+        )
+        return {
+            "exito": resultado.exito,
+            "mensaje": resultado.mensaje,
+            "reintentar": resultado.reintentar,
+            "posicion": resultado.posicion,
+            "espera_estimada": resultado.espera_estimada,
+        }
+
+    def _retener(self, pedido: dict):
+        #Con sala de espera, las retenciones hacen la misma fila que las compras
+        evento_id, cantidad = int(pedido["evento_id"]), int(pedido["cantidad"])
+        if isinstance(self.coordinador, ControlAdmision):
+            resultado = self.coordinador.retener(self.reservas, evento_id, pedido["gmail"], cantidad)
+        else:
+            exito, mensaje, retencion_id = self.reservas.retener(evento_id, cantidad)
+            resultado = ResultadoCompra(exito, mensaje, retencion_id=retencion_id)
+        return {
+            "exito": resultado.exito,
+            "mensaje": resultado.mensaje,
+            "retencion_id": resultado.retencion_id,
+            "reintentar": resultado.reintentar,
+            "posicion": resultado.posicion,
+            "espera_estimada": resultado.espera_estimada,
+        }
+
+    def _confirmar(self, pedido: dict):
+        exito, mensaje = self.reservas.confirmar(int(pedido["retencion_id"]), pedido["cliente"], pedido["gmail"])
+        return {"exito": exito, "mensaje": mensaje}
+
+    def _liberar(self, pedido: dict):
+        return self.reservas.liberar(int(pedido["retencion_id"]))
+
+    def _crear_evento(self, pedido: dict):
+        self.gestor_eventos.crear_evento(
+            pedido["nombre"], pedido["fecha"], pedido["lugar"],
+            float(pedido["precio"]), int(pedido["disponibles"])
+        )
+        return None
+
+    def _estadisticas(self, pedido: dict):
+        latencias = sorted(self._latencias)
+        def percentil(p):
+            return latencias[min(len(latencias) - 1, int(p * len(latencias)))] if latencias else 0.0
+        return {
+            "atendidos": self._atendidos,
+            "p50_ms": percentil(0.50),
+            "p95_ms": percentil(0.95),
+            "p99_ms": percentil(0.99),
+        }
+
+    def _metricas(self, pedido: dict):
+        return metricas.instantanea()
+
+    def _distribucion_ventas(self, pedido: dict):
+        #A demanda: recorre las ventas recientes, por eso no está en el reporte programado
+        return RepositorioReportes().distribucion_ventas(int(pedido.get("horas", 24)))
+
+    def _sala_espera(self, pedido: dict):
+        estado = getattr(self.coordinador, "estado", None)
+        return estado() if estado is not None else None
+
+    async def _atender(self, linea: bytes, escritor: asyncio.StreamWriter, lock_escritura: asyncio.Lock, cupo: asyncio.Semaphore) -> None:
+        inicio = time.perf_counter()
+        respuesta = {"id": None, "ok": False}
+        try:
+            pedido = json.loads(linea)
+            respuesta["id"] = pedido.get("id")
+            accion = self._acciones.get(pedido.get("accion"))
+            if accion is None:
+                raise ValueError(f"Acción desconocida: {pedido.get('accion')}")
+            bucle = asyncio.get_running_loop()
+            respuesta["resultado"] = await bucle.run_in_executor(self._executor, accion, pedido)
+            respuesta["ok"] = True
+        except Exception as error:
+            respuesta["error"] = str(error)
+        finally:
+            cupo.release()
+        latencia = (time.perf_counter() - inicio) * 1000
+        respuesta["latencia_ms"] = round(latencia, 3)
+        self._latencias.append(latencia)
+        metricas.observar("servidor.pedido", latencia)
+        self._atendidos += 1
+        async with lock_escritura:
+            escritor.write(json.dumps(respuesta, ensure_ascii=False).encode("utf-8") + b"\n")
+            await escritor.drain()
+
+    async def _conexion(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter) -> None:
+        lock_escritura = asyncio.Lock()
+        tareas = set()
+        self._conexiones.add(asyncio.current_task())
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                if not linea.strip():
+                    continue
+                # Si hay demasiados pedidos en curso se deja de leer (contrapresión TCP)
+                await self._cupo.acquire()
+                tarea = asyncio.create_task(self._atender(linea, escritor, lock_escritura, self._cupo))
+                tareas.add(tarea)
+                tarea.add_done_callback(tareas.discard)
+            if tareas:
+                await asyncio.gather(*tareas, return_exceptions=True)
+        except (ConnectionError, asyncio.CancelledError):
+            # Cliente desconectado o servidor deteniéndose
+            pass
+        finally:
+            self._conexiones.discard(asyncio.current_task())
+            escritor.close()
+
+    async def iniciar(self) -> None:
+        self._bucle = asyncio.get_running_loop()
+        self._cupo = asyncio.Semaphore(self.max_en_curso)
+        self._parar = asyncio.Event()
+        if self.ruta_unix:
+            self._servidor = await asyncio.start_unix_server(self._conexion, path=self.ruta_unix)
+        else:
+            self._servidor = await asyncio.start_server(self._conexion, self.host, self.puerto)
+            self.puerto = self._servidor.sockets[0].getsockname()[1]
+        self._listo.set()
+
+    async def servir(self) -> None:
+        await self.iniciar()
+        async with self._servidor:
+            await self._parar.wait()
+        for tarea in list(self._conexiones):
+            tarea.cancel()
+        await asyncio.gather(*self._conexiones, return_exceptions=True)
+
+    def iniciar_en_hilo(self) -> None:
+        """Arranca el servidor en un hilo propio y espera a que acepte conexiones"""
+        def ejecutar():
+            try:
+                asyncio.run(self.servir())
+            except Exception as error:
+                self._error_inicio = error
+                self._listo.set()
+        self._hilo = threading.Thread(target=ejecutar, daemon=True, name="servidor-compras")
+        self._hilo.start()
+        if not self._listo.wait(10) or self._error_inicio is not None:
+            raise RuntimeError(f"El servidor de compras no pudo iniciarse: {self._error_inicio}")
+
+    def detener(self) -> None:
+        #Deja de aceptar pedidos y espera a los que están en el executor
+        if self._parar is not None and self._bucle is not None and not self._bucle.is_closed():
+            self._bucle.call_soon_threadsafe(self._parar.set)
+        if self._hilo is not None:
+            self._hilo.join(5)
+        self._executor.shutdown(wait=True)
+
+
+class ClienteCompras:
+    """Cliente sincrónico del ServidorCompras con la misma interfaz que usa el menú"""
+
+    def __init__(self, host: str = "127.0.0.1", puerto: int = 8765, ruta_unix: str | None = None, timeout: float = 30.0):
+        if ruta_unix:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(ruta_unix)
+        else:
+            self._socket = socket.create_connection((host, puerto))
+        self._socket.settimeout(timeout)
+        self._archivo = self._socket.makefile("rwb")
+        self._lock = threading.Lock()
+        self._siguiente_id = 0
+        self.ultima_latencia_ms = None
+
+    def _pedir(self, accion: str, **datos):
+        with self._lock:
+            self._siguiente_id += 1
+            pedido = {"id": self._siguiente_id, "accion": accion, **datos}
+            self._archivo.write(json.dumps(pedido, ensure_ascii=False).encode("utf-8") + b"\n")
+            self._archivo.flush()
+            linea = self._archivo.readline()
+        if not linea:
+            raise ConnectionError("El servidor cerró la conexión")
+        respuesta = json.loads(linea)
+        self.ultima_latencia_ms = respuesta.get("latencia_ms")
+        if not respuesta["ok"]:
+            raise ErrorServidor(respuesta.get("error", "Error desconocido"))
+        return respuesta.get("resultado")
+
+    def obtener_eventos(self) -> list[Evento]:
+        return [Evento(**datos) for datos in self._pedir("listar_eventos")]
+
+    def comprar(self, evento_id: int, cliente: str, gmail: str, cantidad: int, clave: str | None = None) -> ResultadoCompra:
+        #Con clave, reenviar el mismo pedido (por ejemplo tras un timeout) no compra dos veces
+        resultado = self._pedir(
+            "comprar", evento_id=evento_id, cliente=cliente, gmail=gmail, cantidad=cantidad, clave=clave
+        )
+        return ResultadoCompra(
+            resultado["exito"], resultado["mensaje"], resultado["reintentar"],
+            posicion=resultado.get("posicion"), espera_estimada=resultado.get("espera_estimada")
+        )
+
+    def retener(self, evento_id: int, gmail: str, cantidad: int) -> ResultadoCompra:
+        #El gmail identifica al cliente en los límites de la sala de espera
+        resultado = self._pedir("retener", evento_id=evento_id, gmail=gmail, cantidad=cantidad)
+        return ResultadoCompra(
+            resultado["exito"], resultado["mensaje"], resultado["reintentar"],
+            posicion=resultado.get("posicion"), espera_estimada=resultado.get("espera_estimada"),
+            retencion_id=resultado["retencion_id"]
+        )
+
+    def confirmar(self, retencion_id: int, cliente: str, gmail: str) -> tuple[bool, str]:
+        resultado = self._pedir("confirmar", retencion_id=retencion_id, cliente=cliente, gmail=gmail)
+        return resultado["exito"], resultado["mensaje"]
+
+    def liberar(self, retencion_id: int) -> bool:
+        return self._pedir("liberar", retencion_id=retencion_id)
+
+    def crear_evento(self, nombre: str, fecha: str, lugar: str, precio: float, disponibles: int) -> None:
+        self._pedir("crear_evento", nombre=nombre, fecha=fecha, lugar=lugar, precio=precio, disponibles=disponibles)
+
+    def estadisticas(self) -> dict:
+        return self._pedir("estadisticas")
+
+    def metricas(self) -> dict:
+        return self._pedir("metricas")
+
+    def distribucion_ventas(self, horas: int = 24) -> dict:
+        return self._pedir("distribucion_ventas", horas=horas)
+
+    def sala_espera(self) -> dict | None:
+        return self._pedir("sala_espera")
+
+    def cerrar(self) -> None:
+        self._archivo.close()
+        self._socket.close()
+
+
+def main():
+    #Ejecuta sólo el servidor (sin menú): python capa_servidor.py [puerto] [procesos_compra]
+    #Con procesos_compra > 0 las compras se reparten entre procesos de trabajo
+    import sys
+    puerto = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    procesos_compra = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    gestor_concurrencia = GestorConcurrencia(procesos_compra)
+    gestor_ventas = GestorVentas(gestor_concurrencia.cola_ventas)
+    coordinador = gestor_concurrencia.pool_compras or CoordinadorCompras(gestor_ventas)
+    # Las compras que llegan por la red pasan por la sala de espera
+    admision = ControlAdmision(coordinador, max_en_curso=max(4, procesos_compra))
+    gestor_concurrencia.iniciar_concurrencia()
+    servidor = ServidorCompras(
+        GestorEventos(), admision, puerto=puerto, max_hilos=max(8, procesos_compra * 4),
+        reservas=gestor_concurrencia.reservas
+    )
+    print(f"Servidor de compras escuchando en 127.0.0.1:{puerto}")
+    try:
+        asyncio.run(servidor.servir())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.detener()
+        gestor_concurrencia.detener_concurrencia()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# Métricas internas del sistema de venta de boletos
+#
+# Contadores, medidores e histogramas de latencia en memoria y sin dependencias
+# externas. Todo el sistema usa el registro compartido `metricas`; con
+# metricas.activo = False (o la variable de entorno BOLETOS_METRICAS=0) cada
+# llamada se reduce a leer un atributo y volver.
+#
+#   metricas.incrementar("compras.exitosas")
+#   with metricas.medir("bd.transaccion"):
+#       ...
+#   @metricas.cronometrar("bd.reservar_boletos")
+#   def reservar_boletos(...): ...
+#
+# Los valores se exponen con instantanea() (dict), texto() (una línea por
+# serie, formato de texto de Prometheus), volcar(ruta) (JSON atómico) o por
+# HTTP con servir_http(puerto). Cada proceso tiene su propio registro.
+
+import bisect
+import json
+import os
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+#Límites superiores (en milisegundos) de las cubetas de los histogramas
+LIMITES_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class Histograma:
+    #Histograma de latencias con cubetas fijas: observar es O(log cubetas) y la memoria
+    #no crece con la cantidad de observaciones. Los percentiles son aproximados
+    #(límite superior de la cubeta que los contiene).
+
+    def __init__(self):
+        self.cubetas = [0] * (len(LIMITES_MS) + 1)
+        self.cantidad = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+        self._lock = threading.Lock()
+
+    def observar(self, ms: float) -> None:
+        indice = bisect.bisect_left(LIMITES_MS, ms)
+        with self._lock:
+            self.cubetas[indice] += 1
+            self.cantidad += 1
+            self.suma += ms
+            if ms > self.maximo:
+                self.maximo = ms
+
+    def percentil(self, p: float) -> float:
+        objetivo = p * self.cantidad
+        acumulado = 0
+        for indice, cantidad in enumerate(self.cubetas):
+            acumulado += cantidad
+            if cantidad and acumulado >= objetivo:
+                limite = min(LIMITES_MS[indice], self.maximo) if indice < len(LIMITES_MS) else self.maximo
+                return round(limite, 3)
+        return 0.0
+
+    def resumen(self) -> dict:
+        with self._lock:
+            return {
+                "cantidad": self.cantidad,
+                "suma_ms": round(self.suma, 3),
+                "media_ms": round(self.suma / self.cantidad, 3) if self.cantidad else 0.0,
+                "p50_ms": self.percentil(0.50),
+                "p95_ms": self.percentil(0.95),
+                "p99_ms": self.percentil(0.99),
+                "max_ms": round(self.maximo, 3),
+                "cubetas": {
+                    str(limite): cantidad
+                    for limite, cantidad in zip(LIMITES_MS + ("+Inf",), self.cubetas)
+                    if cantidad
+                },
+            }
+
+
+class _Cronometro:
+    #Context manager de medir(): observa la duración y cuenta los errores
+    __slots__ = ("registro", "nombre", "inicio")
+
+    def __init__(self, registro, nombre: str):
+        self.registro = registro
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self.registro.observar(self.nombre, (time.perf_counter() - self.inicio) * 1000)
+        if tipo is not None:
+            self.registro.incrementar(f"{self.nombre}.errores")
+        return False
+
+
+class _SinMedir:
+    #Context manager vacío para cuando las métricas están desactivadas
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        return False
+
+
+_SIN_MEDIR = _SinMedir()
+
+
+class RegistroMetricas:
+    """Registro de métricas de un proceso.
+
+    Los contadores sólo suben, los medidores guardan el último valor (o se
+    calculan al leerlos con registrar_medidor) y los histogramas acumulan
+    latencias en milisegundos. Los nombres usan puntos como separador
+    ("bd.reservar_boletos", "hilos.sincronizador").
+    """
+
+    def __init__(self, activo: bool = True):
+        self.activo = activo
+        self.iniciado_en = time.time()
+        self._lock = threading.Lock()
+        self._contadores = {}
+        self._medidores = {}
+        self._funciones = {}
+        self._histogramas = {}
+
+    def incrementar(self, nombre: str, valor: int = 1) -> None:
+        if not self.activo:
+            return
+        with self._lock:
+            self._contadores[nombre] = self._contadores.get(nombre, 0) + valor
+
+    def fijar(self, nombre: str, valor: float) -> None:
+        if not self.activo:
+            return
+        self._medidores[nombre] = valor
+
+    def registrar_medidor(self, nombre: str, funcion) -> None:
+        #El valor se calcula al leer las métricas, sin costo en el camino caliente
+        self._funciones[nombre] = funcion
+
+    def observar(self, nombre: str, ms: float) -> None:
+        if not self.activo:
+            return
+        histograma = self._histogramas.get(nombre)
+        if histograma is None:
+            with self._lock:
+                histograma = self._histogramas.setdefault(nombre, Histograma())
+        histograma.observar(ms)
+
+    def medir(self, nombre: str):
+        #with metricas.medir("nombre"): observa la duración del bloque
+        if not self.activo:
+            return _SIN_MEDIR
+        return _Cronometro(self, nombre)
+
+    def cronometrar(self, nombre: str):
+        #Decorador equivalente a envolver el cuerpo de la función en medir(nombre)
+        def decorador(funcion):
+            @wraps(funcion)
+            def envoltura(*args, **kwargs):
+                if not self.activo:
+                    return funcion(*args, **kwargs)
+                inicio = time.perf_counter()
+                try:
+                    return funcion(*args, **kwargs)
+                except BaseException:
+                    self.incrementar(f"{nombre}.errores")
+                    raise
+                finally:
+                    self.observar(nombre, (time.perf_counter() - inicio) * 1000)
+            return envoltura
+        return decorador
+
+    def instantanea(self) -> dict:
+        medidores = dict(self._medidores)
+        for nombre, funcion in list(self._funciones.items()):
+            try:
+                medidores[nombre] = funcion()
+            except Exception:
+                medidores[nombre] = None
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = list(self._histogramas.items())
+        return {
+            "pid": os.getpid(),
+            "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "segundos_activo": round(time.time() - self.iniciado_en, 1),
+            "activo": self.activo,
+            "contadores": contadores,
+            "medidores": medidores,
+            "histogramas": {nombre: histograma.resumen() for nombre, histograma in sorted(histogramas)},
+        }
+
+    def texto(self) -> str:
+        #Una línea por serie; los nombres se normalizan al formato de Prometheus
+        def serie(nombre):
+            return "boletos_" + "".join(c if c.isalnum() else "_" for c in nombre)
+
+        datos = self.instantanea()
+        lineas = []
+        for nombre, valor in sorted(datos["contadores"].items()):
+            lineas.append(f"{serie(nombre)}_total {valor}")
+        for nombre, valor in sorted(datos["medidores"].items()):
+            if isinstance(valor, (int, float)):
+                lineas.append(f"{serie(nombre)} {valor}")
+        for nombre, resumen in datos["histogramas"].items():
+            base = serie(nombre) + "_ms"
+            for cuantil in ("p50", "p95", "p99"):
+                lineas.append(f'{base}{{quantile="0.{cuantil[1:]}"}} {resumen[cuantil + "_ms"]}')
+            lineas.append(f"{base}_sum {resumen['suma_ms']}")
+            lineas.append(f"{base}_count {resumen['cantidad']}")
+        return "\n".join(lineas) + "\n"
+
+    def volcar(self, ruta: str) -> None:
+        #Escritura atómica: quien lea el archivo nunca ve un JSON a medio escribir
+        temporal = f"{ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump(self.instantanea(), archivo, ensure_ascii=False, indent=2)
+        os.replace(temporal, ruta)
+
+    def reiniciar(self) -> None:
+        #Descarta los valores acumulados (por ejemplo, los heredados al crear un proceso)
+        with self._lock:
+            self._contadores.clear()
+            self._medidores.clear()
+            self._histogramas.clear()
+        self.iniciado_en = time.time()
+
+
+metricas = RegistroMetricas(activo=os.environ.get("BOLETOS_METRICAS", "1") != "0")
+
+
+def servir_http(puerto: int, host: str = "127.0.0.1", registro: RegistroMetricas = metricas) -> ThreadingHTTPServer:
+    """Expone las métricas por HTTP en un hilo propio y devuelve el servidor.
+
+    GET /metricas devuelve texto (una serie por línea) y GET /metricas.json
+    la instantánea completa. Para detenerlo: servidor.shutdown().
+    """
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metricas.json"):
+                cuerpo = json.dumps(registro.instantanea(), ensure_ascii=False).encode("utf-8")
+                tipo = "application/json; charset=utf-8"
+            elif self.path.startswith("/metricas") or self.path == "/":
+                cuerpo = registro.texto().encode("utf-8")
+                tipo = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, formato, *args):
+            #Sin una línea en consola por cada consulta
+            pass
+
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True, name="metricas-http").start()
+    return servidor
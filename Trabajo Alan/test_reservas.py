@@ -0,0 +1,148 @@
+# Pruebas de regresión de las reservas con vencimiento
+#
+#   python -m unittest test_reservas
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from capa_datos import RepositorioEventos, configurar_base_datos
+from capa_logica import GestorEventos, GestorReservas, RuedaTemporizadores
+
+
+class PruebasRueda(unittest.TestCase):
+
+    def setUp(self):
+        self.ahora = time.time()
+        self.rueda = RuedaTemporizadores(resolucion=1.0, ranuras=8)
+
+    def test_devuelve_sólo_las_vencidas(self):
+        self.rueda.agregar("a", self.ahora + 2)
+        self.rueda.agregar("b", self.ahora + 5)
+        self.assertEqual(self.rueda.avanzar(self.ahora + 3), ["a"])
+        self.assertEqual(self.rueda.avanzar(self.ahora + 6), ["b"])
+        self.assertEqual(len(self.rueda), 0)
+
+    def test_cancelar(self):
+        self.rueda.agregar("a", self.ahora + 2)
+        self.assertTrue(self.rueda.cancelar("a"))
+        self.assertFalse(self.rueda.cancelar("a"))
+        self.assertEqual(self.rueda.avanzar(self.ahora + 3), [])
+
+    def test_clave_a_más_de_una_vuelta(self):
+        #Comparte ranura con el tic ahora+3 pero vence una vuelta (8 tics) después
+        self.rueda.agregar("lejos", self.ahora + 11)
+        self.assertEqual(self.rueda.avanzar(self.ahora + 4), [])
+        self.assertEqual(self.rueda.avanzar(self.ahora + 12), ["lejos"])
+
+    def test_ya_vencida_sale_en_el_próximo_tic(self):
+        self.rueda.agregar("vieja", self.ahora - 100)
+        self.assertEqual(self.rueda.avanzar(self.ahora + 1), ["vieja"])
+
+
+class PruebasReservas(unittest.TestCase):
+    #Base temporal con un evento de 10 boletos
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.db_original = RepositorioEventos.DB
+        configurar_base_datos(os.path.join(self.directorio, "reservas.db"))
+        GestorEventos().crear_evento("Prueba", "2099-01-01", "Sala", 100.0, 10)
+        self.evento_id = RepositorioEventos().listar_eventos()[0].id
+        self.reservas = GestorReservas(ttl=60)
+
+    def tearDown(self):
+        self.reservas.detener()
+        configurar_base_datos(self.db_original)
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def contadores(self) -> tuple:
+        evento = RepositorioEventos().obtener_evento_por_id(self.evento_id)
+        return evento.boletos_vendidos, evento.boletos_retenidos
+
+    def esperar_liberadas(self, limite: float = 3.0) -> None:
+        fin = time.time() + limite
+        while self.contadores()[1] and time.time() < fin:
+            time.sleep(0.02)
+
+
+class PruebasConfirmacion(PruebasReservas):
+
+    def test_retenciones_confirmadas_una_tras_otra(self):
+        #Cada confirmación borra su retención; la siguiente no puede reutilizar el id
+        #(ni su clave de idempotencia) y tiene que registrar una venta propia
+        ids = []
+        for _ in range(3):
+            exito, _, retencion_id = self.reservas.retener(self.evento_id, 1)
+            self.assertTrue(exito)
+            ids.append(retencion_id)
+            exito, mensaje = self.reservas.confirmar(retencion_id, "Cliente", "cliente@gmail.com")
+            self.assertTrue(exito, mensaje)
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(self.contadores(), (3, 0))
+
+    def test_confirmar_retencion_ya_confirmada_no_vende_otra_vez(self):
+        _, _, primera = self.reservas.retener(self.evento_id, 1)
+        self.reservas.confirmar(primera, "Cliente", "cliente@gmail.com")
+        _, _, segunda = self.reservas.retener(self.evento_id, 2)
+        self.assertNotEqual(primera, segunda)
+        exito, _ = self.reservas.confirmar(primera, "Cliente", "cliente@gmail.com")
+        self.assertTrue(exito)
+        self.assertEqual(self.contadores(), (1, 2))
+
+
+class PruebasVencimiento(PruebasReservas):
+
+    def setUp(self):
+        super().setUp()
+        self.reservas = GestorReservas(ttl=0.1, resolucion=0.05)
+
+    def test_el_hilo_libera_las_vencidas(self):
+        self.reservas.iniciar()
+        _, _, retencion_id = self.reservas.retener(self.evento_id, 3)
+        self.esperar_liberadas()
+        self.assertEqual(self.contadores(), (0, 0))
+        exito, _ = self.reservas.confirmar(retencion_id, "Cliente", "cliente@gmail.com")
+        self.assertFalse(exito)
+
+    def test_recuperar_libera_las_vencidas_con_el_sistema_detenido(self):
+        self.reservas.retener(self.evento_id, 2)
+        time.sleep(0.15)
+        self.assertEqual(GestorReservas(ttl=60).recuperar(), 1)
+        self.assertEqual(self.contadores(), (0, 0))
+
+    def test_devuelve_los_asientos(self):
+        GestorEventos().crear_mapa_asientos(self.evento_id, [("Platea", 1, 10, 1)])
+        self.reservas.iniciar()
+        self.reservas.retener(self.evento_id, 6)
+        self.esperar_liberadas()
+        self.assertEqual(self.contadores(), (0, 0))
+        exito, mensaje, _ = self.reservas.retener(self.evento_id, 10)
+        self.assertTrue(exito, mensaje)
+
+    def test_no_cambia_el_mapa_con_boletos_reservados(self):
+        self.reservas.ttl = 60
+        self.reservas.retener(self.evento_id, 1)
+        with self.assertRaises(ValueError):
+            GestorEventos().crear_mapa_asientos(self.evento_id, [("Platea", 2, 5, 1)])
+
+    def test_un_error_al_liberar_reprograma_las_vencidas(self):
+        vencer = self.reservas._vencer
+        fallas = [sqlite3.OperationalError("database is locked")]
+        def vencer_con_falla(ids, ahora):
+            if fallas:
+                raise fallas.pop()
+            return vencer(ids, ahora)
+        self.reservas._vencer = vencer_con_falla
+        self.reservas.iniciar()
+        self.reservas.retener(self.evento_id, 4)
+        self.esperar_liberadas()
+        self.assertFalse(fallas)
+        self.assertEqual(self.contadores(), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()